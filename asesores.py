@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
 from models import get_db, Usuario, Cliente
 from utils import get_current_user, require_supervisor
+from etags import incrementar_version_datos
 
 router = APIRouter(prefix="/asesores", tags=["asesores"])
 
@@ -21,20 +23,26 @@ class ClienteAsignacionRequest(BaseModel):
 @router.get("/", response_model=list[AsesorResponse])
 def get_asesores(db: Session = Depends(get_db), current_user=Depends(require_supervisor)):
     """Solo Supervisores pueden ver la lista de asesores de su compañía"""
-    asesores = db.query(Usuario).filter(Usuario.compania_id == current_user.compania_id).all()
+    # Una sola consulta: clientes por asesor agrupados (índice compania_id, asesor_id)
+    # y unidos a los usuarios; los usuarios sin clientes salen con 0
+    conteos = select(
+        Cliente.asesor_id, func.count(Cliente.id).label("clientes_count")
+    ).where(
+        Cliente.compania_id == current_user.compania_id
+    ).group_by(Cliente.asesor_id).subquery()
     
-    result = []
-    for asesor in asesores:
-        clientes_count = db.query(Cliente).filter(Cliente.asesor_id == asesor.id).count()
-        result.append(AsesorResponse(
-            id=asesor.id,
-            email=asesor.email,
-            rol=asesor.rol,
-            compania_id=asesor.compania_id,
-            clientes_count=clientes_count
-        ))
+    asesores = db.execute(
+        select(
+            Usuario.id, Usuario.email, Usuario.rol, Usuario.compania_id,
+            func.coalesce(conteos.c.clientes_count, 0).label("clientes_count")
+        ).outerjoin(
+            conteos, conteos.c.asesor_id == Usuario.id
+        ).where(
+            Usuario.compania_id == current_user.compania_id
+        ).order_by(Usuario.id)
+    ).all()
     
-    return result
+    return [AsesorResponse(**asesor._mapping) for asesor in asesores]
 
 @router.put("/reasignar-cliente", response_model=dict)
 def reasignar_cliente(
@@ -64,6 +72,7 @@ def reasignar_cliente(
     
     # Realizar la reasignación
     cliente.asesor_id = asignacion.nuevo_asesor_id
+    incrementar_version_datos(db, cliente.compania_id)
     db.commit()
     db.refresh(cliente)
     
@@ -1,12 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from pydantic import BaseModel
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
+import hashlib
 import os
 import logging
-from models import get_db, Usuario
+import secrets
+from models import get_db, Usuario, RefreshToken
+from passwords import verify_password
+from utils import get_current_user, revocar_sesiones
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,8 +31,11 @@ def get_secret_key():
 SECRET_KEY = get_secret_key()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# El refresh token evita repetir bcrypt cada 30 minutos; rota en cada uso
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 def create_access_token(data: dict):
     try:
@@ -41,29 +49,68 @@ def create_access_token(data: dict):
         logger.error(f"Failed to create JWT token: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create token: {str(e)}")
 
+def hash_refresh_token(token: str) -> str:
+    # Token aleatorio de 256 bits: sha256 basta, no hace falta un hash lento
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def emitir_refresh_token(db: Session, usuario_id: int, familia: str = None) -> str:
+    """Store a new refresh token for the user and return it in clear (caller commits)."""
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        usuario_id=usuario_id,
+        token_hash=hash_refresh_token(token),
+        familia=familia or secrets.token_hex(16),
+        expira_en=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    return token
+
+def emitir_tokens(db: Session, user: Usuario, familia: str = None) -> dict:
+    access_token = create_access_token(data={
+        "sub": user.email, 
+        "compania_id": user.compania_id,
+        "user_id": user.id,
+        "rol": user.rol,
+        "ver": user.token_version or 0
+    })
+    refresh_token = emitir_refresh_token(db, user.id, familia)
+    db.commit()
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+def revocar_familia(db: Session, familia: str):
+    db.query(RefreshToken).filter(
+        RefreshToken.familia == familia,
+        RefreshToken.revocado_en.is_(None)
+    ).update({RefreshToken.revocado_en: datetime.utcnow()}, synchronize_session=False)
+
+def completar_login(db: Session, user: Usuario) -> dict:
+    # Limpieza de los refresh tokens caducados del usuario
+    db.query(RefreshToken).filter(
+        RefreshToken.usuario_id == user.id,
+        RefreshToken.expira_en < datetime.utcnow()
+    ).delete(synchronize_session=False)
+    return emitir_tokens(db, user)
+
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    # async: las consultas (sesión síncrona) van al threadpool, pero bcrypt se
+    # espera en el event loop sin retener ningún hilo
     try:
         logger.info(f"Login attempt for email: {form_data.username}")
-        user = db.query(Usuario).filter(Usuario.email == form_data.username).first()
+        user = await run_in_threadpool(
+            lambda: db.query(Usuario).filter(Usuario.email == form_data.username).first()
+        )
         if not user:
             logger.error(f"User not found: {form_data.username}")
             raise HTTPException(status_code=401, detail="Incorrect email or password")
         
-        # Truncar password a 72 bytes antes de verificar
-        password_truncated = form_data.password[:72]
-        if not pwd_context.verify(password_truncated, user.password):
+        # bcrypt en su executor acotado (trunca a 72 bytes; 503 si está saturado)
+        if not await verify_password(form_data.password, user.password):
             logger.error(f"Password verification failed for: {form_data.username}")
             raise HTTPException(status_code=401, detail="Incorrect email or password")
         
-        access_token = create_access_token(data={
-            "sub": user.email, 
-            "compania_id": user.compania_id,
-            "user_id": user.id,
-            "rol": user.rol
-        })
+        tokens = await run_in_threadpool(completar_login, db, user)
         logger.info(f"Login successful for: {form_data.username}")
-        return {"access_token": access_token, "token_type": "bearer"}
+        return tokens
     
     except HTTPException as e:
         logger.error(f"Login failed with HTTP error: {str(e)}")
@@ -71,3 +118,55 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     except Exception as e:
         logger.error(f"Unexpected login error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
+
+
+@router.post("/refresh")
+def refresh(request: RefreshRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new access + refresh token pair (no bcrypt)."""
+    try:
+        # FOR UPDATE: dos refresh simultáneos con el mismo token no pueden rotarlo los dos
+        stored = db.query(RefreshToken).filter(
+            RefreshToken.token_hash == hash_refresh_token(request.refresh_token)
+        ).with_for_update().first()
+        if not stored or stored.revocado_en is not None or stored.expira_en < datetime.utcnow():
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+        
+        if stored.usado_en is not None:
+            # Reutilización de un token ya rotado: probablemente robado, se revoca toda la familia
+            logger.error(f"Refresh token reuse detected for user {stored.usuario_id}, revoking session")
+            revocar_familia(db, stored.familia)
+            db.commit()
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+        
+        user = db.query(Usuario).filter(Usuario.id == stored.usuario_id).first()
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+        
+        stored.usado_en = datetime.utcnow()
+        return emitir_tokens(db, user, stored.familia)
+    
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Unexpected refresh error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Refresh failed: {str(e)}")
+
+@router.post("/logout")
+def logout(request: RefreshRequest, db: Session = Depends(get_db)):
+    """Revoke the session (refresh token family) of this device."""
+    stored = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_refresh_token(request.refresh_token)
+    ).first()
+    if stored:
+        revocar_familia(db, stored.familia)
+        db.commit()
+    return {"message": "Sesión cerrada"}
+
+@router.post("/logout-all")
+def logout_all(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Revoke every access and refresh token of the current user."""
+    revocar_sesiones(db, current_user.id)
+    db.commit()
+    return {"message": "Todas las sesiones cerradas"}
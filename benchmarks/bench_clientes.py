@@ -0,0 +1,150 @@
+"""
+Benchmark de la construcción de la respuesta de los listados de clientes.
+
+Uso (desde la raíz del repo, necesita DATABASE_URL):
+
+    python -m benchmarks.bench_clientes                       # 10k clientes
+    python -m benchmarks.bench_clientes --clientes 1000 10000 --guardar clientes.json
+
+Sobre una compañía temporal (benchmarks.datos) con todos los clientes
+asignados a un asesor, se compara por fila:
+
+- anterior: entidades Cliente con joinedload del asesor, un ClienteResponse
+  por cliente copiando los campos y la revalidación de la lista entera contra
+  list[ClienteResponse] que hacía FastAPI antes de serializar
+- actual: tuplas de columnas (clientes.consulta_clientes, outer join con
+  usuarios), dicts con clientes.serializar_clientes y OrjsonResponse
+
+Cada fase (consulta, construcción, serialización) guarda el mejor tiempo de
+--repeticiones.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from benchmarks.datos import compania_temporal
+
+
+def _mejor(funcion, repeticiones: int):
+    mejor, resultado = None, None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, resultado
+
+
+def _medidas(fases: dict, filas: int, bytes_json: int) -> dict:
+    total = sum(fases.values())
+    return {
+        **{f"{fase}_us_por_fila": round(segundos / filas * 1e6, 2) for fase, segundos in fases.items()},
+        "total_ms": round(total * 1e3, 1),
+        "us_por_fila": round(total / filas * 1e6, 2),
+        "filas": filas,
+        "bytes": bytes_json
+    }
+
+
+def bench_anterior(db, supervisor, repeticiones: int) -> dict:
+    from clientes import AsesorInfo, ClienteResponse
+    from models import Cliente
+
+    campos = [campo for campo in ClienteResponse.model_fields if campo != "asesor_asignado"]
+    lista = TypeAdapter(list[ClienteResponse])
+
+    def consulta():
+        db.expunge_all()
+        return db.scalars(select(Cliente).options(joinedload(Cliente.asesor_asignado)).where(
+            Cliente.compania_id == supervisor.compania_id
+        )).unique().all()
+
+    def construir():
+        # Como el antiguo from_orm_with_asesor: un modelo por cliente con los campos copiados
+        return [
+            ClienteResponse(
+                **{campo: getattr(cliente, campo) for campo in campos},
+                asesor_asignado=AsesorInfo(
+                    id=cliente.asesor_asignado.id, email=cliente.asesor_asignado.email, rol=cliente.asesor_asignado.rol
+                ) if cliente.asesor_asignado else None
+            )
+            for cliente in clientes
+        ]
+
+    def serializar():
+        # FastAPI revalidaba la lista contra el response_model antes de serializarla
+        return lista.dump_json(lista.validate_python(respuestas, from_attributes=True))
+
+    t_consulta, clientes = _mejor(consulta, repeticiones)
+    t_construir, respuestas = _mejor(construir, repeticiones)
+    t_serializar, cuerpo = _mejor(serializar, repeticiones)
+    return _medidas({"consulta": t_consulta, "construccion": t_construir, "serializacion": t_serializar}, len(clientes), len(cuerpo))
+
+
+def bench_actual(db, supervisor, repeticiones: int) -> dict:
+    from clientes import consulta_clientes, serializar_clientes
+    from listados import FiltrosListado, Paginacion
+    from responses import OrjsonResponse
+
+    stmt = consulta_clientes(supervisor, FiltrosListado(), Paginacion())
+    t_consulta, filas = _mejor(lambda: db.execute(stmt).all(), repeticiones)
+    t_construir, clientes = _mejor(lambda: serializar_clientes(filas), repeticiones)
+    t_serializar, cuerpo = _mejor(lambda: OrjsonResponse(clientes).body, repeticiones)
+    return _medidas({"consulta": t_consulta, "construccion": t_construir, "serializacion": t_serializar}, len(filas), len(cuerpo))
+
+
+def ejecutar(args) -> dict:
+    from models import SessionLocal, Cliente
+
+    resultados = {}
+    for num_clientes in args.clientes:
+        with compania_temporal(num_clientes, 10, args.seed) as (compania_id, supervisor):
+            db = SessionLocal()
+            try:
+                db.query(Cliente).filter(Cliente.compania_id == compania_id).update(
+                    {Cliente.asesor_id: supervisor.id}, synchronize_session=False
+                )
+                db.commit()
+                print(f"⏱️  {num_clientes} clientes...", file=sys.stderr)
+                resultados[f"{num_clientes} anterior"] = bench_anterior(db, supervisor, args.repeticiones)
+                resultados[f"{num_clientes} actual"] = bench_actual(db, supervisor, args.repeticiones)
+            finally:
+                db.close()
+    return resultados
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de los listados de clientes")
+    parser.add_argument("--clientes", type=int, nargs="+", default=[10000])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--guardar", help="guardar los resultados en JSON")
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar(args)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as fichero:
+            json.dump({
+                "meta": {"fecha": datetime.now().isoformat(), **vars(args)},
+                "resultados": resultados
+            }, fichero, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {args.guardar}", file=sys.stderr)
+
+    print(f"{'benchmark':20} {'consulta':>10} {'construc.':>10} {'serializ.':>10} {'µs/fila':>10} {'total ms':>10} {'bytes':>10}")
+    for clave, medida in resultados.items():
+        print(
+            f"{clave:20} {medida['consulta_us_por_fila']:>10} {medida['construccion_us_por_fila']:>10} "
+            f"{medida['serializacion_us_por_fila']:>10} {medida['us_por_fila']:>10} {medida['total_ms']:>10} {medida['bytes']:>10}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Benchmarks de la capa HTTP: middlewares, bytes en la red y serialización.
+
+Uso (desde la raíz del repo, necesita DATABASE_URL):
+
+    python -m benchmarks.bench_http
+    python -m benchmarks.bench_http --clientes 5000 --pisos 500 --guardar http.json
+
+Las peticiones se lanzan directamente contra la app ASGI (sin servidor ni
+TestClient) sobre una compañía temporal (benchmarks.datos). Se mide:
+
+- overhead de middlewares por petición en /health y /pisos/: sin middlewares,
+  con la pila anterior (CORSMiddleware de Starlette + dos @app.middleware)
+  y con la actual (http_middleware)
+- bytes en la red y CPU por petición de los listados grandes con
+  Accept-Encoding identity / gzip / br
+- CPU de serializar cada payload con jsonable_encoder + json vs orjson
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import orjson
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.middleware.cors import CORSMiddleware as StarletteCORSMiddleware
+
+from benchmarks.datos import compania_temporal
+
+ENDPOINTS = ["/clientes/all", "/pisos/all", "/match/?piso_id={piso_id}", "/match/download-excel"]
+CODIFICACIONES = ["identity", "gzip", "br"]
+
+
+async def _get(app, ruta: str, cabeceras: dict = None) -> tuple:
+    """Run one GET through the ASGI app; returns (status, body bytes on the wire)."""
+    partes = urlsplit(ruta)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "root_path": "",
+        "path": partes.path, "raw_path": partes.path.encode(), "query_string": partes.query.encode(),
+        "headers": [(nombre.lower().encode(), valor.encode()) for nombre, valor in (cabeceras or {}).items()],
+        "client": ("127.0.0.1", 50000), "server": ("benchmark", 80)
+    }
+    pedido = {"enviado": False}
+    desconexion = asyncio.Event()  # Nunca se dispara: el cliente no se va
+
+    async def receive():
+        if not pedido["enviado"]:
+            pedido["enviado"] = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await desconexion.wait()
+
+    respuesta = {"status": None, "cuerpo": []}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            respuesta["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            respuesta["cuerpo"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return respuesta["status"], b"".join(respuesta["cuerpo"])
+
+
+def _pila_anterior(app: FastAPI):
+    """Rebuild the previous middleware stack (CORSMiddleware + two BaseHTTPMiddleware hooks)."""
+    app.add_middleware(
+        StarletteCORSMiddleware,
+        allow_origins=["*"], allow_credentials=False, allow_methods=["*"], allow_headers=["*"], expose_headers=["*"]
+    )
+
+    @app.middleware("http")
+    async def add_cors_headers(request, call_next):
+        response = await call_next(request)
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, HEAD, PATCH"
+        response.headers["Access-Control-Allow-Headers"] = "*"
+        response.headers["Access-Control-Expose-Headers"] = "*"
+        return response
+
+    @app.middleware("http")
+    async def catch_exceptions_middleware(request, call_next):
+        try:
+            response = await call_next(request)
+            response.headers["Access-Control-Allow-Origin"] = "*"
+            response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, HEAD, PATCH"
+            response.headers["Access-Control-Allow-Headers"] = "*"
+            return response
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"detail": f"Internal server error: {str(e)}"})
+
+
+def _pila_actual(app: FastAPI):
+    from http_middleware import CORSMiddleware, CompressionMiddleware
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(CORSMiddleware)
+
+
+def _app_con(router, pila=None) -> FastAPI:
+    # Mismas rutas (y dependency_overrides de main.app), distinta pila de middlewares
+    app = FastAPI()
+    app.router = router
+    if pila:
+        pila(app)
+    return app
+
+
+async def _cronometrar(app, ruta: str, cabeceras: dict, peticiones: int) -> dict:
+    status, cuerpo = await _get(app, ruta, cabeceras)  # Calentamiento
+    if status != 200:
+        raise RuntimeError(f"GET {ruta} -> {status}: {cuerpo[:200]!r}")
+    inicio, cpu = time.perf_counter(), time.process_time()
+    for _ in range(peticiones):
+        await _get(app, ruta, cabeceras)
+    return {
+        "us_por_peticion": round((time.perf_counter() - inicio) / peticiones * 1e6, 1),
+        "cpu_us_por_peticion": round((time.process_time() - cpu) / peticiones * 1e6, 1),
+        "bytes": len(cuerpo)
+    }
+
+
+async def bench_middlewares(router, peticiones: int) -> dict:
+    pilas = {
+        "sin_middlewares": _app_con(router),
+        "anterior": _app_con(router, _pila_anterior),
+        "actual": _app_con(router, _pila_actual)
+    }
+    resultados = {}
+    for ruta in ("/health", "/pisos/"):
+        for nombre, app in pilas.items():
+            resultados[f"{ruta} {nombre}"] = await _cronometrar(app, ruta, {"Accept-Encoding": "identity"}, peticiones)
+    return resultados
+
+
+async def bench_listados(app, rutas: list, peticiones: int) -> dict:
+    resultados = {}
+    for ruta in rutas:
+        for codificacion in CODIFICACIONES:
+            resultados[f"{ruta} {codificacion}"] = await _cronometrar(app, ruta, {"Accept-Encoding": codificacion}, peticiones)
+    return resultados
+
+
+async def bench_serializacion(app, rutas: list, repeticiones: int) -> dict:
+    resultados = {}
+    for ruta in rutas:
+        _, cuerpo = await _get(app, ruta, {"Accept-Encoding": "identity"})
+        payload = json.loads(cuerpo)
+        for nombre, serializar in (
+            ("json", lambda: json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode()),
+            ("orjson", lambda: orjson.dumps(payload))
+        ):
+            inicio = time.process_time()
+            for _ in range(repeticiones):
+                serializar()
+            resultados[f"{ruta} {nombre}"] = {
+                "cpu_us_por_peticion": round((time.process_time() - inicio) / repeticiones * 1e6, 1),
+                "bytes": len(cuerpo)
+            }
+    return resultados
+
+
+async def _ejecutar(args) -> dict:
+    from main import app
+    from models import SessionLocal, Piso, async_engine
+    from utils import get_current_user
+
+    with compania_temporal(args.clientes, args.pisos, args.seed) as (compania_id, supervisor):
+        db = SessionLocal()
+        try:
+            piso_id = db.query(Piso.id).filter(
+                Piso.compania_id == compania_id, Piso.paralizado != "SÍ"
+            ).order_by(Piso.id).first().id
+        finally:
+            db.close()
+        rutas = [ruta.format(piso_id=piso_id) for ruta in ENDPOINTS]
+
+        app.dependency_overrides[get_current_user] = lambda: supervisor
+        try:
+            resultados = {}
+            print("⏱️  Middlewares...", file=sys.stderr)
+            resultados.update(await bench_middlewares(app.router, args.peticiones))
+            print("⏱️  Listados y compresión...", file=sys.stderr)
+            resultados.update(await bench_listados(app, rutas, max(args.peticiones // 10, 1)))
+            print("⏱️  Serialización...", file=sys.stderr)
+            resultados.update(await bench_serializacion(app, rutas, max(args.peticiones // 10, 1)))
+            return resultados
+        finally:
+            app.dependency_overrides.pop(get_current_user, None)
+            await async_engine.dispose()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de la capa HTTP")
+    parser.add_argument("--clientes", type=int, default=2000)
+    parser.add_argument("--pisos", type=int, default=200)
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--guardar", help="guardar los resultados en JSON")
+    args = parser.parse_args(argv)
+
+    resultados = asyncio.run(_ejecutar(args))
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as fichero:
+            json.dump({
+                "meta": {"fecha": datetime.now().isoformat(), **vars(args)},
+                "resultados": resultados
+            }, fichero, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {args.guardar}", file=sys.stderr)
+
+    print(f"{'benchmark':58} {'µs/pet':>10} {'CPU µs/pet':>12} {'bytes':>10}")
+    for clave, medida in resultados.items():
+        print(f"{clave:58} {medida.get('us_por_peticion', ''):>10} {medida['cpu_us_por_peticion']:>12} {medida['bytes']:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
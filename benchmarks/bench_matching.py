@@ -0,0 +1,263 @@
+"""
+Micro-benchmarks del scoring de matches.
+
+Uso (desde la raíz del repo):
+
+    python -m benchmarks.bench_matching                          # 1k / 10k / 100k
+    python -m benchmarks.bench_matching --escalas 1000 --guardar base.json
+    python -m benchmarks.bench_matching --comparar base.json     # diff contra la baseline
+    python -m benchmarks.bench_matching --db                     # + obtener_matches end-to-end
+    python -m benchmarks.bench_matching --escalas 20000 --workers 1 2 4 8   # escalado de la matriz
+
+Para cada escala N se puntúan N pares (piso, cliente) generados con
+benchmarks.generador (misma semilla -> mismos pares). Se mide:
+
+- calculate_match_score_with_details y cada check_* por separado
+- el scorer NumPy (un piso contra N clientes)
+- con --db: GET /match/ de punta a punta contra DATABASE_URL, sobre una
+  compañía temporal que se crea y se borra al terminar
+- con --workers: calcular_matriz_matches (N/10 pisos x N clientes, lo que
+  hace /match/recalcular) con cada nº de procesos, y la aceleración y
+  eficiencia respecto a 1 proceso. El pool se arranca en el calentamiento,
+  así que se mide el pool ya creado, como en un servidor en marcha
+
+Cada medida guarda el mejor tiempo de --repeticiones, pares/segundo y, en una
+pasada aparte con tracemalloc, el pico de memoria y lo que queda reservado.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.datos import compania_temporal
+from benchmarks.generador import generar_clientes, generar_pisos
+
+import match_store
+import routers.match as match
+from match_profiles import cliente_profile, piso_profile
+from match_batch import ClienteBatch, score_piso_against_clientes
+
+ESCALAS = [1000, 10000, 100000]
+CHECKS = [
+    "check_zona_match", "check_habitaciones_match", "check_estado_match",
+    "check_tipo_vivienda_match", "check_bajos_match", "check_entreplanta_match",
+    "check_precio_match", "check_m2_match", "check_ascensor_match",
+    "check_cercania_metro_match", "check_altura_match", "check_interior_match",
+    "check_balcon_terraza_match", "check_patio_match"
+]
+# End-to-end: tope de pisos de la compañía temporal (la matriz completa se
+# materializa antes de medir y a 100k clientes x 10k pisos no es razonable)
+MAX_PISOS_DB = 500
+# Cambio relativo de pares/segundo a partir del cual --comparar marca regresión
+UMBRAL_REGRESION = 0.10
+
+
+def _medir(funcion, pares: int, repeticiones: int) -> dict:
+    funcion()  # Calentamiento (cachés de perfiles, imports perezosos)
+    mejor = min(_cronometrar(funcion) for _ in range(repeticiones))
+
+    tracemalloc.start()
+    inicial, _ = tracemalloc.get_traced_memory()
+    funcion()
+    actual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "pares": pares,
+        "segundos": round(mejor, 6),
+        "pares_por_segundo": round(pares / mejor) if mejor else None,
+        "pico_kb": round((pico - inicial) / 1024, 1),
+        "retenido_kb": round((actual - inicial) / 1024, 1)
+    }
+
+
+def _cronometrar(funcion) -> float:
+    inicio = time.perf_counter()
+    funcion()
+    return time.perf_counter() - inicio
+
+
+def _pares(escala: int, seed: int):
+    clientes = generar_clientes(escala, seed)
+    pisos = generar_pisos(max(escala // 10, 1), seed)
+    return [(pisos[i % len(pisos)], cliente) for i, cliente in enumerate(clientes)], pisos, clientes
+
+
+def bench_scoring(escala: int, seed: int, repeticiones: int) -> dict:
+    pares, pisos, clientes = _pares(escala, seed)
+    resultados = {}
+
+    def score_detalles():
+        for piso, cliente in pares:
+            match.calculate_match_score_with_details(piso, cliente)
+    resultados["calculate_match_score_with_details"] = _medir(score_detalles, len(pares), repeticiones)
+
+    # Los check_* reciben perfiles ya compilados
+    perfiles = [(piso_profile(piso), cliente_profile(cliente)) for piso, cliente in pares]
+    for nombre in CHECKS:
+        check = getattr(match, nombre)
+
+        def ejecutar_check(check=check):
+            for piso, cliente in perfiles:
+                try:
+                    check(piso, cliente)
+                except ValueError:
+                    pass  # habitaciones no numéricas: el scorer lo trata como score 0
+        resultados[nombre] = _medir(ejecutar_check, len(perfiles), repeticiones)
+
+    batch = ClienteBatch([cliente_profile(cliente) for cliente in clientes])
+    piso = piso_profile(pisos[0])
+    resultados["score_piso_against_clientes"] = _medir(
+        lambda: score_piso_against_clientes(piso, batch), len(clientes), repeticiones
+    )
+    return resultados
+
+
+def bench_matriz(escala: int, seed: int, repeticiones: int, workers: list) -> dict:
+    """calcular_matriz_matches with each number of worker processes."""
+    pisos = [piso_profile(piso) for piso in generar_pisos(max(escala // 10, 1), seed)]
+    clientes = [cliente_profile(cliente) for cliente in generar_clientes(escala, seed)]
+    pares = len(pisos) * len(clientes)
+
+    resultados = {}
+    # Sin umbral: se quiere el reparto entre procesos también en escalas pequeñas
+    minimo, match_store.MATCH_PARALLEL_MIN_PARES = match_store.MATCH_PARALLEL_MIN_PARES, 0
+    try:
+        for num in workers:
+            resultados[f"calcular_matriz_matches[workers={num}]"] = _medir(
+                lambda: match_store.calcular_matriz_matches(pisos, clientes, workers=num), pares, repeticiones
+            )
+    finally:
+        match_store.MATCH_PARALLEL_MIN_PARES = minimo
+        match_store.cerrar_pools_matching()
+
+    base = resultados.get("calcular_matriz_matches[workers=1]")
+    if base:
+        for num in workers:
+            medida = resultados[f"calcular_matriz_matches[workers={num}]"]
+            medida["aceleracion"] = round(base["segundos"] / medida["segundos"], 2)
+            medida["eficiencia"] = round(medida["aceleracion"] / num, 2)
+    return resultados
+
+
+def bench_obtener_matches(escala: int, seed: int, repeticiones: int, consultas: int = 50) -> dict:
+    """GET /match/ end-to-end on a throwaway compania (needs DATABASE_URL and httpx)."""
+    from fastapi.testclient import TestClient
+    from main import app
+    from models import SessionLocal, Cliente, Piso
+    from utils import get_current_user
+
+    num_pisos = min(max(escala // 10, 1), MAX_PISOS_DB)
+    with compania_temporal(escala, num_pisos, seed) as (compania_id, supervisor):
+        db = SessionLocal()
+        try:
+            piso_ids = [fila.id for fila in db.query(Piso.id).filter(
+                Piso.compania_id == compania_id, Piso.paralizado != "SÍ"
+            ).order_by(Piso.id).limit(consultas)]
+            cliente_ids = [fila.id for fila in db.query(Cliente.id).filter(
+                Cliente.compania_id == compania_id
+            ).order_by(Cliente.id).limit(consultas)]
+        finally:
+            db.close()
+
+        app.dependency_overrides[get_current_user] = lambda: supervisor
+        try:
+            # Con "with" todas las peticiones comparten event loop: las conexiones
+            # del pool asyncpg (GET /match/ es async) están ligadas a un loop
+            with TestClient(app) as cliente_http:
+                def por_piso():
+                    for piso_id in piso_ids:
+                        cliente_http.get("/match/", params={"piso_id": piso_id}).raise_for_status()
+
+                def por_cliente():
+                    for cliente_id in cliente_ids:
+                        cliente_http.get("/match/", params={"cliente_id": cliente_id}).raise_for_status()
+
+                # Pares = candidatos que cubre cada petición (todos los clientes / pisos de la compañía)
+                return {
+                    "obtener_matches_por_piso": _medir(por_piso, len(piso_ids) * escala, repeticiones),
+                    "obtener_matches_por_cliente": _medir(por_cliente, len(cliente_ids) * num_pisos, repeticiones)
+                }
+        finally:
+            app.dependency_overrides.pop(get_current_user, None)
+
+
+def comparar(base: dict, actual: dict, umbral: float = UMBRAL_REGRESION) -> int:
+    """Print a per-benchmark diff of pairs/second; return the number of regressions."""
+    regresiones = 0
+    print(f"{'benchmark':58} {'base p/s':>12} {'actual p/s':>12} {'cambio':>8}")
+    for clave in sorted(set(base["resultados"]) & set(actual["resultados"])):
+        antes = base["resultados"][clave]["pares_por_segundo"]
+        despues = actual["resultados"][clave]["pares_por_segundo"]
+        if not antes or not despues:
+            continue
+        cambio = despues / antes - 1
+        marca = ""
+        if cambio < -umbral:
+            marca = "  ❌ REGRESIÓN"
+            regresiones += 1
+        elif cambio > umbral:
+            marca = "  ✅"
+        print(f"{clave:58} {antes:>12} {despues:>12} {cambio:>+8.1%}{marca}")
+    for clave in sorted(set(base["resultados"]) ^ set(actual["resultados"])):
+        print(f"{clave:58} (solo en {'la baseline' if clave in base['resultados'] else 'esta ejecución'})")
+    return regresiones
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks del scoring de matches")
+    parser.add_argument("--escalas", type=int, nargs="+", default=ESCALAS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--db", action="store_true", help="incluir GET /match/ end-to-end (usa DATABASE_URL)")
+    parser.add_argument("--workers", type=int, nargs="+", help="medir calcular_matriz_matches con estos nº de procesos")
+    parser.add_argument("--guardar", help="guardar los resultados como baseline JSON")
+    parser.add_argument("--comparar", help="baseline JSON con la que comparar")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_REGRESION)
+    args = parser.parse_args(argv)
+
+    resultados = {}
+    for escala in args.escalas:
+        print(f"⏱️  Escala {escala}...", file=sys.stderr)
+        medidas = bench_scoring(escala, args.seed, args.repeticiones)
+        if args.workers:
+            medidas.update(bench_matriz(escala, args.seed, args.repeticiones, args.workers))
+        if args.db:
+            medidas.update(bench_obtener_matches(escala, args.seed, args.repeticiones))
+        for nombre, medida in medidas.items():
+            resultados[f"{nombre}@{escala}"] = medida
+
+    informe = {
+        "meta": {
+            "fecha": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "seed": args.seed,
+            "cpus": os.cpu_count(),
+            "repeticiones": args.repeticiones
+        },
+        "resultados": resultados
+    }
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as fichero:
+            json.dump(informe, fichero, indent=2, ensure_ascii=False)
+        print(f"💾 Baseline guardada en {args.guardar}", file=sys.stderr)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as fichero:
+            base = json.load(fichero)
+        return 1 if comparar(base, informe, args.umbral) else 0
+
+    for clave, medida in resultados.items():
+        escalado = f"  x{medida['aceleracion']} ({medida['eficiencia']:.0%})" if "aceleracion" in medida else ""
+        print(f"{clave:58} {medida['pares_por_segundo']:>12} p/s  {medida['segundos']:>10.4f} s  pico {medida['pico_kb']:>10} KB{escalado}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Compañía temporal con datos generados para los benchmarks end-to-end.
+
+Se crea en la BD de DATABASE_URL, con un supervisor, clientes y pisos de
+benchmarks.generador y sus matches materializados, y se borra al salir.
+"""
+import time
+from contextlib import contextmanager
+
+from benchmarks.generador import generar_clientes, generar_pisos
+
+
+@contextmanager
+def compania_temporal(num_clientes: int, num_pisos: int, seed: int = 42):
+    """Yield (compania_id, supervisor) for a throwaway company; everything is deleted on exit."""
+    from models import SessionLocal, Compania, Usuario, Cliente, Piso, Match, ClienteEstadoPiso
+    from match_store import reconstruir_matches_compania
+
+    db = SessionLocal()
+    compania = Compania(nombre=f"benchmark-{seed}-{num_clientes}-{int(time.time())}")
+    db.add(compania)
+    db.commit()
+    try:
+        supervisor = Usuario(email=f"bench-{compania.id}@benchmark.local", password="-", rol="Supervisor", compania_id=compania.id)
+        db.add(supervisor)
+        db.add_all(generar_clientes(num_clientes, seed, compania.id, id_inicial=None))
+        db.add_all(generar_pisos(num_pisos, seed, compania.id, id_inicial=None))
+        db.commit()
+        reconstruir_matches_compania(db, compania.id)
+        db.commit()
+        db.refresh(supervisor)
+        db.expunge(supervisor)
+        yield compania.id, supervisor
+    finally:
+        db.rollback()
+        for modelo in (Match, ClienteEstadoPiso, Cliente, Piso, Usuario):
+            db.query(modelo).filter(modelo.compania_id == compania.id).delete(synchronize_session=False)
+        db.query(Compania).filter(Compania.id == compania.id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
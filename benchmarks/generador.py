@@ -0,0 +1,114 @@
+"""
+Generador determinista de clientes y pisos sintéticos para los benchmarks.
+
+Misma semilla -> mismos datos, de modo que dos ejecuciones (antes / después de
+un cambio) puntúan exactamente los mismos pares. Los valores salen de las
+opciones reales de los formularios (ClienteCreate / PisoCreate) y de las zonas
+por defecto de una compañía (models.ZONAS_DEFAULT).
+"""
+import random
+from typing import List, Optional
+
+from models import Cliente, Piso, ZONAS_DEFAULT, normalizar_zonas
+
+TIPOS_VIVIENDA = ["Piso", "Ático", "Chalet", "Local", "Dúplex", "Estudio"]
+ESTADOS = ["Entrar a Vivir", "Actualizar", "A Reformar"]
+ALTURAS = ["Bajo", "Medio", "Alto"]
+ASCENSOR_CLIENTE = ["SÍ", "INDIFERENTE", "Después de 1º", "Después de 2º", "Después de 3º", "Después de 4º"]
+METRO = ["0-5 MIN", "5-10 MIN", "10-15 MIN", "15-20 MIN", "+20 MIN", "INDIFERENTE"]
+INTERIOR_CLIENTE = ["INTERIOR", "EXTERIOR", "INDIFERENTE"]
+INTERIOR_PISO = ["INTERIOR", "EXTERIOR", "AMBOS"]
+PLANTAS = ["-1", "Entreplanta", "0", "1", "2", "3", "4", "5", "6", "7"]
+SI_NO = ["SÍ", "NO"]
+M2 = [30, 40, 50, 60, 70, 80, 90, 100, 110, 120, 130, 150]
+
+
+def _precio_cliente(r: random.Random) -> float:
+    # Formulario: de 10.000 en 10.000 hasta 200.000, después de 20.000 en 20.000.
+    # La mayoría de presupuestos se concentra entre 120.000 y 250.000
+    precio = min(max(r.lognormvariate(12.1, 0.35), 10000), 500000)
+    paso = 10000 if precio <= 200000 else 20000
+    return float(round(precio / paso) * paso)
+
+
+def _varios(r: random.Random, opciones: list, maximo: int) -> List[str]:
+    return r.sample(opciones, r.randint(1, min(maximo, len(opciones))))
+
+
+def _opcional(r: random.Random, valor, probabilidad: float = 0.8):
+    return valor if r.random() < probabilidad else None
+
+
+def generar_clientes(n: int, seed: int = 42, compania_id: int = 1, zonas: List[str] = None, id_inicial: Optional[int] = 1) -> List[Cliente]:
+    """Build n transient Cliente rows, not added to any session.
+
+    With id_inicial=None the ids are left for the database to assign.
+    """
+    r = random.Random(seed)
+    zonas = zonas or ZONAS_DEFAULT
+    clientes = []
+    for i in range(n):
+        zona = ",".join(_varios(r, zonas, 3))
+        precio = _precio_cliente(r)
+        habitaciones = _opcional(r, ",".join(str(h) for h in sorted(_varios(r, [1, 2, 3, 4, 5], 2))))
+        clientes.append(Cliente(
+            id=None if id_inicial is None else id_inicial + i,
+            nombre=f"Cliente {i}",
+            telefono=f"6{r.randint(10000000, 99999999)}",
+            zona=zona,
+            zonas=normalizar_zonas(zona),
+            entrada=float(round(precio * r.uniform(0.1, 0.3), -4)),
+            precio=precio,
+            tipo_vivienda=_opcional(r, ",".join(_varios(r, TIPOS_VIVIENDA[:4], 2))),
+            habitaciones=habitaciones,
+            estado=_opcional(r, ",".join(_varios(r, ESTADOS, 2))),
+            ascensor=_opcional(r, r.choice(ASCENSOR_CLIENTE)),
+            bajos=_opcional(r, r.choice(SI_NO)),
+            entreplanta=_opcional(r, r.choice(SI_NO)),
+            m2=r.choice(M2[:9]),
+            altura=_opcional(r, ",".join(_varios(r, ALTURAS, 2)), 0.5),
+            cercania_metro=_opcional(r, r.choice(METRO)),
+            balcon_terraza=_opcional(r, r.choice(SI_NO), 0.6),
+            patio=_opcional(r, r.choice(SI_NO), 0.4),
+            interior=_opcional(r, r.choice(INTERIOR_CLIENTE)),
+            compania_id=compania_id
+        ))
+    return clientes
+
+
+def generar_pisos(n: int, seed: int = 42, compania_id: int = 1, zonas: List[str] = None, id_inicial: Optional[int] = 1) -> List[Piso]:
+    """Build n transient Piso rows, not added to any session.
+
+    With id_inicial=None the ids are left for the database to assign.
+    """
+    r = random.Random(seed + 1)  # Flujo distinto al de los clientes
+    zonas = zonas or ZONAS_DEFAULT
+    pisos = []
+    for i in range(n):
+        zona = ",".join(_varios(r, zonas, 1 if r.random() < 0.9 else 2))
+        m2 = int(min(max(r.gauss(80, 25), 25), 250))
+        planta = r.choice(PLANTAS)
+        pisos.append(Piso(
+            id=None if id_inicial is None else id_inicial + i,
+            direccion=f"Calle Benchmark {i}",
+            zona=zona,
+            zonas=normalizar_zonas(zona),
+            # Precio ligado al tamaño: ~2.300 €/m2 con bastante dispersión
+            precio=float(round(m2 * r.lognormvariate(7.75, 0.3), -3)),
+            tipo_vivienda=r.choice(TIPOS_VIVIENDA),
+            habitaciones=str(max(1, min(5, round(m2 / 30)))),
+            estado=r.choice(ESTADOS),
+            ascensor=r.choice(SI_NO),
+            bajos="SÍ" if planta in ("-1", "0") else "NO",
+            entreplanta="SÍ" if planta == "Entreplanta" else "NO",
+            planta=planta,
+            m2=m2,
+            altura=r.choice(ALTURAS),
+            cercania_metro=_opcional(r, r.choice(METRO[:5])),
+            balcon_terraza=r.choice(SI_NO),
+            patio=r.choice(SI_NO),
+            interior=r.choice(INTERIOR_PISO),
+            paralizado="SÍ" if r.random() < 0.05 else "NO",
+            compania_id=compania_id
+        ))
+    return pisos
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
-from models import get_db, Cliente, Usuario
+from models import get_db, get_async_db, Cliente, Usuario, normalizar_zonas
 from utils import get_current_user
+from match_profiles import invalidate_cliente
+from match_store import bloquear_compania, refrescar_matches_cliente, borrar_matches_cliente
+from etags import incrementar_version_datos, consulta_version, etag_lista, alcance_usuario, respuesta_condicional
+from listados import (
+    FiltrosListado, Paginacion, filtros_listado, paginacion_listado, campos_solicitados,
+    aplicar_filtros, paginar, recortar_pagina, respuesta_proyectada
+)
 
 router = APIRouter(prefix="/clientes", tags=["clientes"])
 
@@ -36,6 +45,8 @@ class ClienteCreate(BaseModel):
 
 # Nuevo modelo para la información del asesor
 class AsesorInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     email: str
     rol: str
@@ -74,44 +85,55 @@ class ClienteResponse(BaseModel):
 
     @classmethod
     def from_orm_with_asesor(cls, cliente):
-        """Método personalizado para crear la respuesta con información del asesor"""
-        asesor_info = None
-        if cliente.asesor_asignado:
-            asesor_info = AsesorInfo(
-                id=cliente.asesor_asignado.id,
-                email=cliente.asesor_asignado.email,
-                rol=cliente.asesor_asignado.rol
-            )
-        
-        return cls(
-            id=cliente.id,
-            nombre=cliente.nombre,
-            telefono=cliente.telefono,
-            zona=cliente.zona,
-            subzonas=cliente.subzonas,
-            entrada=cliente.entrada,
-            precio=cliente.precio,
-            tipo_vivienda=cliente.tipo_vivienda,
-            finalidad=cliente.finalidad,
-            habitaciones=cliente.habitaciones,
-            estado=cliente.estado,
-            ascensor=cliente.ascensor,
-            bajos=cliente.bajos,
-            entreplanta=cliente.entreplanta,
-            m2=cliente.m2,
-            altura=cliente.altura,
-            cercania_metro=cliente.cercania_metro,
-            balcon_terraza=cliente.balcon_terraza,
-            patio=cliente.patio,
-            interior=cliente.interior,
-            caracteristicas_adicionales=cliente.caracteristicas_adicionales,
-            banco=cliente.banco,
-            permuta=cliente.permuta,
-            kiron=cliente.kiron,
-            compania_id=cliente.compania_id,
-            asesor_id=cliente.asesor_id,
-            asesor_asignado=asesor_info
-        )
+        """Respuesta de un cliente ya cargado con su asesor (ver cargar_cliente_con_asesor)"""
+        return cls.model_validate(cliente)
+
+CAMPOS_CLIENTE = tuple(ClienteResponse.model_fields)
+
+def consulta_clientes(current_user, filtros: FiltrosListado, pagina: Paginacion, campos: Optional[list] = None):
+    """SELECT shared by the clientes lists: column tuples for `campos` (default: all of ClienteResponse).
+
+    asesor_asignado is an outer join on usuarios in the same query, so there is
+    no per-row asesor load and no ORM object is built (see serializar_clientes).
+    """
+    campos = campos or CAMPOS_CLIENTE
+    stmt = select(*(getattr(Cliente, campo) for campo in campos if campo != "asesor_asignado"))
+    if "asesor_asignado" in campos:
+        stmt = stmt.add_columns(
+            Usuario.id.label("_asesor_id"), Usuario.email.label("_asesor_email"), Usuario.rol.label("_asesor_rol")
+        ).outerjoin(Usuario, Cliente.asesor_id == Usuario.id)
+    stmt = stmt.where(Cliente.compania_id == current_user.compania_id)
+    # Si es Asesor, solo ve sus clientes; si es Supervisor, todos los de la compañía
+    if current_user.rol == "Asesor":
+        stmt = stmt.where(Cliente.asesor_id == current_user.id)
+    return paginar(aplicar_filtros(stmt, Cliente, filtros), Cliente, pagina)
+
+def serializar_clientes(filas: list) -> list:
+    """Rows of consulta_clientes as response dicts, straight from the tuples.
+
+    The columns come from the database already typed as in ClienteResponse, so
+    the list is sent with OrjsonResponse without any Pydantic validation.
+    """
+    if not filas:
+        return []
+    claves = list(filas[0]._fields)
+    if "_asesor_id" not in claves:
+        return [dict(zip(claves, fila)) for fila in filas]
+    # Las columnas del asesor van al final: zip se queda con las del cliente
+    i = claves.index("_asesor_id")
+    claves = claves[:i]
+    clientes = []
+    for fila in filas:
+        datos = dict(zip(claves, fila))
+        datos["asesor_asignado"] = {"id": fila[i], "email": fila[i + 1], "rol": fila[i + 2]} if fila[i] is not None else None
+        clientes.append(datos)
+    return clientes
+
+def cargar_cliente_con_asesor(db: Session, cliente_id: int) -> Cliente:
+    """Reload a cliente with its asesor in one query (instead of refresh + lazy load)."""
+    return db.query(Cliente).options(
+        joinedload(Cliente.asesor_asignado)
+    ).filter(Cliente.id == cliente_id).populate_existing().one()
 
 @router.post("/", response_model=ClienteResponse)
 def create_cliente(cliente: ClienteCreate, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
@@ -172,9 +194,16 @@ def create_cliente(cliente: ClienteCreate, db: Session = Depends(get_db), curren
             compania_id=cliente.compania_id,
             asesor_id=asesor_id
         )
+        # Desde el texto guardado: un elemento con comas ("ALTO,OLIVOS") son varias zonas, como en el matching
+        db_cliente.zonas = normalizar_zonas(db_cliente.zona)
         db.add(db_cliente)
+        db.flush()
+        # Matches del nuevo cliente en la misma transacción
+        refrescar_matches_cliente(db, db_cliente)
+        incrementar_version_datos(db, db_cliente.compania_id)
         db.commit()
-        db.refresh(db_cliente)
+        db_cliente = cargar_cliente_con_asesor(db, db_cliente.id)
+        invalidate_cliente(db_cliente.id)
         return ClienteResponse.from_orm_with_asesor(db_cliente)
     except ValueError as e:
         db.rollback()
@@ -186,19 +215,24 @@ def create_cliente(cliente: ClienteCreate, db: Session = Depends(get_db), curren
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @router.get("/", response_model=list[ClienteResponse])
-def read_clientes(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    # Si es Asesor, solo ve sus clientes
-    if current_user.rol == "Asesor":
-        clientes = db.query(Cliente).filter(
-            Cliente.compania_id == current_user.compania_id,
-            Cliente.asesor_id == current_user.id
-        ).all()
-    # Si es Supervisor, ve todos los clientes de la compañía
-    else:
-        clientes = db.query(Cliente).filter(Cliente.compania_id == current_user.compania_id).all()
-    
-    # Usar el método personalizado para crear las respuestas
-    return [ClienteResponse.from_orm_with_asesor(cliente) for cliente in clientes]
+async def read_clientes(
+    request: Request,
+    response: Response,
+    filtros: FiltrosListado = Depends(filtros_listado),
+    pagina: Paginacion = Depends(paginacion_listado),
+    fields: Optional[str] = Query(None, description="Campos separados por comas (id siempre incluido)"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user)
+):
+    version = await db.scalar(consulta_version(current_user.compania_id))
+    etag = etag_lista("clientes", current_user.compania_id, version, alcance_usuario(current_user))
+    no_modificado = respuesta_condicional(request, response, etag)
+    if no_modificado:
+        return no_modificado
+
+    stmt = consulta_clientes(current_user, filtros, pagina, campos_solicitados(fields, CAMPOS_CLIENTE))
+    filas = recortar_pagina((await db.execute(stmt)).all(), pagina, response)
+    return respuesta_proyectada(serializar_clientes(filas), response)
 
 
 @router.delete("/{cliente_id}")
@@ -242,9 +276,15 @@ def delete_cliente(cliente_id: int, db: Session = Depends(get_db), current_user=
             for estado in estados_relacionados:
                 db.delete(estado)
         
-        # Eliminar el cliente
+        # Eliminar el cliente y sus matches precalculados. Con la compañía bloqueada,
+        # como en los refrescos: un alta concurrente no puede insertar un match
+        # de este cliente después de borrarlos (rompería la FK al borrar el cliente)
+        bloquear_compania(db, cliente.compania_id)
+        borrar_matches_cliente(db, cliente_id)
         db.delete(cliente)
+        incrementar_version_datos(db, cliente.compania_id)
         db.commit()
+        invalidate_cliente(cliente_id)
         
         logger.info(f"Cliente {cliente_nombre} eliminado exitosamente")
         return {"message": f"Cliente {cliente_nombre} eliminado exitosamente"}
@@ -302,6 +342,7 @@ def update_cliente(
     cliente.nombre = cliente_data.nombre
     cliente.telefono = cliente_data.telefono
     cliente.zona = ",".join(cliente_data.zona)
+    cliente.zonas = normalizar_zonas(cliente.zona)
     cliente.subzonas = cliente_data.subzonas
     cliente.entrada = cliente_data.entrada
     cliente.precio = cliente_data.precio
@@ -324,23 +365,33 @@ def update_cliente(
     cliente.kiron = cliente_data.kiron
     cliente.asesor_id = asesor_id
     
+    # Recalcular sus matches (el asesor no influye en el score: se filtra al leer)
+    db.flush()
+    refrescar_matches_cliente(db, cliente)
+    incrementar_version_datos(db, cliente.compania_id)
     db.commit()
-    db.refresh(cliente)
+    cliente = cargar_cliente_con_asesor(db, cliente.id)
+    invalidate_cliente(cliente.id)
     return ClienteResponse.from_orm_with_asesor(cliente)
 
 @router.get("/all", response_model=list[ClienteResponse])
-def read_all_clientes(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def read_all_clientes(
+    request: Request,
+    response: Response,
+    filtros: FiltrosListado = Depends(filtros_listado),
+    pagina: Paginacion = Depends(paginacion_listado),
+    fields: Optional[str] = Query(None, description="Campos separados por comas (id siempre incluido)"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
     """Obtener todos los clientes para gestión - Solo Supervisores ven todos, Asesores solo sus clientes"""
     
-    if current_user.rol == "Asesor":
-        # Asesor ve solo sus clientes
-        clientes = db.query(Cliente).filter(
-            Cliente.compania_id == current_user.compania_id,
-            Cliente.asesor_id == current_user.id
-        ).all()
-    else:  # Supervisor
-        # Supervisor ve todos los clientes de la compañía
-        clientes = db.query(Cliente).filter(Cliente.compania_id == current_user.compania_id).all()
-    
-    # Usar el método personalizado para crear las respuestas
-    return [ClienteResponse.from_orm_with_asesor(cliente) for cliente in clientes]
+    version = db.scalar(consulta_version(current_user.compania_id))
+    etag = etag_lista("clientes-all", current_user.compania_id, version, alcance_usuario(current_user))
+    no_modificado = respuesta_condicional(request, response, etag)
+    if no_modificado:
+        return no_modificado
+
+    stmt = consulta_clientes(current_user, filtros, pagina, campos_solicitados(fields, CAMPOS_CLIENTE))
+    filas = recortar_pagina(db.execute(stmt).all(), pagina, response)
+    return respuesta_proyectada(serializar_clientes(filas), response)
@@ -0,0 +1,102 @@
+"""
+Panel de supervisión: clientes de cada usuario de la compañía por estado.
+
+Se calcula con una sola consulta agrupada por usuario, contando clientes
+distintos por estado con COUNT(DISTINCT ...) FILTER. Un cliente sin ningún
+estado registrado cuenta como "Pendiente".
+
+El resultado se cachea por compañía DASHBOARD_CACHE_TTL segundos:
+- las escrituras de clientes (y pisos) incrementan companias.data_version
+  (ver etags.py) y una entrada de otra versión no se usa, en cualquier worker
+- los cambios de estado y el alta de usuarios llaman a invalidar_dashboard
+  (en este proceso; en los demás workers el TTL acota el desfase)
+"""
+import os
+import time
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import and_, distinct, func, or_, select
+from sqlalchemy.orm import Session
+
+from models import Cliente, ClienteEstadoPiso, Usuario
+from etags import consulta_version
+
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+
+# Clave en la respuesta -> valor de cliente_estado_pisos.estado
+ESTADOS_DASHBOARD = {
+    "pendiente": "Pendiente",
+    "cita_venta_puesta": "Cita Venta Puesta",
+    "descarta": "Descarta",
+    "no_contesta": "No Contesta",
+}
+
+_cache: Dict[int, Tuple[float, Optional[int], list]] = {}
+_generaciones: Dict[int, int] = {}
+_cache_lock = Lock()
+
+
+def consulta_dashboard(compania_id: int):
+    """One row per user of the company: total clientes and distinct clientes per estado."""
+    clientes = func.count(distinct(Cliente.id))
+    columnas = [
+        Usuario.email,
+        Usuario.rol,
+        clientes.label("total_clientes"),
+        # CLAVE: los clientes sin ningún estado se consideran "Pendiente"
+        clientes.filter(or_(
+            ClienteEstadoPiso.estado == ESTADOS_DASHBOARD["pendiente"], ClienteEstadoPiso.id.is_(None)
+        )).label("pendiente"),
+    ] + [
+        func.count(distinct(ClienteEstadoPiso.cliente_id)).filter(ClienteEstadoPiso.estado == estado).label(clave)
+        for clave, estado in ESTADOS_DASHBOARD.items() if clave != "pendiente"
+    ]
+    return select(*columnas).select_from(Usuario).outerjoin(
+        Cliente, and_(Cliente.asesor_id == Usuario.id, Cliente.compania_id == compania_id)
+    ).outerjoin(
+        ClienteEstadoPiso, and_(ClienteEstadoPiso.cliente_id == Cliente.id, ClienteEstadoPiso.compania_id == compania_id)
+    ).where(
+        Usuario.compania_id == compania_id
+    ).group_by(Usuario.id).order_by(Usuario.id)
+
+
+def estadisticas_asesores(db: Session, compania_id: int) -> list:
+    asesores = [
+        {
+            "asesor_email": fila.email,
+            "asesor_nombre": fila.email.split("@")[0],
+            "asesor_rol": fila.rol,
+            "total_clientes": fila.total_clientes,
+            **{clave: getattr(fila, clave) for clave in ESTADOS_DASHBOARD}
+        }
+        for fila in db.execute(consulta_dashboard(compania_id))
+    ]
+    # Ordenar por total de clientes pendientes (descendente)
+    asesores.sort(key=lambda asesor: asesor["pendiente"], reverse=True)
+    return asesores
+
+
+def dashboard_compania(db: Session, compania_id: int) -> list:
+    """Cached estadisticas_asesores; the returned list is shared, do not modify it."""
+    version = db.scalar(consulta_version(compania_id))
+    ahora = time.monotonic()
+    with _cache_lock:
+        entrada = _cache.get(compania_id)
+        generacion = _generaciones.get(compania_id, 0)
+    if entrada is not None and entrada[0] > ahora and entrada[1] == version:
+        return entrada[2]
+
+    asesores = estadisticas_asesores(db, compania_id)
+    with _cache_lock:
+        # Si se invalidó mientras se calculaba, el resultado puede ir atrasado: no se guarda
+        if _generaciones.get(compania_id, 0) == generacion:
+            _cache[compania_id] = (ahora + DASHBOARD_CACHE_TTL, version, asesores)
+    return asesores
+
+
+def invalidar_dashboard(compania_id: int):
+    """Drop the cached dashboard of a company (estado changes)."""
+    with _cache_lock:
+        _generaciones[compania_id] = _generaciones.get(compania_id, 0) + 1
+        _cache.pop(compania_id, None)
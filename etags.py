@@ -0,0 +1,64 @@
+"""
+ETags de los listados por compañía (GET condicional con If-None-Match).
+
+Cada compañía tiene un contador companias.data_version que TODA escritura de
+pisos, clientes, asignaciones de asesor y zonas incrementa en su misma
+transacción. El ETag de un listado sale de ese contador (más el usuario cuando
+el listado depende de él), así que comprobar si ha cambiado cuesta una lectura
+por clave primaria de companias y no toca las tablas de pisos/clientes.
+"""
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import Compania
+
+# El navegador guarda la respuesta pero revalida siempre antes de usarla
+CACHE_CONTROL = "private, no-cache"
+
+
+def incrementar_version_datos(db: Session, compania_id: int):
+    """Bump the compania's data_version (caller commits, together with the write)."""
+    db.query(Compania).filter(Compania.id == compania_id).update(
+        {Compania.data_version: Compania.data_version + 1}, synchronize_session=False
+    )
+
+
+def consulta_version(compania_id: int):
+    """SELECT of the compania's data_version, for sync or async sessions."""
+    return select(Compania.data_version).where(Compania.id == compania_id)
+
+
+def etag_lista(recurso: str, compania_id: int, version: Optional[int], alcance: str = "") -> str:
+    return f'W/"{recurso}-{compania_id}-{version or 0}{alcance}"'
+
+
+def alcance_usuario(current_user) -> str:
+    """ETag suffix for lists filtered per user (an Asesor only sees their own clientes)."""
+    return f"-u{current_user.id}" if current_user.rol == "Asesor" else ""
+
+
+def _no_modificado(request: Request, etag: str) -> bool:
+    cabecera = request.headers.get("if-none-match")
+    if not cabecera:
+        return False
+    if cabecera.strip() == "*":
+        return True
+    # Comparación débil (RFC 9110): se ignora el prefijo W/
+    buscado = etag[2:] if etag.startswith("W/") else etag
+    for candidato in cabecera.split(","):
+        candidato = candidato.strip()
+        if (candidato[2:] if candidato.startswith("W/") else candidato) == buscado:
+            return True
+    return False
+
+
+def respuesta_condicional(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return a 304 if the client already has this version; otherwise tag `response` and return None."""
+    if _no_modificado(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return None
@@ -0,0 +1,218 @@
+"""
+Middlewares ASGI puros de la API (sin BaseHTTPMiddleware).
+
+CORSMiddleware   cabeceras CORS en todas las respuestas (también en errores),
+                 respuesta directa a los preflight OPTIONS y conversión de
+                 excepciones no controladas en un 500 JSON con CORS.
+CompressionMiddleware
+                 br (si el paquete brotli está instalado) o gzip según
+                 Accept-Encoding, solo para tipos de contenido comprimibles y
+                 a partir de COMPRESSION_MIN_BYTES. Funciona también con
+                 StreamingResponse: cada trozo se comprime y se envía al momento.
+
+Al ser ASGI puro no se crea una tarea ni se envuelve el stream por petición,
+y las respuestas en streaming (exportaciones CSV/XLSX) salen tal cual.
+"""
+import json
+import logging
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Sin brotli se negocia solo gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ALLOW_METHODS = b"GET, POST, PUT, DELETE, OPTIONS, HEAD, PATCH"
+# Los navegadores no cubren Authorization con "*": en el preflight se
+# devuelven las cabeceras pedidas
+CORS_HEADERS = (
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", ALLOW_METHODS),
+    (b"access-control-allow-headers", b"*"),
+    (b"access-control-expose-headers", b"*"),
+)
+_NOMBRES_CORS = {nombre for nombre, _ in CORS_HEADERS}
+PREFLIGHT_MAX_AGE = b"3600"
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))  # 4: buen ratio sin disparar la CPU
+COMPRIMIBLES = (b"application/json", b"text/", b"application/javascript", b"application/xml", b"image/svg+xml")
+
+
+def _con_cors(cabeceras: list) -> list:
+    return [(nombre, valor) for nombre, valor in cabeceras if nombre.lower() not in _NOMBRES_CORS] + list(CORS_HEADERS)
+
+
+class CORSMiddleware:
+    """CORS headers, preflight and unhandled-exception-to-500 in one pure ASGI layer."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS":
+            await self._preflight(scope, send)
+            return
+
+        iniciada = False
+
+        async def send_con_cors(message):
+            nonlocal iniciada
+            if message["type"] == "http.response.start":
+                iniciada = True
+                message = {**message, "headers": _con_cors(message.get("headers", []))}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_cors)
+        except Exception as e:
+            if iniciada:
+                raise  # Ya se enviaron cabeceras: no se puede cambiar a un 500
+            logger.error(f"Unhandled exception: {str(e)}")
+            cuerpo = json.dumps({"detail": f"Internal server error: {str(e)}"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": _con_cors([
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(cuerpo)).encode())
+                ])
+            })
+            await send({"type": "http.response.body", "body": cuerpo})
+
+    async def _preflight(self, scope, send):
+        pedidas = dict(scope["headers"]).get(b"access-control-request-headers")
+        cabeceras = _con_cors([(b"content-length", b"0")])
+        if pedidas:
+            cabeceras = [(n, pedidas if n == b"access-control-allow-headers" else v) for n, v in cabeceras]
+        cabeceras.append((b"access-control-max-age", PREFLIGHT_MAX_AGE))
+        await send({"type": "http.response.start", "status": 200, "headers": cabeceras})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def _codificacion_aceptada(cabeceras) -> str:
+    aceptadas = set()
+    for parte in dict(cabeceras).get(b"accept-encoding", b"").decode("latin-1").split(","):
+        codificacion, _, parametros = parte.partition(";")
+        parametros = parametros.replace(" ", "")
+        if parametros.startswith("q="):
+            try:
+                if float(parametros[2:]) <= 0:
+                    continue  # q=0: rechazada explícitamente
+            except ValueError:
+                continue
+        aceptadas.add(codificacion.strip().lower())
+    if brotli is not None and "br" in aceptadas:
+        return "br"
+    if "gzip" in aceptadas:
+        return "gzip"
+    return ""
+
+
+class _Compresor:
+    def __init__(self, codificacion: str):
+        if codificacion == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._gzip = None
+        else:
+            self._br = None
+            self._gzip = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: formato gzip
+
+    def trozo(self, datos: bytes) -> bytes:
+        """Compress and flush, so a streamed chunk reaches the client right away."""
+        if self._br is not None:
+            return self._br.process(datos) + self._br.flush()
+        return self._gzip.compress(datos) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def fin(self, datos: bytes = b"") -> bytes:
+        if self._br is not None:
+            return self._br.process(datos) + self._br.finish()
+        return self._gzip.compress(datos) + self._gzip.flush()
+
+
+class CompressionMiddleware:
+    """Negotiated br/gzip response compression, streaming-aware."""
+
+    def __init__(self, app, minimo: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        codificacion = _codificacion_aceptada(scope["headers"])
+        if not codificacion:
+            await self.app(scope, receive, send)
+            return
+
+        estado = {"inicio": None, "compresor": None, "directo": False}
+
+        async def send_comprimido(message):
+            if message["type"] == "http.response.start":
+                # Se retiene hasta el primer trozo del cuerpo: de él depende comprimir o no
+                estado["inicio"] = message
+                return
+            if message["type"] != "http.response.body" or estado["directo"]:
+                await send(message)
+                return
+
+            cuerpo = message.get("body", b"")
+            mas = message.get("more_body", False)
+            compresor = estado["compresor"]
+            if compresor is None:
+                inicio = estado["inicio"]
+                cabeceras = inicio.get("headers", [])
+                if not self._comprimible(cabeceras) or (not mas and len(cuerpo) < self.minimo):
+                    estado["directo"] = True
+                    await send(inicio)
+                    await send(message)
+                    return
+                compresor = estado["compresor"] = _Compresor(codificacion)
+                cabeceras = [
+                    (nombre, valor) for nombre, valor in cabeceras
+                    if nombre.lower() not in (b"content-length", b"vary")
+                ] + [
+                    (b"content-encoding", codificacion.encode()),
+                    (b"vary", self._vary(cabeceras))
+                ]
+                if not mas:
+                    comprimido = compresor.fin(cuerpo)
+                    cabeceras.append((b"content-length", str(len(comprimido)).encode()))
+                    await send({**inicio, "headers": cabeceras})
+                    await send({"type": "http.response.body", "body": comprimido})
+                    return
+                await send({**inicio, "headers": cabeceras})
+
+            datos = compresor.trozo(cuerpo) if mas else compresor.fin(cuerpo)
+            await send({"type": "http.response.body", "body": datos, "more_body": mas})
+
+        await self.app(scope, receive, send_comprimido)
+
+    @staticmethod
+    def _comprimible(cabeceras) -> bool:
+        tipo = b""
+        for nombre, valor in cabeceras:
+            nombre = nombre.lower()
+            if nombre == b"content-encoding":
+                return False  # Ya comprimido por el endpoint
+            if nombre == b"content-type":
+                tipo = valor.lower()
+        return tipo.startswith(COMPRIMIBLES)
+
+    @staticmethod
+    def _vary(cabeceras) -> bytes:
+        for nombre, valor in cabeceras:
+            if nombre.lower() == b"vary" and b"accept-encoding" not in valor.lower():
+                return valor + b", Accept-Encoding"
+            if nombre.lower() == b"vary":
+                return valor
+        return b"Accept-Encoding"
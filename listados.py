@@ -0,0 +1,110 @@
+"""
+Piezas comunes de los listados de pisos y clientes: filtros, paginación por
+cursor y proyección de campos (fields=).
+
+Los listados se ordenan por id y se paginan por keyset: cada página pide
+id > cursor con limit + 1 filas; si sobra la última, el id de la última fila
+devuelta va en la cabecera X-Next-Cursor (ausente en la última página).
+Sin limit se devuelve todo el listado, como hasta ahora.
+
+Con fields= solo se seleccionan esas columnas en SQL y las filas salen como
+dicts sin pasar por el response_model (id se incluye siempre).
+"""
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from fastapi import HTTPException, Query, Response
+
+from models import normalizar_zonas, habitaciones_array
+from responses import OrjsonResponse
+
+LISTADO_MAX_LIMIT = int(os.getenv("LISTADO_MAX_LIMIT", "500"))
+CABECERA_CURSOR = "X-Next-Cursor"
+
+
+@dataclass(frozen=True)
+class FiltrosListado:
+    zona: Optional[List[str]] = None
+    precio_min: Optional[float] = None
+    precio_max: Optional[float] = None
+    m2_min: Optional[int] = None
+    m2_max: Optional[int] = None
+    habitaciones: Optional[List[int]] = None
+
+
+@dataclass(frozen=True)
+class Paginacion:
+    limit: Optional[int] = None
+    cursor: Optional[int] = None
+
+
+def filtros_listado(
+    zona: Optional[List[str]] = Query(None, description="Zonas (repetible o separadas por comas); basta con coincidir en una"),
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    m2_min: Optional[int] = Query(None, ge=0),
+    m2_max: Optional[int] = Query(None, ge=0),
+    habitaciones: Optional[List[int]] = Query(None, description="Repetible; basta con coincidir en una")
+) -> FiltrosListado:
+    return FiltrosListado(zona, precio_min, precio_max, m2_min, m2_max, habitaciones)
+
+
+def paginacion_listado(
+    limit: Optional[int] = Query(None, ge=1, le=LISTADO_MAX_LIMIT),
+    cursor: Optional[int] = Query(None, ge=0, description=f"Valor de la cabecera {CABECERA_CURSOR} de la página anterior")
+) -> Paginacion:
+    return Paginacion(limit, cursor)
+
+
+def campos_solicitados(fields: Optional[str], permitidos) -> Optional[list]:
+    """Parse fields= into a column list (id first); None means the full response model."""
+    if not fields:
+        return None
+    campos = [campo.strip() for campo in fields.split(",") if campo.strip()]
+    desconocidos = [campo for campo in campos if campo not in permitidos]
+    if desconocidos:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos en fields: {', '.join(desconocidos)}")
+    return ["id"] + [campo for campo in dict.fromkeys(campos) if campo != "id"]
+
+
+def aplicar_filtros(stmt, modelo, filtros: FiltrosListado):
+    """Add the zona / precio / m2 / habitaciones filters (all index-backed) to `stmt`."""
+    if filtros.zona:
+        zonas = normalizar_zonas(",".join(filtros.zona))
+        if zonas:
+            stmt = stmt.where(modelo.zonas.overlap(zonas))
+    if filtros.precio_min is not None:
+        stmt = stmt.where(modelo.precio >= filtros.precio_min)
+    if filtros.precio_max is not None:
+        stmt = stmt.where(modelo.precio <= filtros.precio_max)
+    if filtros.m2_min is not None:
+        stmt = stmt.where(modelo.m2 >= filtros.m2_min)
+    if filtros.m2_max is not None:
+        stmt = stmt.where(modelo.m2 <= filtros.m2_max)
+    if filtros.habitaciones:
+        stmt = stmt.where(habitaciones_array(modelo).overlap([str(h) for h in filtros.habitaciones]))
+    return stmt
+
+
+def paginar(stmt, modelo, pagina: Paginacion):
+    stmt = stmt.order_by(modelo.id)
+    if pagina.cursor is not None:
+        stmt = stmt.where(modelo.id > pagina.cursor)
+    if pagina.limit:
+        stmt = stmt.limit(pagina.limit + 1)  # Una de más para saber si hay otra página
+    return stmt
+
+
+def recortar_pagina(filas: list, pagina: Paginacion, response: Response) -> list:
+    """Drop the look-ahead row and, if there is a next page, set X-Next-Cursor."""
+    if pagina.limit and len(filas) > pagina.limit:
+        filas = filas[:pagina.limit]
+        response.headers[CABECERA_CURSOR] = str(filas[-1].id)
+    return filas
+
+
+def respuesta_proyectada(filas: list, response: Response) -> OrjsonResponse:
+    """Projected rows (dicts) as JSON, keeping the headers already set on `response` (ETag, cursor)."""
+    cabeceras = {nombre: valor for nombre, valor in response.headers.items() if nombre != "content-length"}
+    return OrjsonResponse(filas, headers=cabeceras)
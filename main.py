@@ -1,10 +1,13 @@
 # MatchingProps API - CORS Fixed Version
 import os
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from http_middleware import CORSMiddleware, CompressionMiddleware
 import auth, companias, usuarios, pisos, clientes, register, asesores
 from routers import match
 from models import create_db_and_tables
+import metrics
+import query_guard
 
 app = FastAPI(
     title="MatchingProps API",
@@ -47,63 +50,19 @@ else:
     print("🚀 Running in PRODUCTION environment")
     print(f"📡 CORS enabled for PRODUCTION origins: {origins}")
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # ✅ TEMPORAL: Máxima permisividad
-    allow_credentials=False,  # ✅ OBLIGATORIO con allow_origins=["*"]
-    allow_methods=["*"],  # ✅ TODOS los métodos
-    allow_headers=["*"],  # ✅ TODAS las cabeceras
-    expose_headers=["*"]
-)
+# ✅ CORS + errores 500 + compresión en middlewares ASGI puros (http_middleware.py)
+# - CORS abierto ("*", sin credenciales) en TODAS las respuestas, también en errores
+# - Preflight OPTIONS respondido directamente, sin llegar al router
+# - br/gzip negociado para respuestas grandes (también en streaming)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(CORSMiddleware)
 
-# ✅ MIDDLEWARE ADICIONAL PARA FORZAR CORS EN ERRORES 500
-@app.middleware("http")
-async def add_cors_headers(request, call_next):
-    response = await call_next(request)
-    
-    # ✅ FORZAR CORS HEADERS SIEMPRE (incluso en errores)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, HEAD, PATCH"
-    response.headers["Access-Control-Allow-Headers"] = "*"
-    response.headers["Access-Control-Expose-Headers"] = "*"
-    
-    return response
-
-# ✅ Add error handling middleware
-from fastapi.responses import JSONResponse  # AGREGAR ESTE IMPORT AL INICIO
-
-@app.middleware("http")
-async def catch_exceptions_middleware(request, call_next):
-    try:
-        response = await call_next(request)
-        
-        # ✅ ASEGURAR CORS EN TODAS LAS RESPUESTAS
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, HEAD, PATCH"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-        
-        return response
-        
-    except Exception as e:
-        import logging
-        logging.error(f"Unhandled exception: {str(e)}")
-        
-        # ✅ RESPONSE CON CORS HEADERS INCLUIDOS
-        response = JSONResponse(
-            status_code=500,
-            content={"detail": f"Internal server error: {str(e)}"}
-        )
-        
-        # ✅ FORZAR CORS EN ERRORES 500
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, HEAD, PATCH"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-        
-        return response
-
-# ❌ REMOVED CustomCORSMiddleware - it was conflicting with CORSMiddleware
-# ✅ Standard CORSMiddleware is sufficient and more reliable
+# 🔍 Detector de N+1 / lazy loads: solo con QUERY_GUARD=warn|raise (tests, staging)
+if query_guard.MODO:
+    app.add_middleware(query_guard.QueryGuardMiddleware)
+
+# 📊 Métricas por petición (el último añadido es el más externo: mide todo)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Initialize database
 create_db_and_tables()
@@ -117,6 +76,14 @@ async def health_check():
         "version": "1.0.0"
     }
 
+# 📊 Métricas en formato Prometheus (si METRICS_TOKEN está definido, se exige como Bearer)
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return PlainTextResponse("Unauthorized", status_code=401)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ✅ CORS test endpoint for debugging
 @app.get("/test-cors")
 async def test_cors():
@@ -126,17 +93,6 @@ async def test_cors():
         "origins": origins
     }
     
-# ✅ HANDLER EXPLÍCITO PARA PREFLIGHT - MEJORADO
-@app.options("/{path:path}")
-async def handle_options(path: str):
-    from fastapi import Response
-    response = Response()
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, HEAD, PATCH"
-    response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type, Accept, Origin, X-Requested-With"
-    response.headers["Access-Control-Max-Age"] = "3600"
-    return response
-
 # Include all routers
 app.include_router(auth.router)
 app.include_router(companias.router)
@@ -0,0 +1,296 @@
+"""
+Motor de scoring vectorizado (NumPy) para un piso contra todos los clientes de
+una compañía, y para un cliente contra todos sus pisos.
+
+Cada lado se guarda como struct-of-arrays construido a partir de los perfiles
+de match_profiles: máscaras de bits para los campos multi-valor (zona, estado,
+tipo_vivienda, altura) y arrays numéricos para precio, m2, habitaciones,
+ascensor, metro y flags. Las reglas son exactamente las de los check_* de
+routers/match.py; los resultados (score y penalizaciones) son idénticos a
+calculate_match_score_with_details.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from match_profiles import ClienteProfile, PisoProfile
+
+_MASCARA_64 = (1 << 64) - 1
+# Código para valores que no existen en el vocabulario del batch
+_DESCONOCIDO = -2
+_SIN_VALOR = -1
+
+
+class _Vocabulario:
+    """Asigna un bit a cada valor distinto visto en el lado 'batch'."""
+
+    def __init__(self, conjuntos):
+        self.indices: Dict[str, int] = {}
+        for conjunto in conjuntos:
+            for valor in conjunto:
+                if valor not in self.indices:
+                    self.indices[valor] = len(self.indices)
+        self.palabras = max(1, (len(self.indices) + 63) // 64)
+
+    def mascara(self, conjunto) -> int:
+        mascara = 0
+        for valor in conjunto:
+            indice = self.indices.get(valor)
+            if indice is not None:
+                mascara |= 1 << indice
+        return mascara
+
+    def matriz(self, conjuntos) -> np.ndarray:
+        filas = [self.mascara(c) for c in conjuntos]
+        matriz = np.zeros((len(filas), self.palabras), dtype=np.uint64)
+        for palabra in range(self.palabras):
+            desplazamiento = 64 * palabra
+            matriz[:, palabra] = [(m >> desplazamiento) & _MASCARA_64 for m in filas]
+        return matriz
+
+
+class _Codigos:
+    """Codifica valores escalares (interior) como enteros comparables."""
+
+    def __init__(self, valores):
+        self.indices: Dict[str, int] = {}
+        for valor in valores:
+            if valor is not None and valor not in self.indices:
+                self.indices[valor] = len(self.indices)
+
+    def codigo(self, valor) -> int:
+        if valor is None:
+            return _SIN_VALOR
+        return self.indices.get(valor, _DESCONOCIDO)
+
+
+def _intersecan(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a & b).any(axis=1)
+
+
+def _opcional(valores, vacio) -> np.ndarray:
+    return np.array([vacio if v is None else v for v in valores], dtype=np.int64)
+
+
+def _numerico(valores) -> np.ndarray:
+    # None y 0 son "falsy" en los check_* -> 0.0 significa "sin dato"
+    return np.array([float(v) if v else 0.0 for v in valores], dtype=np.float64)
+
+
+class _Lado:
+    """Struct-of-arrays común a clientes y pisos."""
+
+    def __init__(self, perfiles, vocabularios=None):
+        self.perfiles = tuple(perfiles)
+        self.n = len(self.perfiles)
+        self.ids = np.array([_SIN_VALOR if p.id is None else p.id for p in self.perfiles], dtype=np.int64)
+        if vocabularios is None:
+            vocabularios = self._vocabularios(self.perfiles)
+        self.vocabularios = vocabularios
+        zonas_v, estados_v, tipos_v, alturas_v, interior_c = vocabularios
+
+        self.zonas = zonas_v.matriz(p.zonas for p in self.perfiles)
+        self.estados = estados_v.matriz(p.estados for p in self.perfiles)
+        self.tipos = tipos_v.matriz(p.tipos_vivienda for p in self.perfiles)
+        self.alturas = alturas_v.matriz(p.alturas for p in self.perfiles)
+        self.con_estados = np.array([bool(p.estados) for p in self.perfiles], dtype=bool)
+        self.con_tipos = np.array([bool(p.tipos_vivienda) for p in self.perfiles], dtype=bool)
+        self.con_alturas = np.array([bool(p.alturas) for p in self.perfiles], dtype=bool)
+        self.habitaciones_invalidas = np.array([p.habitaciones_invalidas for p in self.perfiles], dtype=bool)
+        self.precio = _numerico(p.precio for p in self.perfiles)
+        self.m2 = _numerico(p.m2 for p in self.perfiles)
+        self.metro = _opcional((p.metro_rango for p in self.perfiles), _SIN_VALOR)
+        self.interior = np.array([interior_c.codigo(p.interior) for p in self.perfiles], dtype=np.int64)
+        self.bajos = np.array([p.bajos for p in self.perfiles], dtype=object)
+        self.entreplanta = np.array([p.entreplanta for p in self.perfiles], dtype=object)
+        self.balcon_terraza = np.array([p.balcon_terraza for p in self.perfiles], dtype=object)
+        self.patio = np.array([p.patio for p in self.perfiles], dtype=object)
+
+    @staticmethod
+    def _vocabularios(perfiles):
+        return (
+            _Vocabulario(p.zonas for p in perfiles),
+            _Vocabulario(p.estados for p in perfiles),
+            _Vocabulario(p.tipos_vivienda for p in perfiles),
+            _Vocabulario(p.alturas for p in perfiles),
+            _Codigos(p.interior for p in perfiles)
+        )
+
+    def __len__(self):
+        return self.n
+
+
+class ClienteBatch(_Lado):
+    """Clientes de una compañía como struct-of-arrays."""
+
+    def __init__(self, perfiles: Sequence[ClienteProfile], vocabularios=None):
+        super().__init__(perfiles, vocabularios)
+        self.con_habitaciones = np.array([p.habitaciones_min is not None for p in self.perfiles], dtype=bool)
+        self.habitaciones_min = _opcional((p.habitaciones_min for p in self.perfiles), 0)
+        self.ascensor_max_subida = _opcional((p.ascensor_max_subida for p in self.perfiles), _SIN_VALOR)
+        self.bajos_no = self.bajos == "NO"
+        self.entreplanta_no = self.entreplanta == "NO"
+        self.balcon_si = self.balcon_terraza == "SÍ"
+        self.patio_si = self.patio == "SÍ"
+
+
+class PisoBatch(_Lado):
+    """Pisos de una compañía como struct-of-arrays."""
+
+    def __init__(self, perfiles: Sequence[PisoProfile], vocabularios=None):
+        super().__init__(perfiles, vocabularios)
+        self.con_habitaciones = np.array([p.habitaciones_max is not None for p in self.perfiles], dtype=bool)
+        self.habitaciones_max = _opcional((p.habitaciones_max for p in self.perfiles), 0)
+        self.sin_ascensor = np.array([p.sin_ascensor for p in self.perfiles], dtype=bool)
+        # Sin planta (o no parseable) nunca penaliza, igual que planta <= 0
+        self.planta = _opcional((p.planta_num for p in self.perfiles), 0)
+        self.interior_ambos = np.array([p.interior == "AMBOS" for p in self.perfiles], dtype=bool)
+        self.bajos_si = self.bajos == "SÍ"
+        self.entreplanta_si = self.entreplanta == "SÍ"
+        self.balcon_no = self.balcon_terraza == "NO"
+        self.patio_no = self.patio == "NO"
+
+
+def _penalizacion_escalonada(porcentaje: np.ndarray) -> np.ndarray:
+    """5 si <=10%, 10 si <=20%, -1 (excluir) si más."""
+    return np.where(porcentaje <= 10, 5, np.where(porcentaje <= 20, 10, -1))
+
+
+def _puntuar(pisos: PisoBatch, clientes: ClienteBatch, min_score: int = 0):
+    """Score every (piso, cliente) pair; one of the two sides has length 1.
+
+    With min_score, the remaining criteria are skipped (all scores 0) once no
+    pair of the batch can still reach it.
+    """
+    filas = max(len(pisos), len(clientes))
+
+    # Zona: EXCLUIR si no hay intersección
+    excluido = ~_intersecan(pisos.zonas, clientes.zonas)
+
+    # Habitaciones: error de parseo -> score 0 (como el try/except original)
+    excluido |= clientes.habitaciones_invalidas
+    excluido |= pisos.habitaciones_invalidas & clientes.con_habitaciones
+    pen_habitaciones = np.where(
+        clientes.con_habitaciones
+        & (~pisos.con_habitaciones | (pisos.habitaciones_max < clientes.habitaciones_min)),
+        10, 0
+    )
+
+    # Estado / Tipo de vivienda: al menos un valor en común
+    pen_estado = np.where(
+        clientes.con_estados & ~(pisos.con_estados & _intersecan(pisos.estados, clientes.estados)), 10, 0
+    )
+    pen_tipo = np.where(
+        clientes.con_tipos & ~(pisos.con_tipos & _intersecan(pisos.tipos, clientes.tipos)), 10, 0
+    )
+
+    # Bajos / Entreplanta
+    pen_bajos = np.where(clientes.bajos_no & pisos.bajos_si, 10, 0)
+    pen_entreplanta = np.where(clientes.entreplanta_no & pisos.entreplanta_si, 10, 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Precio: % por encima del máximo del cliente
+        aplica = (pisos.precio != 0) & (clientes.precio != 0) & (pisos.precio > clientes.precio)
+        porcentaje = ((pisos.precio - clientes.precio) / clientes.precio) * 100
+        pen_precio = np.where(aplica, _penalizacion_escalonada(porcentaje), 0)
+
+        # Metros cuadrados: % por debajo del mínimo del cliente
+        aplica = (pisos.m2 != 0) & (clientes.m2 != 0) & (pisos.m2 < clientes.m2)
+        porcentaje = ((clientes.m2 - pisos.m2) / clientes.m2) * 100
+        pen_m2 = np.where(aplica, _penalizacion_escalonada(porcentaje), 0)
+
+    excluido = excluido | (pen_precio == -1) | (pen_m2 == -1)
+    if min_score:
+        # Las penalizaciones solo restan: si nadie llega ya al mínimo, no hay más que calcular
+        parcial = pen_habitaciones + pen_estado + pen_tipo + pen_bajos + pen_entreplanta
+        parcial = parcial + np.clip(pen_precio, 0, None) + np.clip(pen_m2, 0, None)
+        if not np.any(~excluido & (100 - parcial >= min_score)):
+            return np.zeros(filas, dtype=int), ()
+
+    # Ascensor: plantas a subir por encima de lo que acepta el cliente
+    exceso = pisos.planta - clientes.ascensor_max_subida
+    aplica = (clientes.ascensor_max_subida >= 0) & pisos.sin_ascensor & (pisos.planta > 0) & (exceso > 0)
+    pen_ascensor = np.where(aplica, np.where(exceso == 1, 5, np.where(exceso == 2, 10, -1)), 0)
+
+    # Cercanía metro: 5 por un nivel más lejos, 10 a partir de dos
+    desviacion = pisos.metro - clientes.metro
+    aplica = (clientes.metro >= 0) & (pisos.metro >= 0) & (desviacion > 0)
+    pen_metro = np.where(aplica, np.where(desviacion == 1, 5, 10), 0)
+
+    # Altura / Interior / Balcón-Terraza / Patio
+    pen_altura = np.where(
+        clientes.con_alturas & ~(pisos.con_alturas & _intersecan(pisos.alturas, clientes.alturas)), 5, 0
+    )
+    interior_ok = (pisos.interior != _SIN_VALOR) & (pisos.interior_ambos | (pisos.interior == clientes.interior))
+    pen_interior = np.where((clientes.interior != _SIN_VALOR) & ~interior_ok, 5, 0)
+    pen_balcon = np.where(clientes.balcon_si & pisos.balcon_no, 5, 0)
+    pen_patio = np.where(clientes.patio_si & pisos.patio_no, 5, 0)
+
+    excluido |= pen_ascensor == -1
+
+    # Mismo orden que calculate_match_score_with_details; color None = según penalty
+    penalizaciones = (
+        ('habitaciones', pen_habitaciones, 'red'),
+        ('estado', pen_estado, 'red'),
+        ('tipo_vivienda', pen_tipo, 'red'),
+        ('bajos', pen_bajos, 'red'),
+        ('entreplanta', pen_entreplanta, 'red'),
+        ('precio', pen_precio, None),
+        ('m2', pen_m2, None),
+        ('ascensor', pen_ascensor, None),
+        ('cercania_metro', pen_metro, None),
+        ('altura', pen_altura, 'yellow'),
+        ('interior', pen_interior, 'yellow'),
+        ('balcon_terraza', pen_balcon, 'yellow'),
+        ('patio', pen_patio, 'yellow'),
+    )
+    total = sum(np.clip(pen, 0, None) for _, pen, _ in penalizaciones)
+    score = np.where(excluido, 0, np.maximum(100 - total, 0))
+    return np.broadcast_to(score, (filas,)), penalizaciones
+
+
+def _resultados(ids: np.ndarray, score: np.ndarray, penalizaciones, min_score: int) -> List[Tuple[int, int, dict]]:
+    seleccion = np.nonzero(score >= min_score)[0]
+    if len(seleccion) == 0:
+        return []
+
+    columnas = [
+        (nombre, np.broadcast_to(pen, score.shape)[seleccion].tolist(), color)
+        for nombre, pen, color in penalizaciones
+    ]
+
+    resultados = []
+    for fila, (indice, valor) in enumerate(zip(ids[seleccion].tolist(), score[seleccion].tolist())):
+        detalle = {}
+        for nombre, valores, color in columnas:
+            penalty = valores[fila]
+            if penalty > 0:
+                detalle[nombre] = {'penalty': penalty, 'color': color or ('red' if penalty >= 10 else 'yellow')}
+        resultados.append((indice, valor, detalle))
+    return resultados
+
+
+def score_piso_against_clientes(piso: PisoProfile, clientes: ClienteBatch, min_score: int = 50) -> List[Tuple[int, int, dict]]:
+    """Score one piso against a ClienteBatch.
+
+    Returns (cliente_id, score, penalizaciones) for every cliente with
+    score >= min_score, in batch order.
+    """
+    if len(clientes) == 0:
+        return []
+    pisos = PisoBatch([piso], clientes.vocabularios)
+    score, penalizaciones = _puntuar(pisos, clientes, min_score)
+    return _resultados(clientes.ids, score, penalizaciones, min_score)
+
+
+def score_cliente_against_pisos(cliente: ClienteProfile, pisos: PisoBatch, min_score: int = 50) -> List[Tuple[int, int, dict]]:
+    """Score one cliente against a PisoBatch.
+
+    Returns (piso_id, score, penalizaciones) for every piso with
+    score >= min_score, in batch order.
+    """
+    if len(pisos) == 0:
+        return []
+    clientes = ClienteBatch([cliente], pisos.vocabularios)
+    score, penalizaciones = _puntuar(pisos, clientes, min_score)
+    return _resultados(pisos.ids, score, penalizaciones, min_score)
@@ -0,0 +1,229 @@
+"""
+Perfiles de matching precompilados para Cliente y Piso.
+
+Los campos multi-valor (zona, habitaciones, estado, tipo_vivienda, altura) se
+guardan como strings separados por comas. Aquí se parsean UNA sola vez por fila
+y el resultado se cachea por id + versión, de modo que puntuar un piso contra
+miles de clientes no vuelve a hacer split/int() en cada par.
+
+La versión de un perfil es la huella de las columnas que intervienen en el
+scoring: si otra instancia del API edita la fila, la huella cambia y el perfil
+se recompila aunque este proceso no haya recibido la invalidación explícita.
+"""
+import os
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, FrozenSet, Optional, Tuple
+
+# Distancias de metro ordenadas (mismo mapeo que usaba check_cercania_metro_match)
+METRO_DISTANCIAS = {
+    "0-5 MIN": 1,
+    "5-10 MIN": 2,
+    "10-15 MIN": 3,
+    "15-20 MIN": 4,
+    "+20 MIN": 5,
+    "INDIFERENTE": 999
+}
+
+# Plantas máximas que el cliente acepta subir sin ascensor
+ASCENSOR_MAX_SUBIDA = {
+    "SÍ": 0,
+    "Después de 1º": 1,
+    "Después de 2º": 2,
+    "Después de 3º": 3,
+    "Después de 4º": 4,
+    "Después de 5º": 5
+}
+
+MAX_PERFILES_CACHE = int(os.getenv("MATCH_PROFILE_CACHE_SIZE", "200000"))
+
+
+@dataclass(frozen=True)
+class ClienteProfile:
+    id: Optional[int]
+    zonas: FrozenSet[str]
+    habitaciones_min: Optional[int]  # None = sin preferencia
+    habitaciones_invalidas: bool  # El string original no se puede parsear
+    estados: FrozenSet[str]
+    tipos_vivienda: FrozenSet[str]
+    alturas: FrozenSet[str]
+    precio: Optional[float]
+    m2: Optional[int]
+    bajos: Optional[str]
+    entreplanta: Optional[str]
+    ascensor_max_subida: Optional[int]  # None = sin preferencia / INDIFERENTE
+    metro_rango: Optional[int]  # None = sin preferencia / INDIFERENTE
+    interior: Optional[str]  # None = sin preferencia / INDIFERENTE
+    balcon_terraza: Optional[str]
+    patio: Optional[str]
+
+
+@dataclass(frozen=True)
+class PisoProfile:
+    id: Optional[int]
+    zonas: FrozenSet[str]
+    habitaciones_max: Optional[int]  # None = el piso no especifica
+    habitaciones_invalidas: bool
+    estados: FrozenSet[str]
+    tipos_vivienda: FrozenSet[str]
+    alturas: FrozenSet[str]
+    precio: Optional[float]
+    m2: Optional[int]
+    bajos: Optional[str]
+    entreplanta: Optional[str]
+    sin_ascensor: bool  # ascensor == "NO"
+    planta_num: Optional[int]  # None = sin planta o no parseable (no penaliza)
+    metro_rango: Optional[int]  # None = el piso no especifica
+    interior: Optional[str]
+    balcon_terraza: Optional[str]
+    patio: Optional[str]
+
+
+def _split_zonas(valor: Optional[str]) -> FrozenSet[str]:
+    if not valor:
+        return frozenset()
+    return frozenset(zona.strip().upper() for zona in valor.split(",") if zona.strip())
+
+
+def _split(valor: Optional[str]) -> FrozenSet[str]:
+    # Sin strip(): los check_* originales comparaban los valores tal cual
+    return frozenset(valor.split(",")) if valor else frozenset()
+
+
+def _parse_habitaciones(valor: Optional[str]) -> Tuple[Tuple[int, ...], bool]:
+    """Devuelve (habitaciones, invalidas)."""
+    if not valor:
+        return (), False
+    try:
+        return tuple(int(x) for x in valor.split(",") if x.strip()), False
+    except ValueError:
+        return (), True
+
+
+def _parse_planta(planta: Optional[str]) -> Optional[int]:
+    if not planta:
+        return None
+    if planta == "Entreplanta":
+        return 0  # Se trata como nivel de calle
+    if planta == "-1":
+        return -1  # Sótano
+    try:
+        return int(planta)
+    except (ValueError, TypeError):
+        return None
+
+
+def compile_cliente(cliente) -> ClienteProfile:
+    """Parse a Cliente row into its matching profile."""
+    habitaciones, habitaciones_invalidas = _parse_habitaciones(cliente.habitaciones)
+    sin_preferencia_ascensor = not cliente.ascensor or cliente.ascensor == "INDIFERENTE"
+    sin_preferencia_metro = not cliente.cercania_metro or cliente.cercania_metro == "INDIFERENTE"
+    sin_preferencia_interior = not cliente.interior or cliente.interior == "INDIFERENTE"
+    return ClienteProfile(
+        id=cliente.id,
+        zonas=_split_zonas(cliente.zona),
+        habitaciones_min=min(habitaciones) if habitaciones else None,
+        habitaciones_invalidas=habitaciones_invalidas,
+        estados=_split(cliente.estado),
+        tipos_vivienda=_split(cliente.tipo_vivienda),
+        alturas=_split(cliente.altura),
+        precio=cliente.precio,
+        m2=cliente.m2,
+        bajos=cliente.bajos,
+        entreplanta=cliente.entreplanta,
+        ascensor_max_subida=None if sin_preferencia_ascensor else ASCENSOR_MAX_SUBIDA.get(cliente.ascensor, 0),
+        metro_rango=None if sin_preferencia_metro else METRO_DISTANCIAS.get(cliente.cercania_metro, 1),
+        interior=None if sin_preferencia_interior else cliente.interior,
+        balcon_terraza=cliente.balcon_terraza,
+        patio=cliente.patio
+    )
+
+
+def compile_piso(piso) -> PisoProfile:
+    """Parse a Piso row into its matching profile."""
+    habitaciones, habitaciones_invalidas = _parse_habitaciones(piso.habitaciones)
+    return PisoProfile(
+        id=piso.id,
+        zonas=_split_zonas(piso.zona),
+        habitaciones_max=max(habitaciones) if habitaciones else None,
+        habitaciones_invalidas=habitaciones_invalidas,
+        estados=_split(piso.estado),
+        tipos_vivienda=_split(piso.tipo_vivienda),
+        alturas=_split(piso.altura),
+        precio=piso.precio,
+        m2=piso.m2,
+        bajos=piso.bajos,
+        entreplanta=piso.entreplanta,
+        sin_ascensor=piso.ascensor == "NO",
+        planta_num=_parse_planta(piso.planta),
+        metro_rango=METRO_DISTANCIAS.get(piso.cercania_metro, 1) if piso.cercania_metro else None,
+        interior=piso.interior or None,
+        balcon_terraza=piso.balcon_terraza,
+        patio=piso.patio
+    )
+
+
+def _version_cliente(cliente) -> tuple:
+    return (
+        cliente.zona, cliente.habitaciones, cliente.estado, cliente.tipo_vivienda,
+        cliente.altura, cliente.precio, cliente.m2, cliente.bajos, cliente.entreplanta,
+        cliente.ascensor, cliente.cercania_metro, cliente.interior,
+        cliente.balcon_terraza, cliente.patio
+    )
+
+
+def _version_piso(piso) -> tuple:
+    return (
+        piso.zona, piso.habitaciones, piso.estado, piso.tipo_vivienda,
+        piso.altura, piso.precio, piso.m2, piso.bajos, piso.entreplanta,
+        piso.ascensor, piso.planta, piso.cercania_metro, piso.interior,
+        piso.balcon_terraza, piso.patio
+    )
+
+
+_cache_clientes: Dict[int, Tuple[tuple, ClienteProfile]] = {}
+_cache_pisos: Dict[int, Tuple[tuple, PisoProfile]] = {}
+_cache_lock = Lock()
+
+
+def _cached(cache: dict, fila, version_fn, compile_fn):
+    if fila.id is None:
+        return compile_fn(fila)  # Fila sin persistir: no se cachea
+
+    version = version_fn(fila)
+    entrada = cache.get(fila.id)
+    if entrada is not None and entrada[0] == version:
+        return entrada[1]
+
+    perfil = compile_fn(fila)
+    with _cache_lock:
+        if len(cache) >= MAX_PERFILES_CACHE:
+            cache.clear()  # Límite de memoria: se vuelve a poblar bajo demanda
+        cache[fila.id] = (version, perfil)
+    return perfil
+
+
+def cliente_profile(cliente) -> ClienteProfile:
+    """Return the cached profile for a Cliente (profiles are returned as-is)."""
+    if isinstance(cliente, ClienteProfile):
+        return cliente
+    return _cached(_cache_clientes, cliente, _version_cliente, compile_cliente)
+
+
+def piso_profile(piso) -> PisoProfile:
+    """Return the cached profile for a Piso (profiles are returned as-is)."""
+    if isinstance(piso, PisoProfile):
+        return piso
+    return _cached(_cache_pisos, piso, _version_piso, compile_piso)
+
+
+def invalidate_cliente(cliente_id: int):
+    """Drop the cached profile of a cliente after create/update/delete."""
+    with _cache_lock:
+        _cache_clientes.pop(cliente_id, None)
+
+
+def invalidate_piso(piso_id: int):
+    """Drop the cached profile of a piso after create/update/delete."""
+    with _cache_lock:
+        _cache_pisos.pop(piso_id, None)
@@ -0,0 +1,357 @@
+"""
+Tabla materializada de matches (models.Match).
+
+Cada escritura de pisos/clientes recalcula solo las filas afectadas: un piso
+contra los clientes candidatos de su compañía, o un cliente contra sus pisos
+candidatos. GET /match/ y la exportación leen después las filas ya puntuadas
+con una búsqueda por índice en lugar de recorrer pisos x clientes.
+
+Paralización de pisos y asignación de asesor NO cambian el score: las filas se
+mantienen y esos filtros se aplican al leer (join con pisos / clientes).
+
+Tras actualizar una BD anterior a la tabla, las compañías sin filas quedan con
+companias.matches_pendientes y se calculan enteras en su primera lectura
+(asegurar_matches_compania), no dentro de las migraciones del arranque.
+
+Los refrescos de una misma compañía se serializan con un lock sobre su fila de
+companias: si un piso y un cliente se crean a la vez, el segundo en llegar
+espera al commit del primero y su SELECT de candidatos ya ve la fila nueva
+(en READ COMMITTED cada sentencia toma un snapshot nuevo), así que el par no
+se pierde.
+"""
+import logging
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from models import Cliente, Compania, Piso, Match, SessionLocal
+from match_profiles import ClienteProfile, PisoProfile, cliente_profile, piso_profile
+from metrics import registrar_pares
+from match_batch import ClienteBatch, PisoBatch, score_piso_against_clientes, score_cliente_against_pisos
+
+logger = logging.getLogger(__name__)
+
+# Solo se materializan los pares que algún endpoint puede mostrar
+MIN_SCORE = 50
+
+# Orden de los criterios en el bitmask: 2 bits por criterio con penalty // 5
+# (1 = 5%, 2 = 10%). El color se deduce del penalty igual que en el scorer.
+CRITERIOS = (
+    'habitaciones', 'estado', 'tipo_vivienda', 'bajos', 'entreplanta',
+    'precio', 'm2', 'ascensor', 'cercania_metro',
+    'altura', 'interior', 'balcon_terraza', 'patio'
+)
+
+_INSERT_LOTE = 5000
+
+# Matriz pisos x clientes en paralelo: nº de procesos y tamaño mínimo (en pares)
+# por debajo del cual repartir el trabajo entre procesos cuesta más de lo que ahorra
+MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", str(os.cpu_count() or 1)))
+MATCH_PARALLEL_MIN_PARES = int(os.getenv("MATCH_PARALLEL_MIN_PARES", "2000000"))
+# Cada tarea lleva los clientes serializados: pocas tareas por proceso, pero
+# más de una para repartir bien la carga
+_TAREAS_POR_WORKER = 4
+
+# Margen relativo para que el redondeo en SQL nunca descarte un par que el
+# scorer aceptaría; los casos frontera los decide siempre check_precio/m2_match
+_MARGEN_PREFILTRO = 1e-9
+
+
+def encode_penalizaciones(penalizaciones: dict) -> int:
+    mascara = 0
+    for posicion, criterio in enumerate(CRITERIOS):
+        detalle = penalizaciones.get(criterio)
+        if detalle:
+            mascara |= (detalle['penalty'] // 5) << (2 * posicion)
+    return mascara
+
+
+def decode_penalizaciones(mascara: int) -> dict:
+    penalizaciones = {}
+    for posicion, criterio in enumerate(CRITERIOS):
+        codigo = (mascara >> (2 * posicion)) & 0b11
+        if codigo:
+            penalty = codigo * 5
+            penalizaciones[criterio] = {'penalty': penalty, 'color': 'red' if penalty >= 10 else 'yellow'}
+    return penalizaciones
+
+
+def filtros_clientes_para_piso(piso: Piso) -> list:
+    """SQL predicates dropping clientes the scorer would exclude for this piso (zona, precio, m2)."""
+    # Zona: al menos una en común -> escaneo del índice GIN sobre clientes.zonas
+    filtros = [Cliente.zonas.overlap(sorted(piso_profile(piso).zonas))]
+    if piso.precio:
+        # Excluido si el piso supera en más de un 20% el precio máximo del cliente
+        filtros.append(or_(
+            Cliente.precio.is_(None),
+            Cliente.precio <= 0,
+            Cliente.precio >= piso.precio / 1.2 * (1 - _MARGEN_PREFILTRO)
+        ))
+    if piso.m2:
+        # Excluido si el piso tiene más de un 20% menos de m2 que el mínimo del cliente
+        filtros.append(or_(
+            Cliente.m2.is_(None),
+            Cliente.m2 <= 0,
+            Cliente.m2 <= piso.m2 / 0.8 * (1 + _MARGEN_PREFILTRO)
+        ))
+    return filtros
+
+
+def filtros_pisos_para_cliente(cliente: Cliente) -> list:
+    """SQL predicates dropping pisos the scorer would exclude for this cliente (zona, precio, m2)."""
+    filtros = [Piso.zonas.overlap(sorted(cliente_profile(cliente).zonas))]
+    if cliente.precio and cliente.precio > 0:
+        filtros.append(or_(
+            Piso.precio.is_(None),
+            Piso.precio <= 0,
+            Piso.precio <= cliente.precio * 1.2 * (1 + _MARGEN_PREFILTRO)
+        ))
+    if cliente.m2 and cliente.m2 > 0:
+        filtros.append(or_(
+            Piso.m2.is_(None),
+            Piso.m2 <= 0,
+            Piso.m2 >= cliente.m2 * 0.8 * (1 - _MARGEN_PREFILTRO)
+        ))
+    return filtros
+
+
+def _insertar(db: Session, filas):
+    filas = iter(filas)
+    while True:
+        lote = list(islice(filas, _INSERT_LOTE))
+        if not lote:
+            break
+        db.execute(Match.__table__.insert(), lote)
+
+
+def borrar_matches_piso(db: Session, piso_id: int):
+    db.query(Match).filter(Match.piso_id == piso_id).delete(synchronize_session=False)
+
+
+def borrar_matches_cliente(db: Session, cliente_id: int):
+    db.query(Match).filter(Match.cliente_id == cliente_id).delete(synchronize_session=False)
+
+
+def bloquear_compania(db: Session, compania_id: int):
+    """Serialize match upkeep per company until the transaction ends.
+
+    FOR NO KEY UPDATE: the same lock the data_version UPDATE takes (see etags.py),
+    and compatible with the KEY SHARE locks of the FK checks on piso/cliente inserts.
+    """
+    db.execute(select(Compania.id).where(Compania.id == compania_id).with_for_update(key_share=True))
+
+
+def refrescar_matches_piso(db: Session, piso: Piso) -> int:
+    """Recompute the materialized matches of one piso (caller commits)."""
+    bloquear_compania(db, piso.compania_id)
+    borrar_matches_piso(db, piso.id)
+    clientes = db.query(Cliente).filter(
+        Cliente.compania_id == piso.compania_id,
+        *filtros_clientes_para_piso(piso)
+    ).order_by(Cliente.id).all()
+
+    batch = ClienteBatch([cliente_profile(cliente) for cliente in clientes])
+    registrar_pares(len(clientes))
+    filas = [
+        {
+            'cliente_id': match_cliente_id,
+            'piso_id': piso.id,
+            'compania_id': piso.compania_id,
+            'score': score,
+            'penalizaciones': encode_penalizaciones(penalizaciones)
+        }
+        for match_cliente_id, score, penalizaciones in score_piso_against_clientes(piso_profile(piso), batch, MIN_SCORE)
+    ]
+    _insertar(db, filas)
+    return len(filas)
+
+
+def refrescar_matches_cliente(db: Session, cliente: Cliente) -> int:
+    """Recompute the materialized matches of one cliente (caller commits)."""
+    bloquear_compania(db, cliente.compania_id)
+    borrar_matches_cliente(db, cliente.id)
+    # Incluye pisos paralizados: se filtran al leer y así reactivar no recalcula
+    pisos = db.query(Piso).filter(
+        Piso.compania_id == cliente.compania_id,
+        *filtros_pisos_para_cliente(cliente)
+    ).order_by(Piso.id).all()
+
+    batch = PisoBatch([piso_profile(piso) for piso in pisos])
+    registrar_pares(len(pisos))
+    filas = [
+        {
+            'cliente_id': cliente.id,
+            'piso_id': match_piso_id,
+            'compania_id': cliente.compania_id,
+            'score': score,
+            'penalizaciones': encode_penalizaciones(penalizaciones)
+        }
+        for match_piso_id, score, penalizaciones in score_cliente_against_pisos(cliente_profile(cliente), batch, MIN_SCORE)
+    ]
+    _insertar(db, filas)
+    return len(filas)
+
+
+# Pools de procesos, uno por nº de workers (en producción solo MATCH_WORKERS),
+# creados la primera vez que se usan y compartidos por todos los recálculos del
+# proceso: los procesos se arrancan una sola vez y varios /recalcular a la vez
+# se reparten los mismos workers en lugar de abrir un pool cada uno
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = Lock()
+
+# Estado de cada proceso del pool: el último batch de clientes recibido. Las
+# tareas de un mismo cálculo comparten clave, así que cada proceso deserializa
+# los clientes y construye el batch una vez por cálculo
+_clientes_worker: Tuple[Optional[str], Optional[ClienteBatch]] = (None, None)
+
+
+def _pool_matching(workers: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # spawn: no se hereda el estado de los hilos del servidor (pool de BD, locks)
+            pool = _pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return pool
+
+
+def _descartar_pool(workers: int, pool: ProcessPoolExecutor):
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+
+
+def cerrar_pools_matching():
+    """Shut down the process pools (they are recreated on the next use)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+def _puntuar_pisos(pisos: Sequence[PisoProfile], clientes: ClienteBatch, min_score: int) -> List[tuple]:
+    return [
+        (piso.id, match_cliente_id, score, encode_penalizaciones(penalizaciones))
+        for piso in pisos
+        for match_cliente_id, score, penalizaciones in score_piso_against_clientes(piso, clientes, min_score)
+    ]
+
+
+def _puntuar_pisos_worker(clave: str, clientes: bytes, pisos: Sequence[PisoProfile], min_score: int) -> List[tuple]:
+    global _clientes_worker
+    if _clientes_worker[0] != clave:
+        _clientes_worker = (clave, ClienteBatch(pickle.loads(clientes)))
+    return _puntuar_pisos(pisos, _clientes_worker[1], min_score)
+
+
+def calcular_matriz_matches(
+    pisos: Sequence[PisoProfile],
+    clientes: Sequence[ClienteProfile],
+    min_score: int = MIN_SCORE,
+    workers: int = None
+) -> List[tuple]:
+    """Score every piso against every cliente.
+
+    Returns (piso_id, cliente_id, score, penalizaciones_mask) in piso order and,
+    within a piso, in cliente order. Large matrices are split in chunks of
+    pisos and scored on the shared process pool; the result is the same as
+    sequential.
+    """
+    workers = workers or MATCH_WORKERS
+    if workers <= 1 or len(pisos) * len(clientes) < MATCH_PARALLEL_MIN_PARES:
+        return _puntuar_pisos(pisos, ClienteBatch(clientes), min_score)
+
+    por_tarea = -(-len(pisos) // (workers * _TAREAS_POR_WORKER))
+    trozos = [pisos[inicio:inicio + por_tarea] for inicio in range(0, len(pisos), por_tarea)]
+    # Los clientes se serializan una vez; cada tarea solo copia los bytes
+    clave, datos_clientes = uuid4().hex, pickle.dumps(list(clientes), protocol=pickle.HIGHEST_PROTOCOL)
+    pool = _pool_matching(workers)
+    filas = []
+    try:
+        # map conserva el orden de los trozos
+        for resultado in pool.map(
+            _puntuar_pisos_worker,
+            [clave] * len(trozos), [datos_clientes] * len(trozos), trozos, [min_score] * len(trozos)
+        ):
+            filas.extend(resultado)
+    except BrokenProcessPool:
+        # Un worker murió (OOM, kill): el siguiente cálculo arranca un pool nuevo
+        _descartar_pool(workers, pool)
+        raise
+    return filas
+
+
+def reconstruir_matches_compania(db: Session, compania_id: int) -> int:
+    """Rebuild every materialized match of a company (caller commits)."""
+    bloquear_compania(db, compania_id)
+    db.query(Match).filter(Match.compania_id == compania_id).delete(synchronize_session=False)
+    db.query(Compania).filter(Compania.id == compania_id).update(
+        {Compania.matches_pendientes: False}, synchronize_session=False
+    )
+
+    pisos = db.query(Piso).filter(Piso.compania_id == compania_id).order_by(Piso.id).all()
+    clientes = db.query(Cliente).filter(Cliente.compania_id == compania_id).order_by(Cliente.id).all()
+
+    registrar_pares(len(pisos) * len(clientes))
+    matriz = calcular_matriz_matches(
+        [piso_profile(piso) for piso in pisos],
+        [cliente_profile(cliente) for cliente in clientes]
+    )
+    _insertar(db, (
+        {
+            'cliente_id': match_cliente_id,
+            'piso_id': match_piso_id,
+            'compania_id': compania_id,
+            'score': score,
+            'penalizaciones': mascara
+        }
+        for match_piso_id, match_cliente_id, score, mascara in matriz
+    ))
+    return len(matriz)
+
+
+# Compañías con la tabla ya calculada, vistas por este proceso: el flag solo lo
+# pone la migración 12, así que una vez a False no vuelve a True
+_matches_al_dia = set()
+
+
+def matches_al_dia(compania_id: int) -> bool:
+    """True if this process already knows the company's matches are built (no query)."""
+    return compania_id in _matches_al_dia
+
+
+def asegurar_matches_compania(compania_id: int):
+    """Build the company's matches on its first read if it is still matches_pendientes.
+
+    Uses its own session and commits. Concurrent first reads wait on the
+    company lock and the later ones find the flag already cleared.
+    """
+    if compania_id in _matches_al_dia:
+        return
+    db = SessionLocal()
+    try:
+        consulta = select(Compania.matches_pendientes).where(Compania.id == compania_id)
+        if db.scalar(consulta):
+            bloquear_compania(db, compania_id)
+            # Relectura con el lock: otra petición pudo calcularla mientras esperábamos
+            if db.scalar(consulta):
+                total = reconstruir_matches_compania(db, compania_id)
+                logger.info(f"Matches de la compañía {compania_id} calculados en su primera lectura: {total}")
+            db.commit()
+        _matches_al_dia.add(compania_id)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
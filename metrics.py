@@ -0,0 +1,240 @@
+"""
+Métricas por petición en formato Prometheus (GET /metrics).
+
+MetricsMiddleware (ASGI puro) mide cada petición y la etiqueta con la plantilla
+de la ruta (p.ej. "/match/", no "/match/?piso_id=7") y con la compañía del
+usuario autenticado, que get_current_user fija con set_tenant(). El número de
+sentencias SQL y el tiempo en BD salen de los eventos de los engines de models
+(el síncrono y el async_engine).
+
+Las métricas viven en memoria del proceso: con varios workers de uvicorn cada
+uno expone las suyas y Prometheus las agrega.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from models import engine, async_engine, pool_stats
+
+# Buckets de latencia (segundos) del histograma por ruta
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SIN_RUTA = "unmatched"  # 404s: no se etiqueta con el path real (cardinalidad)
+SIN_TENANT = "none"
+
+
+class _EstadoPeticion:
+    """Acumuladores de la petición en curso (compartidos con el threadpool)."""
+    __slots__ = ("sql", "db_segundos", "pares", "tenant")
+
+    def __init__(self):
+        self.sql = 0
+        self.db_segundos = 0.0
+        self.pares = 0
+        self.tenant = SIN_TENANT
+
+
+_peticion: ContextVar[Optional[_EstadoPeticion]] = ContextVar("metrics_peticion", default=None)
+
+_lock = Lock()
+# (method, route, status) -> [cuentas por bucket..., +Inf], suma
+_latencias: Dict[Tuple[str, str, str], Tuple[List[int], List[float]]] = {}
+# (route, tenant) -> contadores
+_por_tenant: Dict[Tuple[str, str], Dict[str, float]] = {}
+# Fuera de una petición (migraciones, tareas) solo se cuentan totales
+_fuera_de_peticion = {"sql": 0, "db_segundos": 0.0, "pares": 0}
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def set_tenant(compania_id) -> None:
+    """Tag the current request with the authenticated user's compania."""
+    estado = _peticion.get()
+    if estado is not None:
+        estado.tenant = str(compania_id)
+
+
+def registrar_pares(pares: int) -> None:
+    """Count (piso, cliente) pairs scored by the current request."""
+    estado = _peticion.get()
+    if estado is not None:
+        estado.pares += pares
+    else:
+        with _lock:
+            _fuera_de_peticion["pares"] += pares
+
+
+def registrar_collector(collector: Callable[[], Iterable[str]]) -> None:
+    """Register a callable returning extra Prometheus text lines for /metrics."""
+    _collectors.append(collector)
+
+
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_inicio", []).append(time.perf_counter())
+
+
+def _despues_sql(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("metrics_inicio")
+    if not inicios:
+        return
+    duracion = time.perf_counter() - inicios.pop()
+    estado = _peticion.get()
+    if estado is not None:
+        estado.sql += 1
+        estado.db_segundos += duracion
+    else:
+        with _lock:
+            _fuera_de_peticion["sql"] += 1
+            _fuera_de_peticion["db_segundos"] += duracion
+
+
+def _error_sql(context):
+    # Sin after_cursor_execute: descartar el inicio pendiente
+    inicios = context.connection.info.get("metrics_inicio") if context.connection is not None else None
+    if inicios:
+        inicios.pop()
+
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _antes_sql)
+    event.listen(_engine, "after_cursor_execute", _despues_sql)
+    event.listen(_engine, "handle_error", _error_sql)
+
+
+def _observar(method: str, ruta: str, status: int, segundos: float, bytes_enviados: int, estado: _EstadoPeticion):
+    with _lock:
+        cuentas, suma = _latencias.setdefault((method, ruta, str(status)), ([0] * (len(BUCKETS) + 1), [0.0]))
+        cuentas[bisect_left(BUCKETS, segundos)] += 1
+        suma[0] += segundos
+
+        contadores = _por_tenant.setdefault((ruta, estado.tenant), {
+            "peticiones": 0, "sql": 0, "db_segundos": 0.0, "bytes": 0, "pares": 0
+        })
+        contadores["peticiones"] += 1
+        contadores["sql"] += estado.sql
+        contadores["db_segundos"] += estado.db_segundos
+        contadores["bytes"] += bytes_enviados
+        contadores["pares"] += estado.pares
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: latency, SQL count/time, bytes and pairs per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        estado = _EstadoPeticion()
+        token = _peticion.set(estado)
+        inicio = time.perf_counter()
+        respuesta = {"status": 500, "bytes": 0}
+
+        async def send_con_metricas(message):
+            if message["type"] == "http.response.start":
+                respuesta["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                respuesta["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_metricas)
+        finally:
+            route = scope.get("route")
+            ruta = getattr(route, "path", None) or SIN_RUTA
+            _observar(
+                scope["method"], ruta, respuesta["status"],
+                time.perf_counter() - inicio, respuesta["bytes"], estado
+            )
+            _peticion.reset(token)
+
+
+def _etiquetas(**etiquetas) -> str:
+    partes = []
+    for nombre, valor in etiquetas.items():
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+def _metricas_pool() -> List[str]:
+    por_pool = pool_stats()
+    lineas = []
+    contadores = (
+        ("db_pool_checkouts_total", "checkouts", "Conexiones entregadas por el pool"),
+        ("db_pool_connections_created_total", "conexiones", "Conexiones nuevas abiertas contra Postgres/PgBouncer"),
+        ("db_pool_checkout_wait_seconds_total", "espera_segundos", "Tiempo esperando una conexión del pool"),
+        ("db_pool_timeouts_total", "timeouts", "Esperas que agotaron DB_POOL_TIMEOUT"),
+    )
+    for nombre, clave, ayuda in contadores:
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} counter")
+        for pool, stats in por_pool.items():
+            lineas.append(f"{nombre}{_etiquetas(pool=pool)} {stats[clave]}")
+    gauges = (
+        ("db_pool_checkout_wait_max_seconds", "espera_maxima", "Mayor espera de una conexión desde el arranque"),
+        ("db_pool_size", "tamano", "Conexiones permanentes del pool"),
+        ("db_pool_checked_out", "en_uso", "Conexiones en uso"),
+        ("db_pool_checked_in", "libres", "Conexiones libres en el pool"),
+        ("db_pool_overflow", "overflow", "Conexiones de overflow abiertas"),
+    )
+    for nombre, clave, ayuda in gauges:
+        series = [(pool, stats[clave]) for pool, stats in por_pool.items() if clave in stats]
+        if series:  # Sin ocupación con PgBouncer (NullPool)
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} gauge")
+            lineas.extend(f"{nombre}{_etiquetas(pool=pool)} {valor}" for pool, valor in series)
+    return lineas
+
+
+def render() -> str:
+    """Render every metric in Prometheus text exposition format (0.0.4)."""
+    lineas = []
+    with _lock:
+        lineas.append("# HELP http_request_duration_seconds Latencia de las peticiones HTTP por ruta")
+        lineas.append("# TYPE http_request_duration_seconds histogram")
+        for (method, ruta, status), (cuentas, suma) in sorted(_latencias.items()):
+            acumulado = 0
+            for limite, cuenta in zip(BUCKETS + ("+Inf",), cuentas):
+                acumulado += cuenta
+                lineas.append(
+                    f"http_request_duration_seconds_bucket{_etiquetas(method=method, route=ruta, status=status, le=limite)} {acumulado}"
+                )
+            base = _etiquetas(method=method, route=ruta, status=status)
+            lineas.append(f"http_request_duration_seconds_sum{base} {suma[0]}")
+            lineas.append(f"http_request_duration_seconds_count{base} {acumulado}")
+
+        por_tenant = (
+            ("http_requests_total", "peticiones", "Peticiones por ruta y compañía"),
+            ("db_statements_total", "sql", "Sentencias SQL ejecutadas por ruta y compañía"),
+            ("db_seconds_total", "db_segundos", "Tiempo en base de datos por ruta y compañía"),
+            ("http_response_bytes_total", "bytes", "Bytes de respuesta por ruta y compañía"),
+            ("match_pairs_scored_total", "pares", "Pares piso/cliente puntuados por ruta y compañía"),
+        )
+        for nombre, clave, ayuda in por_tenant:
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} counter")
+            for (ruta, tenant), contadores in sorted(_por_tenant.items()):
+                lineas.append(f"{nombre}{_etiquetas(route=ruta, tenant=tenant)} {contadores[clave]}")
+
+        lineas.append("# HELP background_db_statements_total Sentencias SQL fuera de peticiones HTTP")
+        lineas.append("# TYPE background_db_statements_total counter")
+        lineas.append(f"background_db_statements_total {_fuera_de_peticion['sql']}")
+        lineas.append("# HELP background_db_seconds_total Tiempo en base de datos fuera de peticiones HTTP")
+        lineas.append("# TYPE background_db_seconds_total counter")
+        lineas.append(f"background_db_seconds_total {_fuera_de_peticion['db_segundos']}")
+        lineas.append("# HELP background_match_pairs_scored_total Pares puntuados fuera de peticiones HTTP")
+        lineas.append("# TYPE background_match_pairs_scored_total counter")
+        lineas.append(f"background_match_pairs_scored_total {_fuera_de_peticion['pares']}")
+
+    lineas.extend(_metricas_pool())
+
+    for collector in _collectors:
+        lineas.extend(collector())
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,209 @@
+"""
+Migraciones de esquema versionadas.
+
+Cada migración tiene un número y se aplica una sola vez: la tabla
+schema_version guarda la última aplicada. En el arranque (main.py) basta con
+leer esa fila; solo si la BD va por detrás se ejecutan las pendientes, en
+orden. Con varios workers o instancias arrancando a la vez, un advisory lock
+de Postgres garantiza que solo uno migra; el resto espera y, al obtener el
+lock, vuelve a leer la versión (ya al día) y arranca sin tocar nada.
+
+Todas las migraciones son idempotentes, así que una BD anterior a este
+sistema (sin schema_version) las ejecuta todas sin cambiar nada que ya exista.
+
+Para añadir una migración: escribir la función migrate_* en models.py y
+añadirla AL FINAL de MIGRACIONES (nunca reordenar ni renumerar). Una tabla
+nueva también necesita su migración (create_all solo corre en la versión 1).
+
+Uso desde la raíz del repo:
+
+    python -m migrations             # aplicar las pendientes
+    python -m migrations status      # versión de la BD y pendientes
+    python -m migrations upgrade --hasta 5
+    python -m migrations matches     # calcular ya la tabla matches de las compañías pendientes
+
+El contenido de la tabla matches no se calcula en las migraciones (ver
+migrate_populate_matches): la migración 12 marca las compañías sin filas
+(companias.matches_pendientes) y cada una se calcula en su primera lectura
+de matches, sin el lock de migraciones. "matches" las adelanta todas.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import exc as sa_exc, text
+
+from models import (
+    engine, SessionLocal, SchemaVersion, companias_matches_pendientes, poblar_matches,
+    migrate_create_tables,
+    migrate_add_paralizado_column,
+    migrate_create_zonas_table,
+    migrate_add_fecha_caducidad_trial,
+    migrate_add_match_indexes,
+    migrate_add_zonas_array,
+    migrate_populate_matches,
+    migrate_add_token_version,
+    migrate_add_data_version,
+    migrate_add_listado_indexes,
+    migrate_add_estado_indexes,
+    migrate_add_matches_pendientes,
+)
+
+# (versión, nombre, función): orden de aplicación
+MIGRACIONES = [
+    (1, "create_tables", migrate_create_tables),
+    (2, "add_paralizado_column", migrate_add_paralizado_column),
+    (3, "create_zonas_table", migrate_create_zonas_table),
+    (4, "add_fecha_caducidad_trial", migrate_add_fecha_caducidad_trial),
+    (5, "add_match_indexes", migrate_add_match_indexes),
+    (6, "add_zonas_array", migrate_add_zonas_array),
+    (7, "populate_matches", migrate_populate_matches),
+    (8, "add_token_version", migrate_add_token_version),
+    (9, "add_data_version", migrate_add_data_version),
+    (10, "add_listado_indexes", migrate_add_listado_indexes),
+    (11, "add_estado_indexes", migrate_add_estado_indexes),
+    (12, "add_matches_pendientes", migrate_add_matches_pendientes),
+]
+
+SCHEMA_VERSION = MIGRACIONES[-1][0]
+
+# Con AUTO_MIGRATE=false el arranque no migra: falla si la BD va por detrás
+# (las migraciones se lanzan antes con python -m migrations)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() == "true"
+
+# Clave del advisory lock (cualquier bigint fijo, compartido por todos los procesos)
+MIGRATION_LOCK_ID = 7346142019
+MIGRATION_LOCK_TIMEOUT = float(os.getenv("MIGRATION_LOCK_TIMEOUT", "300"))  # Segundos
+_ESPERA_LOCK = 0.5
+_AVISO_LOCK = 10  # Cada cuántos segundos de espera se avisa en el log
+
+
+def version_actual() -> int:
+    """Schema version stored in the database (0 if never migrated)."""
+    try:
+        with engine.connect() as conn:
+            version = conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar()
+    except sa_exc.ProgrammingError:
+        return 0  # Tabla schema_version todavía no existe
+    return version or 0
+
+
+def _guardar_version(db, version: int):
+    fila = db.get(SchemaVersion, 1)
+    if fila is None:
+        fila = SchemaVersion(id=1, version=version)
+        db.add(fila)
+    fila.version = version
+    fila.fecha_actualizacion = datetime.now().isoformat()
+    db.commit()
+
+
+def _esperar_lock(conn):
+    """Poll pg_try_advisory_xact_lock until it is ours (released when conn's transaction ends)."""
+    inicio = time.monotonic()
+    siguiente_aviso = _AVISO_LOCK
+    while not conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID}).scalar():
+        esperado = time.monotonic() - inicio
+        if esperado > MIGRATION_LOCK_TIMEOUT:
+            raise RuntimeError(f"Lock de migraciones no disponible tras {esperado:.0f}s: otro proceso sigue migrando")
+        if esperado >= siguiente_aviso:
+            print(f"⏳ Esperando el lock de migraciones ({esperado:.0f}s)...")
+            siguiente_aviso += _AVISO_LOCK
+        time.sleep(_ESPERA_LOCK)
+    esperado = time.monotonic() - inicio
+    print(f"🔒 Lock de migraciones obtenido en {esperado:.2f}s (pid {os.getpid()})")
+
+
+def _pendientes(version: int, hasta: int) -> list:
+    return [(numero, nombre, funcion) for numero, nombre, funcion in MIGRACIONES if version < numero <= hasta]
+
+
+def migrar(hasta: int = SCHEMA_VERSION) -> int:
+    """Apply every pending migration up to `hasta`; returns the resulting version.
+
+    Holds a Postgres advisory lock for the whole run, so concurrent workers
+    migrate one at a time and the later ones find nothing left to do.
+    """
+    version = version_actual()
+    if not _pendientes(version, hasta):
+        return version
+
+    # Lock de transacción (no de sesión): también funciona detrás de PgBouncer
+    # en modo transaction. Se libera al cerrar la transacción, pase lo que pase.
+    with engine.connect() as conn_lock, conn_lock.begin():
+        _esperar_lock(conn_lock)
+        # Doble comprobación: mientras esperábamos, otro proceso pudo migrar
+        version = version_actual()
+        pendientes = _pendientes(version, hasta)
+        if not pendientes:
+            print(f"✅ Esquema ya migrado por otro proceso (versión {version})")
+            return version
+        return _aplicar(pendientes, version)
+
+
+def _aplicar(pendientes: list, version: int) -> int:
+    SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        for numero, nombre, funcion in pendientes:
+            print(f"🔄 MIGRACIÓN {numero}: {nombre}")
+            funcion()
+            # Una versión por migración: si una falla, el siguiente arranque
+            # continúa desde ella y no repite las anteriores
+            _guardar_version(db, numero)
+            version = numero
+    finally:
+        db.close()
+    print(f"✅ Esquema en la versión {version}")
+    return version
+
+
+def verificar_esquema():
+    """Startup check: one SELECT when up to date, migrate (or fail) otherwise."""
+    version = version_actual()
+    if version >= SCHEMA_VERSION:
+        print(f"✅ Esquema al día (versión {version})")
+        return
+    if not AUTO_MIGRATE:
+        raise RuntimeError(
+            f"Esquema en la versión {version}, se necesita la {SCHEMA_VERSION}: ejecuta 'python -m migrations'"
+        )
+    migrar()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migraciones de esquema")
+    parser.add_argument("accion", nargs="?", choices=["upgrade", "status", "matches"], default="upgrade")
+    parser.add_argument("--hasta", type=int, default=SCHEMA_VERSION, help="última versión a aplicar")
+    args = parser.parse_args(argv)
+
+    version = version_actual()
+    if args.accion == "status":
+        print(f"Versión de la BD: {version} (código: {SCHEMA_VERSION})")
+        for numero, nombre, _ in MIGRACIONES:
+            print(f"  {'✅' if numero <= version else '⏳'} {numero:>3} {nombre}")
+        if version >= SCHEMA_VERSION:
+            db = SessionLocal()
+            try:
+                pendientes = companias_matches_pendientes(db)
+            finally:
+                db.close()
+            if pendientes:
+                print(f"⚠️ {len(pendientes)} compañía(s) sin matches calculados (se calculan en su primera lectura o con: python -m migrations matches)")
+        return 0 if version >= SCHEMA_VERSION else 1
+
+    if args.accion == "matches":
+        if version < SCHEMA_VERSION:
+            print(f"❌ Esquema en la versión {version}: ejecuta antes 'python -m migrations'")
+            return 1
+        poblar_matches()
+        return 0
+
+    migrar(args.hasta)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
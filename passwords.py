@@ -0,0 +1,132 @@
+"""
+Hash y verificación de contraseñas (bcrypt) en un executor propio y acotado.
+
+bcrypt cuesta ~250ms de CPU por operación. Ejecutado directamente en los
+endpoints ocupa el threadpool compartido de Starlette y, en picos de login
+(entrada a la oficina), deja sin hilos al resto de la API. Aquí:
+
+- PASSWORD_HASH_WORKERS hilos hacen el trabajo de bcrypt (concurrencia máxima)
+- PASSWORD_HASH_QUEUE limita las operaciones en curso + en espera; a partir de
+  ahí se responde 503 con Retry-After al instante en lugar de encolar
+- BCRYPT_ROUNDS ajusta el coste de los hashes nuevos (verify acepta cualquiera)
+
+hash_password / verify_password son corrutinas: los endpoints (async) esperan
+el resultado en el event loop, sin ocupar ningún hilo del threadpool mientras
+bcrypt trabaja o la operación espera turno.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from metrics import registrar_collector
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "16"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
+
+# bcrypt solo usa los primeros 72 bytes
+MAX_PASSWORD_BYTES = 72
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_plazas = BoundedSemaphore(PASSWORD_HASH_QUEUE)
+
+_lock = Lock()
+_en_curso = 0
+# operacion -> contadores
+_estadisticas = {
+    operacion: {"total": 0, "rechazadas": 0, "cpu_segundos": 0.0, "espera_segundos": 0.0}
+    for operacion in ("hash", "verify")
+}
+
+
+def _truncar(password: str) -> bytes:
+    # En bytes, no en caracteres: "ñ" o una tilde ocupan 2 en UTF-8 y las versiones
+    # nuevas de bcrypt rechazan (ValueError) más de 72 bytes en vez de recortar
+    return password.encode("utf-8")[:MAX_PASSWORD_BYTES]
+
+
+async def _ejecutar(operacion: str, funcion, *args):
+    global _en_curso
+    if not _plazas.acquire(blocking=False):
+        with _lock:
+            _estadisticas[operacion]["rechazadas"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio de autenticación saturado, inténtalo de nuevo en unos segundos",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)}
+        )
+
+    encolado = time.perf_counter()
+
+    def trabajo():
+        espera = time.perf_counter() - encolado
+        inicio = time.thread_time()
+        try:
+            return funcion(*args)
+        finally:
+            with _lock:
+                contadores = _estadisticas[operacion]
+                contadores["total"] += 1
+                contadores["cpu_segundos"] += time.thread_time() - inicio
+                contadores["espera_segundos"] += espera
+
+    def liberar(_futuro):
+        global _en_curso
+        with _lock:
+            _en_curso -= 1
+        _plazas.release()
+
+    with _lock:
+        _en_curso += 1
+    futuro = _executor.submit(trabajo)
+    # La plaza se libera cuando termina (o se cancela) el trabajo, no cuando deja
+    # de esperarlo la petición: si el cliente corta, bcrypt sigue ocupando su hilo
+    futuro.add_done_callback(liberar)
+    return await asyncio.wrap_future(futuro)
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password on the bcrypt executor (503 if it is saturated)."""
+    return await _ejecutar("hash", pwd_context.hash, _truncar(password))
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    """Check a password against its hash on the bcrypt executor (503 if it is saturated)."""
+    return await _ejecutar("verify", pwd_context.verify, _truncar(password), hashed)
+
+
+def _metricas():
+    with _lock:
+        yield "# HELP auth_password_operations_total Operaciones bcrypt completadas"
+        yield "# TYPE auth_password_operations_total counter"
+        for operacion, contadores in _estadisticas.items():
+            yield f'auth_password_operations_total{{operation="{operacion}"}} {contadores["total"]}'
+        yield "# HELP auth_password_rejected_total Operaciones bcrypt rechazadas con 503 por cola llena"
+        yield "# TYPE auth_password_rejected_total counter"
+        for operacion, contadores in _estadisticas.items():
+            yield f'auth_password_rejected_total{{operation="{operacion}"}} {contadores["rechazadas"]}'
+        yield "# HELP auth_password_cpu_seconds_total Tiempo de CPU dedicado a bcrypt"
+        yield "# TYPE auth_password_cpu_seconds_total counter"
+        for operacion, contadores in _estadisticas.items():
+            yield f'auth_password_cpu_seconds_total{{operation="{operacion}"}} {contadores["cpu_segundos"]}'
+        yield "# HELP auth_password_queue_seconds_total Tiempo en cola antes de llegar a un hilo bcrypt"
+        yield "# TYPE auth_password_queue_seconds_total counter"
+        for operacion, contadores in _estadisticas.items():
+            yield f'auth_password_queue_seconds_total{{operation="{operacion}"}} {contadores["espera_segundos"]}'
+        yield "# HELP auth_password_in_flight Operaciones bcrypt en curso o en cola"
+        yield "# TYPE auth_password_in_flight gauge"
+        yield f"auth_password_in_flight {_en_curso}"
+        yield "# HELP auth_password_queue_limit Máximo de operaciones bcrypt en curso o en cola"
+        yield "# TYPE auth_password_queue_limit gauge"
+        yield f"auth_password_queue_limit {PASSWORD_HASH_QUEUE}"
+
+
+registrar_collector(_metricas)
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
-from models import get_db, Piso
+from models import get_db, get_async_db, Piso, normalizar_zonas
 from utils import get_current_user
+from match_profiles import invalidate_piso
+from match_store import bloquear_compania, refrescar_matches_piso, borrar_matches_piso
+from etags import incrementar_version_datos, consulta_version, etag_lista, respuesta_condicional
+from listados import (
+    FiltrosListado, Paginacion, filtros_listado, paginacion_listado, campos_solicitados,
+    aplicar_filtros, paginar, recortar_pagina, respuesta_proyectada
+)
 
 router = APIRouter(prefix="/pisos", tags=["pisos"])
 
@@ -54,6 +63,16 @@ class PisoResponse(BaseModel):
     paralizado: Optional[str] = "NO"  # NUEVO: Campo para paralizar pisos
     compania_id: int
 
+CAMPOS_PISO = tuple(PisoResponse.model_fields)
+
+def consulta_pisos(compania_id: int, filtros: FiltrosListado, pagina: Paginacion, campos: Optional[list] = None, paralizado: Optional[bool] = None):
+    """SELECT shared by the pisos lists: whole Piso rows, or only the `campos` columns."""
+    stmt = select(*(getattr(Piso, campo) for campo in campos)) if campos else select(Piso)
+    stmt = stmt.where(Piso.compania_id == compania_id)
+    if paralizado is not None:
+        stmt = stmt.where(Piso.paralizado == "SÍ" if paralizado else Piso.paralizado != "SÍ")
+    return paginar(aplicar_filtros(stmt, Piso, filtros), Piso, pagina)
+
 @router.post("/", response_model=PisoResponse)
 def create_piso(piso: PisoCreate, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
     if piso.compania_id != current_user.compania_id:
@@ -91,9 +110,16 @@ def create_piso(piso: PisoCreate, db: Session = Depends(get_db), current_user=De
             paralizado=piso.paralizado or "NO",  # NUEVO: Campo para paralizar pisos
             compania_id=piso.compania_id
         )
+        # Desde el texto guardado: un elemento con comas ("ALTO,OLIVOS") son varias zonas, como en el matching
+        db_piso.zonas = normalizar_zonas(db_piso.zona)
         db.add(db_piso)
+        db.flush()
+        # Matches del nuevo piso en la misma transacción
+        refrescar_matches_piso(db, db_piso)
+        incrementar_version_datos(db, db_piso.compania_id)
         db.commit()
         db.refresh(db_piso)
+        invalidate_piso(db_piso.id)
         return db_piso
     except HTTPException:
         db.rollback()
@@ -108,13 +134,27 @@ def create_piso(piso: PisoCreate, db: Session = Depends(get_db), current_user=De
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @router.get("/", response_model=list[PisoResponse])
-def read_pisos(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def read_pisos(
+    request: Request,
+    response: Response,
+    filtros: FiltrosListado = Depends(filtros_listado),
+    pagina: Paginacion = Depends(paginacion_listado),
+    fields: Optional[str] = Query(None, description="Campos separados por comas (id siempre incluido)"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user)
+):
+    version = await db.scalar(consulta_version(current_user.compania_id))
+    no_modificado = respuesta_condicional(request, response, etag_lista("pisos", current_user.compania_id, version))
+    if no_modificado:
+        return no_modificado
+
     # Solo mostrar pisos ACTIVOS (no paralizados) para búsquedas
-    pisos = db.query(Piso).filter(
-        Piso.compania_id == current_user.compania_id,
-        Piso.paralizado != "SÍ"
-    ).all()
-    return pisos
+    campos = campos_solicitados(fields, CAMPOS_PISO)
+    stmt = consulta_pisos(current_user.compania_id, filtros, pagina, campos, paralizado=False)
+    if campos:
+        filas = recortar_pagina((await db.execute(stmt)).all(), pagina, response)
+        return respuesta_proyectada([dict(fila._mapping) for fila in filas], response)
+    return recortar_pagina((await db.scalars(stmt)).all(), pagina, response)
 
 @router.delete("/{piso_id}")
 def delete_piso(piso_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
@@ -151,9 +191,15 @@ def delete_piso(piso_id: int, db: Session = Depends(get_db), current_user=Depend
             for estado in estados_relacionados:
                 db.delete(estado)
         
-        # Eliminar el piso
+        # Eliminar el piso y sus matches precalculados. Con la compañía bloqueada,
+        # como en los refrescos: un alta concurrente no puede insertar un match
+        # de este piso después de borrarlos (rompería la FK al borrar el piso)
+        bloquear_compania(db, piso.compania_id)
+        borrar_matches_piso(db, piso_id)
         db.delete(piso)
+        incrementar_version_datos(db, piso.compania_id)
         db.commit()
+        invalidate_piso(piso_id)
         
         logger.info(f"Piso {piso_direccion} eliminado exitosamente por {current_user.rol}")
         return {"message": f"Piso {piso_direccion} eliminado exitosamente"}
@@ -206,6 +252,7 @@ def update_piso(
         # Actualizar campos
         piso.direccion = piso_data.direccion.strip() if piso_data.direccion else None
         piso.zona = ",".join(piso_data.zona) if isinstance(piso_data.zona, list) else str(piso_data.zona)
+        piso.zonas = normalizar_zonas(piso.zona)
         piso.subzonas = piso_data.subzonas.strip() if piso_data.subzonas else None
         piso.precio = float(piso_data.precio)
         piso.tipo_vivienda = ",".join(piso_data.tipo_vivienda) if piso_data.tipo_vivienda else None
@@ -224,8 +271,13 @@ def update_piso(
         piso.caracteristicas_adicionales = piso_data.caracteristicas_adicionales.strip() if piso_data.caracteristicas_adicionales else None
         piso.paralizado = piso_data.paralizado or "NO"
         
+        # Recalcular sus matches (paralizado no influye en el score: se filtra al leer)
+        db.flush()
+        refrescar_matches_piso(db, piso)
+        incrementar_version_datos(db, piso.compania_id)
         db.commit()
         db.refresh(piso)
+        invalidate_piso(piso.id)
         return piso
         
     except HTTPException:
@@ -239,11 +291,29 @@ def update_piso(
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @router.get("/all", response_model=list[PisoResponse])
-def read_all_pisos(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def read_all_pisos(
+    request: Request,
+    response: Response,
+    filtros: FiltrosListado = Depends(filtros_listado),
+    pagina: Paginacion = Depends(paginacion_listado),
+    fields: Optional[str] = Query(None, description="Campos separados por comas (id siempre incluido)"),
+    paralizado: Optional[bool] = Query(None, description="true: solo paralizados; false: solo activos"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
     """Obtener todos los pisos para gestión - Supervisores y Asesores"""
     
-    pisos = db.query(Piso).filter(Piso.compania_id == current_user.compania_id).all()
-    return pisos
+    version = db.scalar(consulta_version(current_user.compania_id))
+    no_modificado = respuesta_condicional(request, response, etag_lista("pisos-all", current_user.compania_id, version))
+    if no_modificado:
+        return no_modificado
+
+    campos = campos_solicitados(fields, CAMPOS_PISO)
+    stmt = consulta_pisos(current_user.compania_id, filtros, pagina, campos, paralizado)
+    if campos:
+        filas = recortar_pagina(db.execute(stmt).all(), pagina, response)
+        return respuesta_proyectada([dict(fila._mapping) for fila in filas], response)
+    return recortar_pagina(db.scalars(stmt).all(), pagina, response)
 
 @router.put("/{piso_id}/paralizar", response_model=PisoResponse)
 def toggle_piso_paralizado(
@@ -265,6 +335,7 @@ def toggle_piso_paralizado(
     try:
         # Cambiar estado de paralización
         piso.paralizado = "SÍ" if piso.paralizado != "SÍ" else "NO"
+        incrementar_version_datos(db, piso.compania_id)
         
         db.commit()
         db.refresh(piso)
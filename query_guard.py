@@ -0,0 +1,161 @@
+"""
+Detector de N+1 y guardia de lazy loads (opt-in, para tests y staging).
+
+QUERY_GUARD=warn   cuenta las sentencias SQL de cada petición, avisa en el log
+                   cuando la misma forma de sentencia se repite y añade la
+                   cabecera X-Query-Count a la respuesta.
+QUERY_GUARD=raise  además, cualquier lazy load de una relationship lanza
+                   LazyLoadError: el N+1 falla en vez de pasar desapercibido.
+Sin la variable (producción) el middleware no se instala y los listeners no
+hacen nada fuera de assert_max_queries().
+
+En tests:
+
+    with assert_max_queries(3):
+        client.get("/clientes/")
+"""
+import logging
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import engine, async_engine
+
+logger = logging.getLogger("query_guard")
+
+MODO = os.getenv("QUERY_GUARD", "").lower()  # "", "warn" o "raise"
+# Repeticiones de una misma forma de sentencia a partir de las cuales se avisa
+REPETICIONES_AVISO = int(os.getenv("QUERY_GUARD_REPETICIONES", "3"))
+
+_PARAMETROS_IN = re.compile(r"IN \((?:%\([^)]+\)s(?:, )?)+\)|IN \(__\[POSTCOMPILE_\w+\]\)")
+_ESPACIOS = re.compile(r"\s+")
+
+
+class LazyLoadError(RuntimeError):
+    """A relationship was lazy-loaded while the guard forbids it."""
+
+
+class QueryBudgetExceeded(AssertionError):
+    """More SQL statements than the budget given to assert_max_queries."""
+
+
+class _Registro:
+    __slots__ = ("sentencias", "prohibir_lazy")
+
+    def __init__(self, prohibir_lazy: bool):
+        self.sentencias: List[str] = []
+        self.prohibir_lazy = prohibir_lazy
+
+    def repetidas(self, minimo: int = REPETICIONES_AVISO) -> List[tuple]:
+        return [(forma, veces) for forma, veces in Counter(self.sentencias).most_common() if veces >= minimo]
+
+
+_registro: ContextVar[Optional[_Registro]] = ContextVar("query_guard_registro", default=None)
+# assert_max_queries también registra aquí: TestClient ejecuta la app en otro
+# hilo y el ContextVar del test no llega a la petición
+_registro_global: Optional[_Registro] = None
+
+
+def _activos() -> List[_Registro]:
+    activos = []
+    registro = _registro.get()
+    if registro is not None:
+        activos.append(registro)
+    if _registro_global is not None and _registro_global is not registro:
+        activos.append(_registro_global)
+    return activos
+
+
+def forma_sentencia(statement: str) -> str:
+    """Normalize a SQL statement so executions differing only in IN-list size compare equal."""
+    return _ESPACIOS.sub(" ", _PARAMETROS_IN.sub("IN (...)", statement)).strip()
+
+
+def _contar_sentencia(conn, cursor, statement, parameters, context, executemany):
+    activos = _activos()
+    if activos:
+        forma = forma_sentencia(statement)
+        for registro in activos:
+            registro.sentencias.append(forma)
+
+
+event.listen(engine, "after_cursor_execute", _contar_sentencia)
+event.listen(async_engine.sync_engine, "after_cursor_execute", _contar_sentencia)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _vigilar_lazy_load(orm_execute_state):
+    if not any(registro.prohibir_lazy for registro in _activos()):
+        return
+    if not (orm_execute_state.is_select and orm_execute_state.is_relationship_load):
+        return
+    # lazy_loaded_from solo está presente en lazy loads (no en selectin/subquery)
+    estado = orm_execute_state.lazy_loaded_from
+    if estado is not None:
+        raise LazyLoadError(
+            f"Lazy load desde {estado.class_.__name__} (id={estado.identity}): "
+            f"usa joinedload/selectinload en la consulta original"
+        )
+
+
+@contextmanager
+def vigilar(prohibir_lazy: bool = False):
+    """Record every statement executed in this context; yields the record."""
+    registro = _Registro(prohibir_lazy)
+    token = _registro.set(registro)
+    try:
+        yield registro
+    finally:
+        _registro.reset(token)
+
+
+@contextmanager
+def assert_max_queries(maximo: int, prohibir_lazy: bool = True):
+    """Fail if the block runs more than `maximo` SQL statements (or any lazy load)."""
+    global _registro_global
+    anterior = _registro_global
+    with vigilar(prohibir_lazy) as registro:
+        _registro_global = registro
+        try:
+            yield registro
+        finally:
+            _registro_global = anterior
+    if len(registro.sentencias) > maximo:
+        detalle = "\n".join(f"  {i + 1}. {sentencia}" for i, sentencia in enumerate(registro.sentencias))
+        raise QueryBudgetExceeded(
+            f"{len(registro.sentencias)} sentencias SQL (máximo {maximo}):\n{detalle}"
+        )
+
+
+class QueryGuardMiddleware:
+    """Pure ASGI middleware active when QUERY_GUARD is set."""
+
+    def __init__(self, app, prohibir_lazy: bool = MODO == "raise"):
+        self.app = app
+        self.prohibir_lazy = prohibir_lazy
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with vigilar(self.prohibir_lazy) as registro:
+            async def send_con_cuenta(message):
+                if message["type"] == "http.response.start":
+                    cabeceras = list(message.get("headers", []))
+                    cabeceras.append((b"x-query-count", str(len(registro.sentencias)).encode()))
+                    message = {**message, "headers": cabeceras}
+                await send(message)
+
+            await self.app(scope, receive, send_con_cuenta)
+
+        route = scope.get("route")
+        ruta = getattr(route, "path", scope.get("path"))
+        for forma, veces in registro.repetidas():
+            logger.warning(f"⚠️ Posible N+1 en {scope['method']} {ruta}: {veces}x {forma}")
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from passlib.context import CryptContext
 from models import get_db, Usuario, Compania
 from utils import require_supervisor
+from passwords import hash_password
+from dashboard import invalidar_dashboard
 import logging
 
 # Configure logging
@@ -12,8 +14,6 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/register", tags=["register"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 class UserCreate(BaseModel):
     email: str
     password: str
@@ -25,48 +25,68 @@ class SupervisorUserCreate(BaseModel):
     compania_id: int
     rol: str = "Supervisor"
 
+# Los endpoints de registro son async: las consultas (sesión síncrona) van al
+# threadpool con run_in_threadpool y el hash bcrypt se espera en el event loop,
+# así que ningún hilo queda retenido mientras bcrypt trabaja.
+
+def comprobar_compania(db: Session, compania_id: int):
+    compania = db.query(Compania).filter(Compania.id == compania_id).first()
+    if not compania:
+        logger.error(f"Company with ID {compania_id} not found")
+        raise HTTPException(status_code=400, detail=f"Company with ID {compania_id} does not exist")
+
+def comprobar_email(db: Session, email: str):
+    existing_user = db.query(Usuario).filter(Usuario.email == email).first()
+    if existing_user:
+        logger.error(f"Email {email} already registered")
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+def crear_usuario(db: Session, email: str, hashed_password: str, compania_id: int, rol: str) -> Usuario:
+    db_user = Usuario(
+        email=email,
+        password=hashed_password,
+        compania_id=compania_id,
+        rol=rol
+    )
+    db.add(db_user)
+    db.commit()
+    invalidar_dashboard(compania_id)  # El panel lista a todos los usuarios de la compañía
+    db.refresh(db_user)
+    return db_user
+
 @router.post("/", response_model=UserCreate)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: Session = Depends(get_db)):
     """Registro público - SOLO puede crear Asesores"""
     try:
         # Check if company exists
-        compania = db.query(Compania).filter(Compania.id == user.compania_id).first()
-        if not compania:
-            logger.error(f"Company with ID {user.compania_id} not found")
-            raise HTTPException(status_code=400, detail=f"Company with ID {user.compania_id} does not exist")
+        await run_in_threadpool(comprobar_compania, db, user.compania_id)
         
         # Check if email is already registered
-        existing_user = db.query(Usuario).filter(Usuario.email == user.email).first()
-        if existing_user:
-            logger.error(f"Email {user.email} already registered")
-            raise HTTPException(status_code=400, detail="Email already registered")
+        await run_in_threadpool(comprobar_email, db, user.email)
         
-        # Hash the password (truncar a 72 bytes para bcrypt)
-        password_truncated = user.password[:72]
-        hashed_password = pwd_context.hash(password_truncated)
+        # Hash the password (bcrypt executor, truncado a 72 bytes)
+        hashed_password = await hash_password(user.password)
         logger.info(f"Password hashed successfully for email: {user.email}")
         
         # Create new user - SIEMPRE como Asesor
-        db_user = Usuario(
-            email=user.email,
-            password=hashed_password,
-            compania_id=user.compania_id,
-            rol="Asesor"  # ✅ FORZADO - Solo Asesores
+        await run_in_threadpool(
+            crear_usuario, db, user.email, hashed_password, user.compania_id,
+            "Asesor"  # ✅ FORZADO - Solo Asesores
         )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
         logger.info(f"User {user.email} registered successfully as Asesor with compania_id: {user.compania_id}")
         
         return user
     
+    except HTTPException:
+        await run_in_threadpool(db.rollback)
+        raise
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         logger.error(f"Failed to register user: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to register user: {str(e)}")
 
 @router.post("/supervisor", response_model=SupervisorUserCreate)
-def register_supervisor(
+async def register_supervisor(
     user: SupervisorUserCreate, 
     db: Session = Depends(get_db),
     current_user = Depends(require_supervisor)  # ✅ SOLO Supervisores pueden crear Supervisores
@@ -74,85 +94,70 @@ def register_supervisor(
     """Registro de Supervisor - SOLO otro Supervisor puede crear uno"""
     try:
         # Check if company exists
-        compania = db.query(Compania).filter(Compania.id == user.compania_id).first()
-        if not compania:
-            raise HTTPException(status_code=400, detail=f"Company with ID {user.compania_id} does not exist")
+        await run_in_threadpool(comprobar_compania, db, user.compania_id)
         
         # Verificar que el supervisor actual pertenece a la misma compañía
         if current_user.compania_id != user.compania_id:
             raise HTTPException(status_code=403, detail="No puedes crear supervisores en otras compañías")
         
         # Check if email is already registered
-        existing_user = db.query(Usuario).filter(Usuario.email == user.email).first()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Email already registered")
+        await run_in_threadpool(comprobar_email, db, user.email)
         
-        password_truncated = user.password[:72]
-        hashed_password = pwd_context.hash(password_truncated)
+        hashed_password = await hash_password(user.password)
         logger.info(f"Password hashed successfully for email: {user.email}")
         
         # Create new supervisor
-        db_user = Usuario(
-            email=user.email,
-            password=hashed_password,
-            compania_id=user.compania_id,
-            rol="Supervisor"  # ✅ Supervisor creado por otro Supervisor
+        await run_in_threadpool(
+            crear_usuario, db, user.email, hashed_password, user.compania_id,
+            "Supervisor"  # ✅ Supervisor creado por otro Supervisor
         )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
         logger.info(f"Supervisor {user.email} created by {current_user.email}")
         
         return user
     
+    except HTTPException:
+        await run_in_threadpool(db.rollback)
+        raise
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         logger.error(f"Failed to register supervisor: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to register supervisor: {str(e)}")
 
 @router.post("/first-supervisor", response_model=SupervisorUserCreate)
-def register_first_supervisor(user: SupervisorUserCreate, db: Session = Depends(get_db)):
+async def register_first_supervisor(user: SupervisorUserCreate, db: Session = Depends(get_db)):
     """Registro del primer supervisor de una compañía - NO requiere autenticación"""
     try:
         # Verificar que no existe ningún supervisor en la compañía
-        existing_supervisor = db.query(Usuario).filter(
-            Usuario.compania_id == user.compania_id,
-            Usuario.rol == "Supervisor"
-        ).first()
+        existing_supervisor = await run_in_threadpool(
+            lambda: db.query(Usuario).filter(
+                Usuario.compania_id == user.compania_id,
+                Usuario.rol == "Supervisor"
+            ).first()
+        )
         
         if existing_supervisor:
             raise HTTPException(status_code=400, detail="Ya existe un supervisor en esta compañía. Usa el endpoint /register/supervisor")
         
         # Check if company exists
-        compania = db.query(Compania).filter(Compania.id == user.compania_id).first()
-        if not compania:
-            raise HTTPException(status_code=400, detail=f"Company with ID {user.compania_id} does not exist")
+        await run_in_threadpool(comprobar_compania, db, user.compania_id)
         
         # Check if email is already registered
-        existing_user = db.query(Usuario).filter(Usuario.email == user.email).first()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Email already registered")
+        await run_in_threadpool(comprobar_email, db, user.email)
         
-        # Hash the password (truncar a 72 bytes para bcrypt)
-        password_truncated = user.password[:72]
-        hashed_password = pwd_context.hash(password_truncated)
+        # Hash the password (bcrypt executor, truncado a 72 bytes)
+        hashed_password = await hash_password(user.password)
         logger.info(f"Password hashed successfully for email: {user.email}")
         
         # Create first supervisor
-        db_user = Usuario(
-            email=user.email,
-            password=hashed_password,
-            compania_id=user.compania_id,
-            rol="Supervisor"
-        )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await run_in_threadpool(crear_usuario, db, user.email, hashed_password, user.compania_id, "Supervisor")
         logger.info(f"First supervisor {user.email} created for company {user.compania_id}")
         
         return user
     
+    except HTTPException:
+        await run_in_threadpool(db.rollback)
+        raise
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         logger.error(f"Failed to register first supervisor: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to register first supervisor: {str(e)}")
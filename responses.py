@@ -0,0 +1,22 @@
+"""
+Respuesta JSON con orjson para los endpoints SIN response_model.
+
+Los endpoints con response_model ya se serializan directamente a bytes con el
+núcleo en Rust de Pydantic; poner otra clase de respuesta por defecto en la
+app desactivaría ese camino, así que OrjsonResponse se usa ruta a ruta
+(response_class=OrjsonResponse) donde se devuelven dicts/listas grandes.
+"""
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def orjson_dumps(content) -> bytes:
+    """orjson.dumps with the options of OrjsonResponse (datetimes, numpy and non-str keys included)."""
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+class OrjsonResponse(JSONResponse):
+    """JSONResponse rendered with orjson_dumps."""
+
+    def render(self, content) -> bytes:
+        return orjson_dumps(content)
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List
-from models import get_db, CompaniaZona, Compania
+from models import get_db, get_async_db, CompaniaZona, Compania
 from utils import get_current_user
+from etags import incrementar_version_datos, consulta_version, etag_lista, respuesta_condicional
 
 router = APIRouter(prefix="/companias/zonas", tags=["companias_zonas"])
 
@@ -17,7 +20,13 @@ class ZonaResponse(BaseModel):
     zona: str
 
 @router.get("/{compania_id}", response_model=List[ZonaResponse])
-def get_zonas_by_compania(compania_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def get_zonas_by_compania(
+    compania_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
     """
     Obtener todas las zonas de una compañía específica.
     Accesible por cualquier usuario de la compañía.
@@ -26,16 +35,31 @@ def get_zonas_by_compania(compania_id: int, db: Session = Depends(get_db), curre
     if current_user.compania_id != compania_id:
         raise HTTPException(status_code=403, detail="No autorizado para acceder a las zonas de esta compañía")
     
+    version = db.scalar(consulta_version(compania_id))
+    no_modificado = respuesta_condicional(request, response, etag_lista("zonas", compania_id, version))
+    if no_modificado:
+        return no_modificado
+    
     zonas = db.query(CompaniaZona).filter(CompaniaZona.compania_id == compania_id).all()
     return zonas
 
 @router.get("/", response_model=List[ZonaResponse])
-def get_zonas_current_compania(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_zonas_current_compania(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user)
+):
     """
     Obtener todas las zonas de la compañía del usuario actual.
     Este endpoint es el que usará el Frontend.
     """
-    zonas = db.query(CompaniaZona).filter(CompaniaZona.compania_id == current_user.compania_id).all()
+    version = await db.scalar(consulta_version(current_user.compania_id))
+    no_modificado = respuesta_condicional(request, response, etag_lista("zonas", current_user.compania_id, version))
+    if no_modificado:
+        return no_modificado
+
+    zonas = (await db.scalars(select(CompaniaZona).filter(CompaniaZona.compania_id == current_user.compania_id))).all()
     
     # Si no hay zonas configuradas, retornar lista vacía
     if not zonas:
@@ -71,6 +95,7 @@ def create_zonas_for_compania(zona_data: ZonaCreate, db: Session = Depends(get_d
             db.add(nueva_zona)
             zonas_creadas.append(zona_nombre)
         
+        incrementar_version_datos(db, zona_data.compania_id)
         db.commit()
         
         return {
@@ -99,6 +124,7 @@ def delete_zona(compania_id: int, zona_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Zona no encontrada")
     
     db.delete(zona)
+    incrementar_version_datos(db, compania_id)
     db.commit()
     
     return {"message": f"Zona '{zona.zona}' eliminada exitosamente"}
@@ -1,10 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
-from models import get_db, Cliente, Piso, ClienteEstadoPiso, Usuario
+import base64
+import binascii
+import json
+from models import get_db, get_async_db, Cliente, Piso, ClienteEstadoPiso, Match
 from utils import get_current_user, require_supervisor
+from match_profiles import ClienteProfile, PisoProfile, cliente_profile, piso_profile
+from fastapi.concurrency import run_in_threadpool
+from match_store import MIN_SCORE, decode_penalizaciones, reconstruir_matches_compania, asegurar_matches_compania, matches_al_dia
+from dashboard import dashboard_compania, invalidar_dashboard
 
 router = APIRouter(prefix="/match", tags=["match"])
 
@@ -27,115 +36,154 @@ class ClienteEstadoResponse(BaseModel):
     estado: str
     fecha_actualizacion: str
 
+def codificar_cursor(score: int, match_id: int) -> str:
+    """Opaque cursor pointing right after the (score, id) of the last match returned."""
+    return base64.urlsafe_b64encode(json.dumps([score, match_id]).encode()).decode()
+
+def decodificar_cursor(cursor: str) -> tuple:
+    try:
+        score, match_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(score), int(match_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 @router.get("/", response_model=list[MatchResponse])
-def obtener_matches(piso_id: int = None, cliente_id: int = None, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def obtener_matches(
+    response: Response,
+    piso_id: int = None,
+    cliente_id: int = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    min_score: int = Query(MIN_SCORE, ge=MIN_SCORE, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user)
+):
+    """Matches de un piso o de un cliente, de mayor a menor score.
+
+    Con limit solo se devuelven los primeros N; si hay más, la cabecera
+    X-Next-Cursor trae el cursor para pedir la siguiente página.
+    """
     if piso_id and cliente_id:
         raise HTTPException(status_code=400, detail="Provide either piso_id or cliente_id, not both")
     if not (piso_id or cliente_id):
         raise HTTPException(status_code=400, detail="Provide either piso_id or cliente_id")
 
-    matches = []
-    
+    # Compañía sin la tabla matches calculada (BD actualizada): se calcula ahora, una vez
+    if not matches_al_dia(current_user.compania_id):
+        await run_in_threadpool(asegurar_matches_compania, current_user.compania_id)
+
     if piso_id:
-        # Verificar que el piso pertenece a la compañía del usuario
         # Verificar que el piso pertenece a la compañía del usuario y NO está paralizado
-        piso = db.query(Piso).filter(
+        piso = await db.scalar(select(Piso.id).filter(
             Piso.id == piso_id, 
             Piso.compania_id == current_user.compania_id,
             Piso.paralizado != "SÍ"
-        ).first()
+        ))
         if not piso:
             raise HTTPException(status_code=404, detail="Piso no encontrado o está paralizado")
         
-        # Obtener clientes según el rol del usuario
-        # Obtener clientes según el rol del usuario con información del asesor
+        # Matches ya puntuados (tabla materializada); el Asesor solo ve sus clientes
+        query = select(Match.cliente_id, Match.piso_id, Match.score, Match.penalizaciones).filter(
+            Match.piso_id == piso_id
+        )
+        # A igual score, desempate determinista por el id del otro lado
+        desempate = Match.cliente_id
         if current_user.rol == "Asesor":
-            # Asesor solo ve sus clientes
-            clientes = db.query(Cliente).options(
-                joinedload(Cliente.asesor_asignado)
-            ).filter(
-                Cliente.compania_id == current_user.compania_id,
+            query = query.join(Cliente, Cliente.id == Match.cliente_id).filter(
                 Cliente.asesor_id == current_user.id
-            ).all()
-        else:
-            # Supervisor ve todos los clientes de la compañía
-            clientes = db.query(Cliente).options(
-                joinedload(Cliente.asesor_asignado)
-            ).filter(Cliente.compania_id == current_user.compania_id).all()
-        
-        for cliente in clientes:
-            score, penalizaciones = calculate_match_score_with_details(piso, cliente)  # ✅ NUEVO
-            if score >= 50:  # Only show matches with 50% or higher
-                # Obtener el estado actual del cliente para este piso
-                estado_actual = db.query(ClienteEstadoPiso).filter(
-                    ClienteEstadoPiso.cliente_id == cliente.id,
-                    ClienteEstadoPiso.piso_id == piso.id,
-                    ClienteEstadoPiso.compania_id == current_user.compania_id
-                ).first()
-                
-                estado = estado_actual.estado if estado_actual else "Pendiente"
-                matches.append(MatchResponse(
-                    cliente_id=cliente.id, 
-                    piso_id=piso.id, 
-                    score=score, 
-                    estado=estado,
-                    penalizaciones=penalizaciones  # ✅ NUEVO CAMPO
-                ))
+            )
     
     elif cliente_id:
         # Verificar que el cliente pertenece a la compañía y, si es Asesor, que le pertenece
-        # Verificar que el cliente pertenece a la compañía y, si es Asesor, que le pertenece
+        filtros_cliente = [Cliente.id == cliente_id, Cliente.compania_id == current_user.compania_id]
         if current_user.rol == "Asesor":
-            cliente = db.query(Cliente).options(
-                joinedload(Cliente.asesor_asignado)
-            ).filter(
-                Cliente.id == cliente_id, 
-                Cliente.compania_id == current_user.compania_id,
-                Cliente.asesor_id == current_user.id
-            ).first()
-        else:
-            cliente = db.query(Cliente).options(
-                joinedload(Cliente.asesor_asignado)
-            ).filter(
-                Cliente.id == cliente_id, 
-                Cliente.compania_id == current_user.compania_id
-            ).first()
+            filtros_cliente.append(Cliente.asesor_id == current_user.id)
+        cliente = await db.scalar(select(Cliente.id).filter(*filtros_cliente))
             
         if not cliente:
             raise HTTPException(status_code=404, detail="Cliente no encontrado")
         
-        # Todos los usuarios pueden ver todos los pisos de su compañía
         # Todos los usuarios pueden ver todos los pisos ACTIVOS de su compañía
-        pisos = db.query(Piso).filter(
-            Piso.compania_id == current_user.compania_id,
+        query = select(Match.cliente_id, Match.piso_id, Match.score, Match.penalizaciones).join(
+            Piso, Piso.id == Match.piso_id
+        ).filter(
+            Match.cliente_id == cliente_id,
             Piso.paralizado != "SÍ"
-        ).all()
-        for piso in pisos:
-            score, penalizaciones = calculate_match_score_with_details(piso, cliente)  # ✅ NUEVO
-            if score >= 50:  # Only show matches with 50% or higher
-                # Obtener el estado actual del cliente para este piso
-                estado_actual = db.query(ClienteEstadoPiso).filter(
-                    ClienteEstadoPiso.cliente_id == cliente.id,
-                    ClienteEstadoPiso.piso_id == piso.id,
-                    ClienteEstadoPiso.compania_id == current_user.compania_id
-                ).first()
-                
-                estado = estado_actual.estado if estado_actual else "Pendiente"
-                matches.append(MatchResponse(
-                    cliente_id=cliente.id, 
-                    piso_id=piso.id, 
-                    score=score, 
-                    estado=estado,
-                    penalizaciones=penalizaciones  # ✅ NUEVO CAMPO
-                ))
+        )
+        desempate = Match.piso_id
+    
+    # Umbral, cursor y límite van a SQL: el índice (piso_id|cliente_id, score)
+    # entrega ya ordenadas solo las filas pedidas, sin ordenar el resto
+    query = query.filter(Match.score >= min_score)
+    if cursor:
+        score_cursor, id_cursor = decodificar_cursor(cursor)
+        query = query.filter(or_(
+            Match.score < score_cursor,
+            and_(Match.score == score_cursor, desempate > id_cursor)
+        ))
     
     # Sort by score (highest first)
-    matches.sort(key=lambda x: x.score, reverse=True)
-    return matches
+    query = query.order_by(Match.score.desc(), desempate)
+    if limit:
+        # Una fila de más para saber si hay página siguiente
+        pares = (await db.execute(query.limit(limit + 1))).all()
+        if len(pares) > limit:
+            pares = pares[:limit]
+            ultimo_cliente_id, ultimo_piso_id, ultimo_score, _ = pares[-1]
+            response.headers["X-Next-Cursor"] = codificar_cursor(
+                ultimo_score, ultimo_cliente_id if piso_id else ultimo_piso_id
+            )
+    else:
+        pares = (await db.execute(query)).all()
+    
+    # Estados de todos los pares en UNA sola consulta (antes: una por match)
+    estados = await cargar_estados(db, current_user.compania_id, [(c_id, p_id) for c_id, p_id, _, _ in pares])
+    
+    return [
+        MatchResponse(
+            cliente_id=match_cliente_id, 
+            piso_id=match_piso_id, 
+            score=score, 
+            estado=estados.get((match_cliente_id, match_piso_id), "Pendiente"),
+            penalizaciones=decode_penalizaciones(mascara)  # ✅ NUEVO CAMPO
+        )
+        for match_cliente_id, match_piso_id, score, mascara in pares
+    ]
+
+async def cargar_estados(db: AsyncSession, compania_id: int, pares: list) -> dict:
+    """Fetch the estado of every (cliente_id, piso_id) pair with a single IN query.
 
-def calculate_match_score_with_details(piso: Piso, cliente: Cliente) -> tuple[int, dict]:
-    """Calculate match score WITH detailed penalty information for visual highlighting."""
+    Pairs without a ClienteEstadoPiso row are simply absent from the result.
+    """
+    if not pares:
+        return {}
+    
+    cliente_ids = {c_id for c_id, _ in pares}
+    piso_ids = {p_id for _, p_id in pares}
+    filas = await db.execute(select(
+        ClienteEstadoPiso.cliente_id,
+        ClienteEstadoPiso.piso_id,
+        ClienteEstadoPiso.estado
+    ).filter(
+        ClienteEstadoPiso.compania_id == compania_id,
+        ClienteEstadoPiso.cliente_id.in_(cliente_ids),
+        ClienteEstadoPiso.piso_id.in_(piso_ids)
+    ).order_by(ClienteEstadoPiso.id))
+    
+    estados = {}
+    for fila_cliente_id, fila_piso_id, estado in filas:
+        # Si hubiera duplicados, gana el registro más antiguo (como el .first() anterior)
+        estados.setdefault((fila_cliente_id, fila_piso_id), estado)
+    return estados
+
+def calculate_match_score_with_details(piso, cliente) -> tuple[int, dict]:
+    """Calculate match score WITH detailed penalty information for visual highlighting.
+
+    Accepts ORM rows or precompiled profiles; rows are compiled once and cached.
+    """
     try:
+        piso = piso_profile(piso)
+        cliente = cliente_profile(cliente)
         score = 100  # Start with 100%
         penalizaciones = {}  # ✅ NUEVO: Tracking de penalizaciones
         
@@ -176,8 +224,6 @@ def calculate_match_score_with_details(piso: Piso, cliente: Cliente) -> tuple[in
         
         # PARÁMETROS MEDIOS (5% penalty each)
         
-        # PARÁMETROS MEDIOS (5% penalty each)
-        
         # 1. Precio: Complex penalty system
         precio_penalty = check_precio_match(piso, cliente)
         if precio_penalty == -1:  # Exclude directly
@@ -240,83 +286,53 @@ def calculate_match_score_with_details(piso: Piso, cliente: Cliente) -> tuple[in
         print(f"Error in scoring: {str(e)}")
         return 0, {}
 
-def calculate_match_score(piso: Piso, cliente: Cliente) -> int:
+def calculate_match_score(piso, cliente) -> int:
     """Mantener función original para retrocompatibilidad total."""
     score, _ = calculate_match_score_with_details(piso, cliente)
     return score
 
-def check_zona_match(piso: Piso, cliente: Cliente) -> bool:
+def check_zona_match(piso: PisoProfile, cliente: ClienteProfile) -> bool:
     """Check if at least one zone matches."""
-    if not cliente.zona or not piso.zona:
-        return False  # Si alguno no tiene zona, no hay match
-    
-    # Limpiar espacios en blanco y convertir a mayúsculas para comparación consistente
-    cliente_zonas = set(zona.strip().upper() for zona in cliente.zona.split(",") if zona.strip())
-    piso_zonas = set(zona.strip().upper() for zona in piso.zona.split(",") if zona.strip())
-    
-    # Debug: imprimir zonas para verificación
-    print(f"DEBUG ZONA - Cliente {cliente.id}: {cliente_zonas}")
-    print(f"DEBUG ZONA - Piso {piso.id}: {piso_zonas}")
-    print(f"DEBUG ZONA - Match: {bool(cliente_zonas.intersection(piso_zonas))}")
-    
-    return bool(cliente_zonas.intersection(piso_zonas))
+    # Zonas ya normalizadas (strip + upper); sin zonas en algún lado no hay match
+    return not cliente.zonas.isdisjoint(piso.zonas)
 
-def check_habitaciones_match(piso: Piso, cliente: Cliente) -> int:
+def check_habitaciones_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check habitaciones match. Returns penalty (0 = match, 10 = penalty)."""
-    if not cliente.habitaciones:
+    if cliente.habitaciones_invalidas:
+        raise ValueError("habitaciones del cliente no numéricas")
+    if cliente.habitaciones_min is None:
         return 0  # No preference
     
-    cliente_habitaciones = [int(x) for x in cliente.habitaciones.split(",") if x.strip()]
-    if not cliente_habitaciones:
-        return 0
-    
-    if not piso.habitaciones:
+    if piso.habitaciones_invalidas:
+        raise ValueError("habitaciones del piso no numéricas")
+    if piso.habitaciones_max is None:
         return 10  # 10% penalty if piso doesn't specify
     
-    piso_habitaciones = [int(x) for x in piso.habitaciones.split(",") if x.strip()]
-    if not piso_habitaciones:
-        return 10
-    
     # Check if piso has at least the minimum required by cliente
-    min_cliente = min(cliente_habitaciones)
-    max_piso = max(piso_habitaciones)
-    
-    if max_piso >= min_cliente:
+    if piso.habitaciones_max >= cliente.habitaciones_min:
         return 0  # Match
     else:
         return 10  # 10% penalty instead of exclude
 
-def check_estado_match(piso: Piso, cliente: Cliente) -> bool:
+def check_estado_match(piso: PisoProfile, cliente: ClienteProfile) -> bool:
     """Check if at least one estado value matches."""
-    if not cliente.estado:
+    if not cliente.estados:
         return True  # No preference
-    
-    cliente_estados = set(cliente.estado.split(",") if cliente.estado else [])
-    piso_estados = set(piso.estado.split(",") if piso.estado else [])
-    
-    if not cliente_estados:
-        return True
-    if not piso_estados:
+    if not piso.estados:
         return False
     
-    return bool(cliente_estados.intersection(piso_estados))
+    return not cliente.estados.isdisjoint(piso.estados)
 
-def check_tipo_vivienda_match(piso: Piso, cliente: Cliente) -> bool:
+def check_tipo_vivienda_match(piso: PisoProfile, cliente: ClienteProfile) -> bool:
     """Check if at least one tipo_vivienda value matches."""
-    if not cliente.tipo_vivienda:
+    if not cliente.tipos_vivienda:
         return True  # No preference
-    
-    cliente_tipos = set(cliente.tipo_vivienda.split(",") if cliente.tipo_vivienda else [])
-    piso_tipos = set(piso.tipo_vivienda.split(",") if piso.tipo_vivienda else [])
-    
-    if not cliente_tipos:
-        return True
-    if not piso_tipos:
+    if not piso.tipos_vivienda:
         return False
     
-    return bool(cliente_tipos.intersection(piso_tipos))
+    return not cliente.tipos_vivienda.isdisjoint(piso.tipos_vivienda)
 
-def check_bajos_match(piso: Piso, cliente: Cliente) -> int:
+def check_bajos_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check bajos match. Returns penalty (0 or 10)."""
     if not cliente.bajos:
         return 0  # No preference - no penalty
@@ -331,7 +347,7 @@ def check_bajos_match(piso: Piso, cliente: Cliente) -> int:
     
     return 0  # No penalty en otros casos
 
-def check_entreplanta_match(piso: Piso, cliente: Cliente) -> int:
+def check_entreplanta_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check entreplanta match. Returns penalty (0 or 10)."""
     if not cliente.entreplanta:
         return 0  # No preference - no penalty
@@ -346,7 +362,7 @@ def check_entreplanta_match(piso: Piso, cliente: Cliente) -> int:
     
     return 0  # No penalty en otros casos
 
-def check_precio_match(piso: Piso, cliente: Cliente) -> int:
+def check_precio_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check precio match. Returns penalty (0, 5, 10) or -1 to exclude."""
     if not piso.precio or not cliente.precio:
         return 0
@@ -367,7 +383,7 @@ def check_precio_match(piso: Piso, cliente: Cliente) -> int:
     else:
         return -1  # Exclude directly
 
-def check_m2_match(piso: Piso, cliente: Cliente) -> int:
+def check_m2_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check m2 match. Returns penalty (0, 5, 10) or -1 to exclude."""
     if not piso.m2 or not cliente.m2:
         return 0
@@ -388,96 +404,48 @@ def check_m2_match(piso: Piso, cliente: Cliente) -> int:
     else:
         return -1  # Exclude directly
 
-def check_ascensor_match(piso: Piso, cliente: Cliente) -> int:
+def check_ascensor_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check ascensor match with floor deviation logic."""
-    if not cliente.ascensor or cliente.ascensor == "INDIFERENTE":
+    if cliente.ascensor_max_subida is None:
         return 0  # No preference
     
-    if not piso.ascensor:
-        return 0  # No info, no penalty
-    
-    # Handle piso WITH elevator (SÍ) - Always perfect match
-    if piso.ascensor == "SÍ":
-        return 0  # Perfect match - piso has elevator
+    # Piso con ascensor, sin info o valores desconocidos: sin penalización
+    if not piso.sin_ascensor:
+        return 0
     
     # Handle piso WITHOUT elevator (NO)
-    elif piso.ascensor == "NO":
-        # Get the actual floor number of the piso
-        if not piso.planta:
-            return 0  # No floor info, no penalty
-        
-        try:
-            # Parse piso floor number
-            if piso.planta == "Entreplanta":
-                piso_floor_number = 0  # Treat entreplanta as ground level
-            elif piso.planta == "-1":
-                piso_floor_number = -1  # Basement
-            else:
-                piso_floor_number = int(piso.planta)
-        except (ValueError, TypeError):
-            return 0  # Can't parse floor, no penalty
-        
-        # If piso is basement or ground floor, no stairs to climb
-        if piso_floor_number <= 0:
-            return 0  # No climbing required
-        
-        # Map client ascensor preferences to maximum floors they accept to climb
-        cliente_max_climb = {
-            "SÍ": 0,  # Wants elevator from ground = accepts 0 floors to climb
-            "Después de 1º": 1,  # Accepts climbing up to 1 floor
-            "Después de 2º": 2,  # Accepts climbing up to 2 floors
-            "Después de 3º": 3,  # Accepts climbing up to 3 floors
-            "Después de 4º": 4,  # Accepts climbing up to 4 floors
-            "Después de 5º": 5   # Accepts climbing up to 5 floors
-        }
-        
-        max_acceptable_climb = cliente_max_climb.get(cliente.ascensor, 0)
-        
-        # Calculate floors to climb (piso floor number = floors to climb)
-        floors_to_climb = piso_floor_number
-        
-        # Calculate excess climbing beyond client's acceptance
-        climb_excess = floors_to_climb - max_acceptable_climb
-        
-        if climb_excess <= 0:
-            return 0  # Within acceptable climbing range
-        elif climb_excess == 1:
-            return 5  # 1 extra floor to climb = 5% penalty
-        elif climb_excess == 2:
-            return 10  # 2 extra floors to climb = 10% penalty
-        else:
-            return -1  # More than 2 extra floors = exclude directly
-    
-    # Fallback for any other ascensor values
+    if piso.planta_num is None:
+        return 0  # No floor info (or unparseable), no penalty
+    
+    # If piso is basement or ground floor, no stairs to climb
+    if piso.planta_num <= 0:
+        return 0  # No climbing required
+    
+    # Calculate excess climbing beyond client's acceptance
+    climb_excess = piso.planta_num - cliente.ascensor_max_subida
+    
+    if climb_excess <= 0:
+        return 0  # Within acceptable climbing range
+    elif climb_excess == 1:
+        return 5  # 1 extra floor to climb = 5% penalty
+    elif climb_excess == 2:
+        return 10  # 2 extra floors to climb = 10% penalty
     else:
-        return 0  # No penalty for unknown values
+        return -1  # More than 2 extra floors = exclude directly
 
-def check_cercania_metro_match(piso: Piso, cliente: Cliente) -> int:
+def check_cercania_metro_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check metro proximity with distance deviation logic."""
-    if not cliente.cercania_metro or cliente.cercania_metro == "INDIFERENTE":
+    if cliente.metro_rango is None:
         return 0  # No preference
     
-    if not piso.cercania_metro:
+    if piso.metro_rango is None:
         return 0  # No info, no penalty
     
-    # Map metro distances to numeric values
-    metro_distances = {
-        "0-5 MIN": 1,
-        "5-10 MIN": 2,
-        "10-15 MIN": 3,
-        "15-20 MIN": 4,
-        "+20 MIN": 5,
-        "INDIFERENTE": 999
-    }
-    
-    cliente_distance = metro_distances.get(cliente.cercania_metro, 1)
-    piso_distance = metro_distances.get(piso.cercania_metro, 1)
-    
-    if piso_distance <= cliente_distance:
+    if piso.metro_rango <= cliente.metro_rango:
         return 0  # Match (piso is closer or equal)
     
     # Calculate deviation
-    deviation = piso_distance - cliente_distance
+    deviation = piso.metro_rango - cliente.metro_rango
     
     if deviation == 1:
         return 5  # 5% penalty for 1 level further
@@ -486,25 +454,19 @@ def check_cercania_metro_match(piso: Piso, cliente: Cliente) -> int:
     else:
         return 10  # Cap at 10% penalty for metro
 
-def check_altura_match(piso: Piso, cliente: Cliente) -> bool:
+def check_altura_match(piso: PisoProfile, cliente: ClienteProfile) -> bool:
     """Check if altura matches (with flexibility)."""
-    if not cliente.altura:
+    if not cliente.alturas:
         return True  # No preference
-    
-    cliente_alturas = set(cliente.altura.split(",") if cliente.altura else [])
-    piso_alturas = set(piso.altura.split(",") if piso.altura else [])
-    
-    if not cliente_alturas:
-        return True
-    if not piso_alturas:
+    if not piso.alturas:
         return False  # 5% penalty will be applied
     
-    return bool(cliente_alturas.intersection(piso_alturas))
+    return not cliente.alturas.isdisjoint(piso.alturas)
 
-def check_interior_match(piso: Piso, cliente: Cliente) -> bool:
+def check_interior_match(piso: PisoProfile, cliente: ClienteProfile) -> bool:
     """Check interior/exterior match with INDIFERENTE logic."""
-    if not cliente.interior or cliente.interior == "INDIFERENTE":
-        return True  # No preference
+    if cliente.interior is None:
+        return True  # No preference (or INDIFERENTE)
     
     if not piso.interior:
         return False  # 5% penalty will be applied
@@ -515,7 +477,7 @@ def check_interior_match(piso: Piso, cliente: Cliente) -> bool:
     
     return cliente.interior == piso.interior
 
-def check_balcon_terraza_match(piso: Piso, cliente: Cliente) -> int:
+def check_balcon_terraza_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check balcon_terraza match."""
     penalty = 0
     
@@ -525,7 +487,7 @@ def check_balcon_terraza_match(piso: Piso, cliente: Cliente) -> int:
     
     return penalty
 
-def check_patio_match(piso: Piso, cliente: Cliente) -> int:
+def check_patio_match(piso: PisoProfile, cliente: ClienteProfile) -> int:
     """Check patio match."""
     if cliente.patio == "SÍ" and piso.patio == "NO":
         return 5
@@ -571,6 +533,7 @@ def actualizar_estado_cliente(
         estado_existente.estado = request.estado
         estado_existente.fecha_actualizacion = fecha_actual
         db.commit()
+        invalidar_dashboard(current_user.compania_id)
         db.refresh(estado_existente)
         
         return ClienteEstadoResponse(
@@ -591,6 +554,7 @@ def actualizar_estado_cliente(
         
         db.add(nuevo_estado)
         db.commit()
+        invalidar_dashboard(current_user.compania_id)
         db.refresh(nuevo_estado)
         
         return ClienteEstadoResponse(
@@ -603,107 +567,189 @@ def actualizar_estado_cliente(
 # AGREGAR AL FINAL DEL ARCHIVO routers/match.py
 
 from fastapi.responses import StreamingResponse
+import csv
 import io
-import json
 from datetime import datetime
+from models import SessionLocal
+from responses import orjson_dumps
+from xlsx_stream import stream_xlsx
+
+# Columnas del reporte, en el orden en que las espera el FrontEnd
+COLUMNAS_EXPORT = [
+    'Piso_Direccion', 'Piso_Zona', 'Piso_Precio', 'Piso_M2', 'Piso_Habitaciones',
+    'Match_Numero', 'Compatibilidad', 'Estado', 'Fecha_Actualizacion',
+    'Cliente_Nombre', 'Cliente_Telefono', 'Cliente_Banco', 'Cliente_Kiron',
+    'Cliente_Entrada', 'Cliente_Precio'
+]
+
+def filas_export_por_piso(db: Session, compania_id: int):
+    """Yield the export rows of one piso at a time (best score first).
+
+    Matches are read with a server-side cursor, so memory depends on the
+    biggest piso, not on the size of the company.
+    """
+    # Estados de la compañía: los introduce el equipo a mano, son pocos
+    estados_dict = {}
+    for estado in db.query(ClienteEstadoPiso).filter(
+        ClienteEstadoPiso.compania_id == compania_id
+    ).order_by(ClienteEstadoPiso.id):
+        estados_dict[(estado.cliente_id, estado.piso_id)] = (estado.estado, estado.fecha_actualizacion)
+    
+    filas = db.query(
+        Match.piso_id, Match.cliente_id, Match.score,
+        Piso.direccion, Piso.zona, Piso.precio, Piso.m2, Piso.habitaciones,
+        Cliente.nombre, Cliente.telefono, Cliente.banco, Cliente.kiron, Cliente.entrada, Cliente.precio
+    ).join(Piso, Piso.id == Match.piso_id).join(Cliente, Cliente.id == Match.cliente_id).filter(
+        Match.compania_id == compania_id
+    ).order_by(Match.piso_id, Match.score.desc(), Match.cliente_id).execution_options(yield_per=1000)
+    
+    grupo = []
+    piso_actual = None
+    for (match_piso_id, match_cliente_id, score, direccion, zona, piso_precio, m2, habitaciones,
+         nombre, telefono, banco, kiron, entrada, cliente_precio) in filas:
+        if match_piso_id != piso_actual:
+            if grupo:
+                yield grupo
+            grupo = []
+            piso_actual = match_piso_id
+        estado, fecha = estados_dict.get((match_cliente_id, match_piso_id), ('Pendiente', ''))
+        grupo.append({
+            'Piso_Direccion': direccion or f"Piso ID {match_piso_id}",
+            'Piso_Zona': zona,
+            'Piso_Precio': piso_precio,
+            'Piso_M2': m2,
+            'Piso_Habitaciones': habitaciones or '',
+            'Match_Numero': len(grupo) + 1,
+            'Compatibilidad': score,
+            'Estado': estado,
+            'Fecha_Actualizacion': fecha,
+            'Cliente_Nombre': nombre,
+            'Cliente_Telefono': telefono,
+            'Cliente_Banco': banco or '',
+            'Cliente_Kiron': kiron or '',
+            'Cliente_Entrada': entrada,
+            'Cliente_Precio': cliente_precio
+        })
+    if grupo:
+        yield grupo
+
+def _stream_csv(compania_id: int):
+    # Sesión propia: la de la petición ya está cerrada cuando se envía el cuerpo
+    db = SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=COLUMNAS_EXPORT)
+        buffer.write('\ufeff')  # BOM para que Excel detecte UTF-8 (acentos, Ñ)
+        writer.writeheader()
+        for grupo in filas_export_por_piso(db, compania_id):
+            writer.writerows(grupo)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    finally:
+        db.close()
+
+def _stream_xlsx(compania_id: int):
+    # Zip escrito en streaming (xlsx_stream): los primeros bytes salen con las primeras filas
+    db = SessionLocal()
+    try:
+        lotes = (
+            [[fila[columna] for columna in COLUMNAS_EXPORT] for fila in grupo]
+            for grupo in filas_export_por_piso(db, compania_id)
+        )
+        yield from stream_xlsx(COLUMNAS_EXPORT, lotes, hoja="Matches")
+    finally:
+        db.close()
+
+def _stream_json(compania_id: int, fecha_generacion: datetime):
+    # Mismo objeto que antes, pero 'datos' se escribe piso a piso y
+    # total_registros va al final (se conoce al terminar)
+    db = SessionLocal()
+    try:
+        yield b'{"compania_id":' + orjson_dumps(compania_id) + b',"fecha_generacion":' + \
+            orjson_dumps(fecha_generacion.isoformat()) + b',"datos":['
+        total = 0
+        for grupo in filas_export_por_piso(db, compania_id):
+            cuerpo = orjson_dumps(grupo)[1:-1]  # Filas del grupo sin los corchetes
+            yield (b"," if total else b"") + cuerpo
+            total += len(grupo)
+        yield b'],"total_registros":' + orjson_dumps(total) + b'}'
+    finally:
+        db.close()
 
 @router.get("/download-excel")
-async def download_matches_excel(db: Session = Depends(get_db), current_user = Depends(require_supervisor)):
-    """Descargar todos los matches de la compañía en formato Excel - SOLO Supervisores"""
+def download_matches_excel(
+    formato: str = Query("json", pattern="^(json|xlsx|csv)$"),
+    db: Session = Depends(get_db),
+    current_user = Depends(require_supervisor)
+):
+    """Descargar todos los matches de la compañía en formato Excel - SOLO Supervisores
+
+    formato=json (por defecto) devuelve los datos para que el FrontEnd genere el
+    Excel; formato=xlsx / csv genera el fichero en el servidor y lo envía en streaming.
+    """
     try:
         # Verificar que sea supervisor
         if current_user.rol != "Supervisor":
             raise HTTPException(status_code=403, detail="Solo supervisores pueden descargar reportes")
         
-        # Obtener todos los pisos de la compañía
-        pisos = db.query(Piso).filter(Piso.compania_id == current_user.compania_id).all()
-        
-        # Obtener todos los clientes de la compañía
-        clientes = db.query(Cliente).filter(Cliente.compania_id == current_user.compania_id).all()
-        
-        # Obtener todos los estados de cliente-piso
-        estados = db.query(ClienteEstadoPiso).filter(
-            ClienteEstadoPiso.compania_id == current_user.compania_id
-        ).all()
-        
-        # Crear diccionario para búsqueda rápida de estados
-        estados_dict = {}
-        for estado in estados:
-            key = f"{estado.cliente_id}-{estado.piso_id}"
-            estados_dict[key] = {
-                'estado': estado.estado,
-                'fecha': estado.fecha_actualizacion
-            }
-        
-        # Preparar datos para Excel
-        excel_data = []
-        
-        for piso in pisos:
-            # Calcular matches para este piso
-            piso_matches = []
-            
-            for cliente in clientes:
-                score = calculate_match_score(piso, cliente)
-                if score >= 50:  # Solo matches válidos
-                    # Buscar estado
-                    key = f"{cliente.id}-{piso.id}"
-                    estado_info = estados_dict.get(key, {'estado': 'Pendiente', 'fecha': ''})
-                    
-                    piso_matches.append({
-                        'score': score,
-                        'cliente_nombre': cliente.nombre,
-                        'cliente_telefono': cliente.telefono,
-                        'cliente_banco': cliente.banco or '',
-                        'cliente_kiron': cliente.kiron or '',
-                        'cliente_entrada': cliente.entrada,
-                        'cliente_precio': cliente.precio,
-                        'estado': estado_info['estado'],
-                        'fecha_actualizacion': estado_info['fecha']
-                    })
-            
-            # Ordenar por score descendente
-            piso_matches.sort(key=lambda x: x['score'], reverse=True)
-            
-            # Agregar fila para cada match
-            for i, match in enumerate(piso_matches):
-                row = {
-                    'Piso_Direccion': piso.direccion or f"Piso ID {piso.id}",
-                    'Piso_Zona': piso.zona,
-                    'Piso_Precio': piso.precio,
-                    'Piso_M2': piso.m2,
-                    'Piso_Habitaciones': piso.habitaciones or '',
-                    'Match_Numero': i + 1,
-                    'Compatibilidad': match['score'],
-                    'Estado': match['estado'],
-                    'Fecha_Actualizacion': match['fecha_actualizacion'],
-                    'Cliente_Nombre': match['cliente_nombre'],
-                    'Cliente_Telefono': match['cliente_telefono'],
-                    'Cliente_Banco': match['cliente_banco'],
-                    'Cliente_Kiron': match['cliente_kiron'],
-                    'Cliente_Entrada': match['cliente_entrada'],
-                    'Cliente_Precio': match['cliente_precio']
-                }
-                excel_data.append(row)
-        
-        # Crear Excel en memoria
-        if not excel_data:
+        asegurar_matches_compania(current_user.compania_id)
+        hay_matches = db.query(Match.id).filter(
+            Match.compania_id == current_user.compania_id
+        ).first()
+        if not hay_matches:
             raise HTTPException(status_code=404, detail="No hay datos de matches para exportar")
         
-        # Preparar respuesta como JSON (el FrontEnd lo convertirá a Excel)
-        response_data = {
-            'compania_id': current_user.compania_id,
-            'fecha_generacion': datetime.now().isoformat(),
-            'total_registros': len(excel_data),
-            'datos': excel_data
-        }
-        
-        return response_data
+        fecha_generacion = datetime.now()
+        nombre_fichero = f"matches_{current_user.compania_id}_{fecha_generacion.strftime('%Y%m%d_%H%M%S')}"
+        
+        if formato == "csv":
+            return StreamingResponse(
+                _stream_csv(current_user.compania_id),
+                media_type="text/csv; charset=utf-8",
+                headers={"Content-Disposition": f'attachment; filename="{nombre_fichero}.csv"'}
+            )
+        
+        if formato == "xlsx":
+            return StreamingResponse(
+                _stream_xlsx(current_user.compania_id),
+                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                headers={"Content-Disposition": f'attachment; filename="{nombre_fichero}.xlsx"'}
+            )
+        
+        # JSON (el FrontEnd lo convertirá a Excel), también en streaming y con orjson
+        return StreamingResponse(
+            _stream_json(current_user.compania_id, fecha_generacion),
+            media_type="application/json"
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         import logging
         logging.error(f"Error generating Excel: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generando reporte: {str(e)}")
 
+@router.post("/recalcular")
+def recalcular_matches(db: Session = Depends(get_db), current_user = Depends(require_supervisor)):
+    """Recalcular desde cero todos los matches de la compañía - SOLO Supervisores
+
+    La matriz pisos x clientes se reparte entre varios procesos (match_store).
+    """
+    try:
+        total = reconstruir_matches_compania(db, current_user.compania_id)
+        db.commit()
+        return {
+            'compania_id': current_user.compania_id,
+            'total_matches': total,
+            'fecha_calculo': datetime.now().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        import logging
+        logging.error(f"Error recalculando matches: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error recalculando matches: {str(e)}")
+
 @router.get("/supervisor-dashboard")
 def get_supervisor_dashboard(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
     """
@@ -723,82 +769,8 @@ def get_supervisor_dashboard(db: Session = Depends(get_db), current_user=Depends
         raise HTTPException(status_code=403, detail="Acceso denegado. Solo supervisores pueden acceder.")
     
     try:
-        # Obtener todos los usuarios (asesores y supervisores) de la misma compañía
-        usuarios_compania = db.query(Usuario).filter(
-            Usuario.compania_id == current_user.compania_id
-        ).all()
-        
-        dashboard_data = []
-        
-        for usuario in usuarios_compania:
-            # Obtener todos los clientes asignados a este usuario
-            clientes_usuario = db.query(Cliente).filter(
-                Cliente.asesor_id == usuario.id,
-                Cliente.compania_id == current_user.compania_id
-            ).all()
-            
-            # IDs de clientes del usuario
-            cliente_ids = [c.id for c in clientes_usuario]
-            
-            if not cliente_ids:
-                # Si no tiene clientes asignados, mostrar con ceros
-                dashboard_data.append({
-                    'asesor_email': usuario.email,
-                    'asesor_nombre': usuario.email.split('@')[0],
-                    'asesor_rol': usuario.rol,
-                    'total_clientes': 0,
-                    'pendiente': 0,
-                    'cita_venta_puesta': 0,
-                    'descarta': 0,
-                    'no_contesta': 0
-                })
-                continue
-            
-            # Obtener todos los estados de los matches de estos clientes
-            estados_matches = db.query(ClienteEstadoPiso).filter(
-                ClienteEstadoPiso.cliente_id.in_(cliente_ids),
-                ClienteEstadoPiso.compania_id == current_user.compania_id
-            ).all()
-            
-            # Crear un set de clientes que tienen al menos un match registrado
-            clientes_con_matches = set()
-            
-            # Contar clientes únicos por estado
-            clientes_con_pendiente = set()
-            clientes_con_cita = set()
-            clientes_con_descarta = set()
-            clientes_con_no_contesta = set()
-            
-            for estado_match in estados_matches:
-                clientes_con_matches.add(estado_match.cliente_id)
-                if estado_match.estado == "Pendiente":
-                    clientes_con_pendiente.add(estado_match.cliente_id)
-                elif estado_match.estado == "Cita Venta Puesta":
-                    clientes_con_cita.add(estado_match.cliente_id)
-                elif estado_match.estado == "Descarta":
-                    clientes_con_descarta.add(estado_match.cliente_id)
-                elif estado_match.estado == "No Contesta":
-                    clientes_con_no_contesta.add(estado_match.cliente_id)
-            
-            # CLAVE: Los clientes sin matches se consideran "Pendiente" por defecto
-            clientes_sin_matches = set(cliente_ids) - clientes_con_matches
-            clientes_con_pendiente.update(clientes_sin_matches)
-            
-            total_clientes = len(clientes_usuario)
-            
-            dashboard_data.append({
-                'asesor_email': usuario.email,
-                'asesor_nombre': usuario.email.split('@')[0],
-                'asesor_rol': usuario.rol,
-                'total_clientes': total_clientes,
-                'pendiente': len(clientes_con_pendiente),
-                'cita_venta_puesta': len(clientes_con_cita),
-                'descarta': len(clientes_con_descarta),
-                'no_contesta': len(clientes_con_no_contesta)
-            })
-        
-        # Ordenar por total de clientes pendientes (descendente)
-        dashboard_data.sort(key=lambda x: x['pendiente'], reverse=True)
+        # Una consulta agrupada por usuario, cacheada por compañía (ver dashboard.py)
+        dashboard_data = dashboard_compania(db, current_user.compania_id)
         
         return {
             'compania_id': current_user.compania_id,
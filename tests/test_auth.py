@@ -0,0 +1,57 @@
+"""Refresh tokens: rotación en cada uso y revocación de la familia al reutilizar uno rotado."""
+import pytest
+
+import auth
+from models import RefreshToken, SessionLocal
+
+
+@pytest.fixture
+def sesion(api):
+    """Issue tokens for the supervisor as a fresh login would; they are deleted afterwards."""
+    db = SessionLocal()
+
+    def login():
+        return auth.emitir_tokens(db, api.supervisor)["refresh_token"]
+
+    try:
+        yield login
+    finally:
+        db.query(RefreshToken).filter(RefreshToken.usuario_id == api.supervisor.id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+
+def refrescar(api, token):
+    return api.http.post("/auth/refresh", json={"refresh_token": token})
+
+
+def test_rota_en_cada_uso(api, sesion):
+    token = sesion()
+    respuesta = refrescar(api, token)
+    assert respuesta.status_code == 200
+    nuevo = respuesta.json()["refresh_token"]
+    assert nuevo != token
+    assert respuesta.json()["access_token"]
+    assert refrescar(api, nuevo).status_code == 200
+
+
+def test_reutilizar_revoca_la_familia(api, sesion):
+    robado = sesion()
+    otro_dispositivo = sesion()
+    legitimo = refrescar(api, robado).json()["refresh_token"]
+
+    assert refrescar(api, robado).status_code == 401
+    # El último token de la cadena también queda revocado
+    assert refrescar(api, legitimo).status_code == 401
+    # Las sesiones de otros logins no se tocan
+    assert refrescar(api, otro_dispositivo).status_code == 200
+
+
+def test_logout_revoca_la_sesion(api, sesion):
+    token = sesion()
+    assert api.http.post("/auth/logout", json={"refresh_token": token}).status_code == 200
+    assert refrescar(api, token).status_code == 401
+
+
+def test_token_desconocido(api):
+    assert refrescar(api, "no-existe").status_code == 401
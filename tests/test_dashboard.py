@@ -0,0 +1,71 @@
+"""Caché del panel de supervisión: versión de datos, TTL e invalidación."""
+import pytest
+
+import dashboard
+
+COMPANIA = 1
+
+
+class _BD:
+    """Only what dashboard_compania reads from the session: the data_version."""
+
+    def __init__(self):
+        self.version = 1
+
+    def scalar(self, _consulta):
+        return self.version
+
+
+@pytest.fixture
+def calculos(monkeypatch):
+    llamadas = []
+
+    def estadisticas(db, compania_id):
+        llamadas.append(compania_id)
+        return [{"calculo": len(llamadas)}]
+
+    monkeypatch.setattr(dashboard, "estadisticas_asesores", estadisticas)
+    monkeypatch.setattr(dashboard, "_cache", {})
+    monkeypatch.setattr(dashboard, "_generaciones", {})
+    return llamadas
+
+
+def test_misma_version_usa_la_cache(calculos):
+    db = _BD()
+    primero = dashboard.dashboard_compania(db, COMPANIA)
+    assert dashboard.dashboard_compania(db, COMPANIA) is primero
+    assert len(calculos) == 1
+
+
+def test_otra_version_recalcula(calculos):
+    db = _BD()
+    dashboard.dashboard_compania(db, COMPANIA)
+    db.version += 1  # Escritura en otro worker
+    assert dashboard.dashboard_compania(db, COMPANIA) == [{"calculo": 2}]
+
+
+def test_invalidar_recalcula(calculos):
+    db = _BD()
+    dashboard.dashboard_compania(db, COMPANIA)
+    dashboard.invalidar_dashboard(COMPANIA)
+    assert dashboard.dashboard_compania(db, COMPANIA) == [{"calculo": 2}]
+
+
+def test_ttl_caducado_recalcula(calculos, monkeypatch):
+    monkeypatch.setattr(dashboard, "DASHBOARD_CACHE_TTL", -1)
+    db = _BD()
+    dashboard.dashboard_compania(db, COMPANIA)
+    dashboard.dashboard_compania(db, COMPANIA)
+    assert len(calculos) == 2
+
+
+def test_invalidado_durante_el_calculo_no_se_guarda(calculos, monkeypatch):
+    def estadisticas(db, compania_id):
+        calculos.append(compania_id)
+        dashboard.invalidar_dashboard(compania_id)  # Cambio de estado mientras se calculaba
+        return [{"calculo": len(calculos)}]
+
+    monkeypatch.setattr(dashboard, "estadisticas_asesores", estadisticas)
+    db = _BD()
+    assert dashboard.dashboard_compania(db, COMPANIA) == [{"calculo": 1}]
+    assert COMPANIA not in dashboard._cache
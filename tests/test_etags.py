@@ -0,0 +1,31 @@
+"""GET condicional (ETag / If-None-Match) de los listados."""
+import pytest
+
+
+@pytest.mark.parametrize("ruta", ["/pisos/", "/clientes/"])
+def test_304_si_no_ha_cambiado(api, ruta):
+    primera = api.http.get(ruta)
+    assert primera.status_code == 200
+    etag = primera.headers["ETag"]
+
+    segunda = api.http.get(ruta, headers={"If-None-Match": etag})
+    assert segunda.status_code == 304
+    assert segunda.content == b""
+    assert segunda.headers["ETag"] == etag
+
+    # Lista de candidatos y comparación débil (sin W/)
+    tercera = api.http.get(ruta, headers={"If-None-Match": f'"otro", {etag.removeprefix("W/")}'})
+    assert tercera.status_code == 304
+
+
+def test_una_escritura_cambia_el_etag(api):
+    etag = api.http.get("/pisos/").headers["ETag"]
+    piso_id = api.http.get("/pisos/", params={"limit": 1}).json()[0]["id"]
+
+    assert api.http.put(f"/pisos/{piso_id}/paralizar").status_code == 200
+    try:
+        respuesta = api.http.get("/pisos/", headers={"If-None-Match": etag})
+        assert respuesta.status_code == 200
+        assert respuesta.headers["ETag"] != etag
+    finally:
+        assert api.http.put(f"/pisos/{piso_id}/paralizar").status_code == 200  # Deshacer
@@ -0,0 +1,69 @@
+"""Paginación por cursor (keyset), filtros y fields= de los listados de pisos y clientes."""
+import pytest
+from fastapi import HTTPException, Response
+
+from listados import CABECERA_CURSOR, Paginacion, campos_solicitados, recortar_pagina
+
+
+class _Fila:
+    def __init__(self, id):
+        self.id = id
+
+
+def test_recortar_pagina_con_pagina_siguiente():
+    response = Response()
+    filas = recortar_pagina([_Fila(i) for i in (3, 5, 8, 9)], Paginacion(limit=3), response)
+    assert [fila.id for fila in filas] == [3, 5, 8]
+    assert response.headers[CABECERA_CURSOR] == "8"
+
+
+def test_recortar_pagina_ultima_pagina_sin_cursor():
+    response = Response()
+    filas = recortar_pagina([_Fila(i) for i in (3, 5, 8)], Paginacion(limit=3), response)
+    assert [fila.id for fila in filas] == [3, 5, 8]
+    assert CABECERA_CURSOR not in response.headers
+
+
+def test_campos_solicitados():
+    assert campos_solicitados(None, {"id", "zona"}) is None
+    assert campos_solicitados("zona, id,zona", {"id", "zona"}) == ["id", "zona"]
+    with pytest.raises(HTTPException) as error:
+        campos_solicitados("zona,secreto", {"id", "zona"})
+    assert error.value.status_code == 400
+
+
+def _recorrer(api, ruta: str, **params) -> list:
+    """Follow X-Next-Cursor page by page; returns every id seen, in order."""
+    ids, cursor, paginas = [], None, 0
+    while True:
+        respuesta = api.http.get(ruta, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert respuesta.status_code == 200
+        pagina = respuesta.json()
+        assert len(pagina) <= params["limit"]
+        ids.extend(fila["id"] for fila in pagina)
+        paginas += 1
+        cursor = respuesta.headers.get(CABECERA_CURSOR)
+        if not cursor:
+            return ids
+        assert paginas < 1000
+
+
+@pytest.mark.parametrize("ruta", ["/pisos/", "/clientes/"])
+def test_paginas_cubren_el_listado_completo(api, ruta):
+    completo = [fila["id"] for fila in api.http.get(ruta).json()]
+    assert completo == sorted(completo)
+    assert len(completo) > 7
+    assert _recorrer(api, ruta, limit=7) == completo
+
+
+@pytest.mark.parametrize("ruta", ["/pisos/", "/clientes/"])
+def test_paginas_con_filtros(api, ruta):
+    filtros = {"precio_min": 100000, "m2_min": 60}
+    completo = [fila["id"] for fila in api.http.get(ruta, params=filtros).json()]
+    assert len(completo) > 5
+    assert _recorrer(api, ruta, limit=5, **filtros) == completo
+
+
+def test_fields_proyecta_columnas(api):
+    filas = api.http.get("/pisos/", params={"fields": "zona,precio", "limit": 3}).json()
+    assert filas and all(set(fila) == {"id", "zona", "precio"} for fila in filas)
@@ -0,0 +1,55 @@
+"""El scorer NumPy (match_batch) debe dar exactamente lo mismo que el escalar."""
+import pytest
+
+from benchmarks.generador import generar_clientes, generar_pisos
+from match_batch import ClienteBatch, PisoBatch, score_cliente_against_pisos, score_piso_against_clientes
+from match_profiles import cliente_profile, piso_profile
+from routers.match import calculate_match_score_with_details
+
+SEED = 7
+
+
+@pytest.fixture(scope="module")
+def perfiles():
+    clientes = [cliente_profile(cliente) for cliente in generar_clientes(300, SEED)]
+    pisos = [piso_profile(piso) for piso in generar_pisos(40, SEED)]
+    return pisos, clientes
+
+
+def _escalar(piso, cliente):
+    return calculate_match_score_with_details(piso, cliente)
+
+
+@pytest.mark.parametrize("min_score", [1, 50, 80])
+def test_piso_contra_clientes_igual_que_escalar(perfiles, min_score):
+    pisos, clientes = perfiles
+    batch = ClienteBatch(clientes)
+    for piso in pisos:
+        esperado = []
+        for cliente in clientes:
+            score, penalizaciones = _escalar(piso, cliente)
+            if score >= min_score:
+                esperado.append((cliente.id, score, penalizaciones))
+        assert score_piso_against_clientes(piso, batch, min_score) == esperado
+
+
+@pytest.mark.parametrize("min_score", [1, 50, 80])
+def test_cliente_contra_pisos_igual_que_escalar(perfiles, min_score):
+    pisos, clientes = perfiles
+    batch = PisoBatch(pisos)
+    for cliente in clientes:
+        esperado = []
+        for piso in pisos:
+            score, penalizaciones = _escalar(piso, cliente)
+            if score >= min_score:
+                esperado.append((piso.id, score, penalizaciones))
+        assert score_cliente_against_pisos(cliente, batch, min_score) == esperado
+
+
+def test_hay_pares_por_encima_y_por_debajo_del_minimo(perfiles):
+    # Sin esto los tests de arriba podrían pasar con listas vacías
+    pisos, clientes = perfiles
+    scores = [_escalar(piso, cliente)[0] for piso in pisos for cliente in clientes]
+    assert any(score >= 80 for score in scores)
+    assert any(0 < score < 50 for score in scores)
+    assert any(score == 0 for score in scores)
@@ -0,0 +1,59 @@
+"""Paginación por cursor (score, id) de GET /match/."""
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from models import Match, Piso, SessionLocal
+from routers.match import codificar_cursor, decodificar_cursor
+
+
+def test_cursor_ida_y_vuelta():
+    assert decodificar_cursor(codificar_cursor(87, 1234)) == (87, 1234)
+
+
+@pytest.mark.parametrize("cursor", ["no-es-base64!", "W10=", "WyJhIiwgMV0="])
+def test_cursor_invalido(cursor):
+    # "W10=" es [] y "WyJhIiwgMV0=" es ["a", 1]
+    with pytest.raises(HTTPException) as error:
+        decodificar_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def _con_mas_matches(api, columna):
+    """Id (piso or cliente) of the company with the most matches."""
+    db = SessionLocal()
+    try:
+        consulta = db.query(columna).join(Piso, Piso.id == Match.piso_id).filter(
+            Piso.compania_id == api.compania_id, Piso.paralizado != "SÍ"
+        ).group_by(columna).order_by(func.count().desc(), columna)
+        return consulta.first()[0]
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("parametro, columna, otro_lado", [
+    ("piso_id", Match.piso_id, "cliente_id"),
+    ("cliente_id", Match.cliente_id, "piso_id"),
+])
+def test_paginas_cubren_todos_los_matches(api, parametro, columna, otro_lado):
+    params = {parametro: _con_mas_matches(api, columna)}
+    completo = api.http.get("/match/", params=params).json()
+    assert len(completo) > 3
+    assert [m["score"] for m in completo] == sorted((m["score"] for m in completo), reverse=True)
+
+    vistos, cursor = [], None
+    while True:
+        respuesta = api.http.get("/match/", params={**params, "limit": 3, **({"cursor": cursor} if cursor else {})})
+        assert respuesta.status_code == 200
+        vistos.extend(respuesta.json())
+        cursor = respuesta.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        assert len(vistos) <= len(completo)
+    assert [(m[otro_lado], m["score"]) for m in vistos] == [(m[otro_lado], m["score"]) for m in completo]
+
+
+def test_cursor_invalido_en_el_endpoint(api):
+    piso_id = _con_mas_matches(api, Match.piso_id)
+    respuesta = api.http.get("/match/", params={"piso_id": piso_id, "cursor": "basura"})
+    assert respuesta.status_code == 400
@@ -0,0 +1,61 @@
+"""Bitmask de penalizaciones y matriz completa de la tabla matches."""
+import pytest
+
+import match_store
+from benchmarks.generador import generar_clientes, generar_pisos
+from match_profiles import cliente_profile, piso_profile
+from match_store import CRITERIOS, calcular_matriz_matches, decode_penalizaciones, encode_penalizaciones
+from routers.match import calculate_match_score_with_details
+
+SEED = 11
+
+
+@pytest.fixture(scope="module")
+def perfiles():
+    clientes = [cliente_profile(cliente) for cliente in generar_clientes(200, SEED)]
+    pisos = [piso_profile(piso) for piso in generar_pisos(30, SEED)]
+    return pisos, clientes
+
+
+@pytest.mark.parametrize("criterio", CRITERIOS)
+@pytest.mark.parametrize("penalty", [5, 10])
+def test_bitmask_ida_y_vuelta_por_criterio(criterio, penalty):
+    penalizaciones = {criterio: {'penalty': penalty, 'color': 'red' if penalty >= 10 else 'yellow'}}
+    assert decode_penalizaciones(encode_penalizaciones(penalizaciones)) == penalizaciones
+
+
+def test_bitmask_ida_y_vuelta_con_penalizaciones_reales(perfiles):
+    pisos, clientes = perfiles
+    vistas = 0
+    for piso in pisos:
+        for cliente in clientes:
+            _, penalizaciones = calculate_match_score_with_details(piso, cliente)
+            assert decode_penalizaciones(encode_penalizaciones(penalizaciones)) == penalizaciones
+            vistas += len(penalizaciones) > 1
+    assert vistas  # Combinaciones de varios criterios, no solo casos sueltos
+
+
+def _esperado(pisos, clientes):
+    filas = []
+    for piso in pisos:
+        for cliente in clientes:
+            score, penalizaciones = calculate_match_score_with_details(piso, cliente)
+            if score >= match_store.MIN_SCORE:
+                filas.append((piso.id, cliente.id, score, encode_penalizaciones(penalizaciones)))
+    return filas
+
+
+def test_matriz_secuencial_igual_que_escalar(perfiles):
+    pisos, clientes = perfiles
+    assert calcular_matriz_matches(pisos, clientes, workers=1) == _esperado(pisos, clientes)
+
+
+def test_matriz_en_paralelo_igual_que_secuencial(perfiles, monkeypatch):
+    pisos, clientes = perfiles
+    monkeypatch.setattr(match_store, "MATCH_PARALLEL_MIN_PARES", 0)
+    try:
+        # Dos veces: la segunda reutiliza el pool y los workers cambian de clientes
+        assert calcular_matriz_matches(pisos, clientes, workers=2) == _esperado(pisos, clientes)
+        assert calcular_matriz_matches(pisos, clientes[:50], workers=2) == _esperado(pisos, clientes[:50])
+    finally:
+        match_store.cerrar_pools_matching()
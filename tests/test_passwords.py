@@ -0,0 +1,73 @@
+"""Executor de bcrypt: rechazo con 503 al llenarse la cola y recorte a 72 bytes."""
+import asyncio
+import threading
+from threading import BoundedSemaphore
+
+import pytest
+from fastapi import HTTPException
+
+import passwords
+
+
+@pytest.fixture
+def rapido(monkeypatch):
+    # Coste mínimo de bcrypt: aquí interesa el comportamiento, no el tiempo
+    monkeypatch.setattr(passwords, "pwd_context", passwords.pwd_context.copy(bcrypt__rounds=4))
+
+
+def test_cola_llena_responde_503(monkeypatch):
+    monkeypatch.setattr(passwords, "_plazas", BoundedSemaphore(1))
+    rechazadas = passwords._estadisticas["verify"]["rechazadas"]
+    empezado, seguir = threading.Event(), threading.Event()
+
+    def lento():
+        empezado.set()
+        seguir.wait(5)
+        return True
+
+    async def escenario():
+        primero = asyncio.ensure_future(passwords._ejecutar("verify", lento))
+        await asyncio.get_running_loop().run_in_executor(None, empezado.wait, 5)
+        with pytest.raises(HTTPException) as exc:
+            await passwords._ejecutar("verify", lento)
+        seguir.set()
+        assert await primero is True
+        return exc.value
+
+    error = asyncio.run(escenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == str(passwords.PASSWORD_HASH_RETRY_AFTER)
+    assert passwords._estadisticas["verify"]["rechazadas"] == rechazadas + 1
+    assert passwords._en_curso == 0
+    # La plaza vuelve a quedar libre al terminar el trabajo
+    assert passwords._plazas.acquire(blocking=False)
+    passwords._plazas.release()
+
+
+def test_hash_y_verify(rapido):
+    async def escenario():
+        hashed = await passwords.hash_password("secreto")
+        return (
+            await passwords.verify_password("secreto", hashed),
+            await passwords.verify_password("otro", hashed),
+        )
+
+    assert asyncio.run(escenario()) == (True, False)
+    assert passwords._en_curso == 0
+
+
+def test_recorte_en_bytes(rapido):
+    # 50 "ñ" son 100 bytes en UTF-8: sin recortar en bytes bcrypt rechazaría la contraseña
+    larga = "ñ" * 50
+    assert len(passwords._truncar(larga)) == passwords.MAX_PASSWORD_BYTES
+
+    async def escenario():
+        hashed = await passwords.hash_password(larga)
+        return (
+            await passwords.verify_password(larga, hashed),
+            # Solo cuentan los primeros 72 bytes
+            await passwords.verify_password(larga + "x", hashed),
+            await passwords.verify_password("ñ" * 35, hashed),
+        )
+
+    assert asyncio.run(escenario()) == (True, True, False)
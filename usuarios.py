@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from models import get_db, Usuario
+from models import get_async_db, Usuario
 from utils import get_current_user
 
 router = APIRouter(prefix="/usuarios", tags=["usuarios"])
@@ -13,9 +14,10 @@ class UsuarioResponse(BaseModel):
     compania_id: int
 
 @router.get("/", response_model=list[UsuarioResponse])
-def get_usuarios(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_usuarios(db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
     # Solo Supervisores pueden ver la lista de usuarios
     if current_user.rol != "Supervisor":
         raise HTTPException(status_code=403, detail="Se requieren permisos de Supervisor")
     
-    return db.query(Usuario).filter(Usuario.compania_id == current_user.compania_id).all()
+    usuarios = await db.scalars(select(Usuario).filter(Usuario.compania_id == current_user.compania_id))
+    return usuarios.all()
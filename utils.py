@@ -1,9 +1,15 @@
 import os
+import time
+from datetime import datetime
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Optional, Tuple
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
-from models import get_db, Usuario
+from models import SessionLocal, Usuario, RefreshToken
+from metrics import set_tenant
 
 def get_secret_key():
     service_name = os.getenv("RENDER_SERVICE_NAME", "")
@@ -19,23 +25,92 @@ ALGORITHM = "HS256"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Caché en proceso de los datos de autorización de cada usuario: evita una
+# consulta a Postgres por petición. Un cambio de rol o un borrado se ven como
+# mucho AUTH_CACHE_TTL segundos después; revocar_sesiones() es inmediato aquí.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated user built from the verified token claims."""
+    id: int
+    email: str
+    rol: str
+    compania_id: int
+    token_version: int = 0
+
+    def usuario(self, db: Session) -> Usuario:
+        """Load the full ORM row, for the endpoints that need it."""
+        return db.get(Usuario, self.id)
+
+_usuarios_cache: Dict[int, Tuple[float, Optional[Principal]]] = {}
+_usuarios_lock = Lock()
+
+def _cargar_principal(user_id: int) -> Optional[Principal]:
+    ahora = time.monotonic()
+    entrada = _usuarios_cache.get(user_id)
+    if entrada is not None and entrada[0] > ahora:
+        return entrada[1]
+    
+    db = SessionLocal()
+    try:
+        fila = db.query(
+            Usuario.email, Usuario.rol, Usuario.compania_id, Usuario.token_version
+        ).filter(Usuario.id == user_id).first()
+    finally:
+        db.close()
+    
+    # Los usuarios inexistentes también se cachean: un token de un usuario
+    # borrado no vuelve a consultar la BD en cada petición
+    principal = Principal(
+        id=user_id,
+        email=fila.email,
+        rol=fila.rol,
+        compania_id=fila.compania_id,
+        token_version=fila.token_version or 0
+    ) if fila else None
+    with _usuarios_lock:
+        _usuarios_cache[user_id] = (ahora + AUTH_CACHE_TTL, principal)
+    return principal
+
+def invalidar_usuario(user_id: int):
+    """Drop a user from the auth cache (role change, deletion...)."""
+    with _usuarios_lock:
+        _usuarios_cache.pop(user_id, None)
+
+def revocar_sesiones(db: Session, user_id: int):
+    """Invalidate every access and refresh token issued to a user so far (caller commits)."""
+    db.query(Usuario).filter(Usuario.id == user_id).update(
+        {Usuario.token_version: Usuario.token_version + 1}, synchronize_session=False
+    )
+    db.query(RefreshToken).filter(
+        RefreshToken.usuario_id == user_id,
+        RefreshToken.revocado_en.is_(None)
+    ).update({RefreshToken.revocado_en: datetime.utcnow()}, synchronize_session=False)
+    invalidar_usuario(user_id)
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         compania_id: int = payload.get("compania_id")
         user_id: int = payload.get("user_id")
-        rol: str = payload.get("rol")
         if email is None or compania_id is None or user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = db.query(Usuario).filter(Usuario.email == email).first()
-        if user is None:
+        principal = _cargar_principal(user_id)
+        if principal is None or principal.email != email:
             raise HTTPException(status_code=401, detail="User not found")
-        return user
+        # Tokens anteriores a la revocación (sin "ver" = emitidos antes de existir)
+        if payload.get("ver", 0) != principal.token_version:
+            raise HTTPException(status_code=401, detail="Token revoked")
+        set_tenant(principal.compania_id)
+        # Rol y compañía salen de la BD (cacheada), no del token: un cambio de
+        # rol se aplica sin esperar a que caduque el token
+        return principal
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def require_supervisor(current_user: Usuario = Depends(get_current_user)):
+def require_supervisor(current_user: Principal = Depends(get_current_user)):
     if current_user.rol != "Supervisor":
         raise HTTPException(status_code=403, detail="Se requieren permisos de Supervisor")
     return current_user
@@ -0,0 +1,154 @@
+"""
+Escritura de un .xlsx de una sola hoja en streaming.
+
+openpyxl (incluso en modo write-only) no produce ni un byte hasta wb.save():
+el zip se monta al final. Aquí el zip se escribe sobre un destino no
+posicionable (zipfile usa entonces descriptores de datos) y la hoja se
+comprime a medida que llegan las filas, así que cada lote de filas sale al
+cliente enseguida y la memoria no depende del tamaño del fichero.
+
+Solo lo necesario para el export: celdas de texto (inlineStr) y numéricas,
+una hoja de estilos mínima (un único estilo "Normal", que algunos lectores
+exigen) y sin tabla de cadenas compartidas.
+"""
+import math
+import re
+import zipfile
+from typing import Iterable, Iterator, List, Sequence
+from xml.sax.saxutils import escape
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{nombre}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+_ESTILOS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_HOJA_INICIO = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_HOJA_FIN = '</sheetData></worksheet>'
+
+# Caracteres de control que XML 1.0 no admite (openpyxl los rechaza)
+_ILEGALES = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _Salida:
+    """Unseekable sink for ZipFile: accumulates bytes until the caller takes them."""
+
+    def __init__(self):
+        self._trozos: List[bytes] = []
+
+    def write(self, datos: bytes) -> int:
+        self._trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def recoger(self) -> bytes:
+        datos = b"".join(self._trozos)
+        self._trozos.clear()
+        return datos
+
+
+def _columna(indice: int) -> str:
+    letras = ""
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _celda(referencia: str, valor) -> str:
+    # NaN / inf no tienen representación en <v>: Excel tendría que reparar el fichero
+    if valor is None or (isinstance(valor, float) and not math.isfinite(valor)):
+        return ""
+    if isinstance(valor, bool):
+        return f'<c r="{referencia}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float)):
+        return f'<c r="{referencia}"><v>{valor!r}</v></c>'
+    texto = escape(_ILEGALES.sub("", str(valor)))
+    return f'<c r="{referencia}" t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def stream_xlsx(cabecera: Sequence[str], lotes: Iterable[Iterable[Sequence]], hoja: str = "Hoja1") -> Iterator[bytes]:
+    """Yield the bytes of an .xlsx with `cabecera` and then the rows of each lote.
+
+    Whatever the compressor has produced is yielded after each lote, so the
+    first bytes leave as soon as the first rows are compressed.
+    """
+    columnas = [_columna(i) for i in range(len(cabecera))]
+    salida = _Salida()
+    with zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(nombre=escape(hoja, {'"': "&quot;"})))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        zf.writestr("xl/styles.xml", _ESTILOS)
+
+        with zf.open("xl/worksheets/sheet1.xml", "w") as hoja_xml:
+            numero = 1
+            hoja_xml.write((_HOJA_INICIO + "".join(
+                ['<row r="1">'] + [_celda(f"{c}1", v) for c, v in zip(columnas, cabecera)] + ["</row>"]
+            )).encode("utf-8"))
+            for lote in lotes:
+                partes = []
+                for fila in lote:
+                    numero += 1
+                    partes.append(f'<row r="{numero}">')
+                    partes.extend(_celda(f"{c}{numero}", v) for c, v in zip(columnas, fila))
+                    partes.append("</row>")
+                hoja_xml.write("".join(partes).encode("utf-8"))
+                # deflate suelta la salida por bloques: un lote pequeño puede no producir bytes todavía
+                datos = salida.recoger()
+                if datos:
+                    yield datos
+            hoja_xml.write(_HOJA_FIN.encode("utf-8"))
+    yield salida.recoger()